@@ -0,0 +1,468 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+import httpx
+from ollama import AsyncClient, ResponseError
+
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class NoBackendAvailable(ConnectionError):
+    """Every endpoint that could serve the request is unhealthy or has its circuit breaker open."""
+
+
+def is_retryable(error):
+    """True for failures another attempt (possibly on another endpoint) might not hit: network errors and 5xx/429."""
+    if isinstance(error, ResponseError):
+        return error.status_code in RETRYABLE_STATUS
+    return isinstance(error, (ConnectionError, httpx.TransportError, asyncio.TimeoutError, OSError))
+
+
+class OllamaBackend:
+    """An Ollama server. Responses are passed through from ollama.AsyncClient unchanged."""
+
+    def __init__(self, host=None, timeout=None):
+        self.client = AsyncClient(host=host, timeout=timeout)
+        self.host = host or os.environ.get('OLLAMA_HOST', 'http://127.0.0.1:11434')
+
+    async def chat(self, **kwargs):
+        return await self.client.chat(**kwargs)
+
+    async def embed(self, **kwargs):
+        return await self.client.embed(**kwargs)
+
+    async def health(self):
+        await self.client.list()
+
+    async def keep_alive(self, model, duration):
+        """Load `model` and keep it loaded for `duration` (seconds or e.g. '10m') from now; 0 unloads it."""
+        await self.client.chat(model=model, messages=[], keep_alive=duration)
+
+
+class OpenAIBackend:
+    """An OpenAI-compatible server (llama.cpp, vLLM, LM Studio...), answering in the same shape as Ollama.
+
+    `host` is the API base URL, usually ending in /v1. Ollama options the server
+    understands (temperature, num_predict, top_p, seed, stop) are translated, and
+    format='json' asks for a JSON object response.
+    """
+
+    OPTION_NAMES = {'temperature': 'temperature', 'num_predict': 'max_tokens', 'top_p': 'top_p',
+                    'seed': 'seed', 'stop': 'stop'}
+
+    def __init__(self, host, api_key=None, timeout=None):
+        self.host = host.rstrip('/')
+        api_key = api_key or os.environ.get('OPENAI_API_KEY')
+        headers = {'Authorization': f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.AsyncClient(base_url=self.host, headers=headers, timeout=timeout)
+
+    async def _post(self, path, body):
+        response = await self.client.post(path, json=body)
+        if response.status_code >= 400:
+            raise ResponseError(response.text, response.status_code)
+        return response.json()
+
+    def _request(self, model, messages, tools, format, options, stream):
+        body = {'model': model, 'messages': list(messages), 'stream': stream}
+        if tools:
+            body['tools'] = tools
+        if format == 'json':
+            body['response_format'] = {'type': 'json_object'}
+        for name, value in (options or {}).items():
+            if name in self.OPTION_NAMES:
+                body[self.OPTION_NAMES[name]] = value
+        return body
+
+    @staticmethod
+    def _tool_calls(calls):
+        converted = []
+        for call in calls:
+            arguments = call['function'].get('arguments') or '{}'
+            if isinstance(arguments, str):
+                try:
+                    arguments = json.loads(arguments)
+                except ValueError:
+                    arguments = {}
+            converted.append({'function': {'name': call['function']['name'], 'arguments': arguments}})
+        return converted
+
+    async def chat(self, model='', messages=None, tools=None, format=None, options=None, stream=False, **kwargs):
+        body = self._request(model, messages or [], tools, format, options, stream)
+        if stream:
+            return self._stream(model, body)
+        data = await self._post('/chat/completions', body)
+        choice = data['choices'][0]['message']
+        message = {'role': 'assistant', 'content': choice.get('content') or ''}
+        if choice.get('tool_calls'):
+            message['tool_calls'] = self._tool_calls(choice['tool_calls'])
+        usage = data.get('usage') or {}
+        return {
+            'model': data.get('model', model),
+            'message': message,
+            'done': True,
+            'prompt_eval_count': usage.get('prompt_tokens'),
+            'eval_count': usage.get('completion_tokens'),
+        }
+
+    async def _stream(self, model, body):
+        calls = {}  # Tool calls arrive in pieces, keyed by index
+        async with self.client.stream('POST', '/chat/completions', json=body) as response:
+            if response.status_code >= 400:
+                raise ResponseError((await response.aread()).decode(), response.status_code)
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                delta = json.loads(data)['choices'][0].get('delta') or {}
+                for call in delta.get('tool_calls') or []:
+                    entry = calls.setdefault(call.get('index', len(calls)), {'function': {'name': '', 'arguments': ''}})
+                    function = call.get('function') or {}
+                    entry['function']['name'] += function.get('name') or ''
+                    entry['function']['arguments'] += function.get('arguments') or ''
+                if delta.get('content'):
+                    yield {'model': model, 'message': {'role': 'assistant', 'content': delta['content']}, 'done': False}
+        message = {'role': 'assistant', 'content': ''}
+        if calls:
+            message['tool_calls'] = self._tool_calls([calls[index] for index in sorted(calls)])
+        yield {'model': model, 'message': message, 'done': True}
+
+    async def embed(self, model='', input='', **kwargs):
+        data = await self._post('/embeddings', {'model': model, 'input': input})
+        return {'model': model, 'embeddings': [item['embedding'] for item in data['data']]}
+
+    async def health(self):
+        response = await self.client.get('/models')
+        response.raise_for_status()
+
+    async def keep_alive(self, model, duration):
+        """OpenAI-compatible servers decide themselves when to load and unload models."""
+
+
+def backend_from_spec(spec, timeout=None):
+    """Create a backend from a host given on the command line: a URL for Ollama, or openai+URL for an OpenAI-compatible server."""
+    if spec.startswith('openai+'):
+        return OpenAIBackend(spec.removeprefix('openai+'), timeout=timeout)
+    return OllamaBackend(spec, timeout=timeout)
+
+
+class CircuitBreaker:
+    """Stops sending requests to an endpoint after `failure_threshold` failures in a row.
+
+    After `reset_timeout` seconds a single trial request is let through
+    (half-open); if it succeeds the breaker closes again, otherwise it reopens.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._trial = False
+
+    def available(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        return not self._trial
+
+    def attempt(self):
+        """Note that a request is being sent; outside the closed state it is the trial request."""
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self._trial = True
+
+    def release(self):
+        """The request ended without saying anything about the endpoint's health (e.g. it was cancelled)."""
+        self._trial = False
+
+    def success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opens += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+
+class Endpoint:
+    """One backend plus what the router knows about it. `models` limits which models it is sent (default: any)."""
+
+    def __init__(self, backend, models=None, failure_threshold=3, reset_timeout=30):
+        self.backend = backend
+        self.name = backend.host
+        self.models = set(models) if models else None
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.healthy = True
+        self.outstanding = 0
+        self.metrics = {'requests': 0, 'failures': 0, 'health_failures': 0}
+
+    def serves(self, model):
+        return self.models is None or model in self.models
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats.update(state=self.breaker.state, healthy=self.healthy, outstanding=self.outstanding)
+        return stats
+
+
+class LLMRouter:
+    """Spreads chat and embedding requests over several model servers.
+
+    Has the same chat()/embed() methods as ollama.AsyncClient, so it can be used
+    in its place. Each request goes to the available endpoint with the fewest
+    requests outstanding (ties broken at random). Network errors and 5xx/429
+    replies are retried up to `retries` times, preferring a different endpoint,
+    after a random delay of up to `backoff` * 2^attempt seconds (full jitter).
+    Endpoints that keep failing are skipped by their circuit breaker, and once
+    start() is called, endpoints failing a health check every `health_interval`
+    seconds are skipped until they pass one again.
+
+    A streamed reply is only retried if it fails before its first part arrives.
+    """
+
+    def __init__(self, endpoints, retries=2, backoff=0.25, max_backoff=2.0, health_interval=15, health_timeout=3):
+        if not endpoints:
+            raise ValueError("LLMRouter needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._health_task = None
+        self.metrics = {'requests': 0, 'retries': 0, 'failed': 0, 'unavailable': 0}
+
+    @classmethod
+    def from_hosts(cls, hosts, timeout=None, **kwargs):
+        """Router over backends given as command line specs (see backend_from_spec); None means the default Ollama."""
+        backends = [backend_from_spec(host, timeout) for host in hosts] if hosts else [OllamaBackend(timeout=timeout)]
+        return cls([Endpoint(backend) for backend in backends], **kwargs)
+
+    def start(self):
+        """Start the background health checks. Must be called from the running event loop."""
+        if len(self.endpoints) > 1 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    async def _check(self, endpoint):
+        try:
+            await asyncio.wait_for(endpoint.backend.health(), self.health_timeout)
+            healthy = True
+        except Exception:
+            healthy = False
+            endpoint.metrics['health_failures'] += 1
+        if healthy != endpoint.healthy:
+            print(f"LLM endpoint {endpoint.name} is {'back up' if healthy else 'not responding'}")
+        endpoint.healthy = healthy
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(self._check(endpoint) for endpoint in self.endpoints))
+            await asyncio.sleep(self.health_interval)
+
+    def _pick(self, model, tried):
+        serving = [endpoint for endpoint in self.endpoints if endpoint.serves(model) and endpoint.breaker.available()]
+        candidates = [endpoint for endpoint in serving if endpoint.healthy and endpoint not in tried]
+        # Rather than fail outright, fall back to endpoints already tried or failing health checks
+        candidates = candidates or [endpoint for endpoint in serving if endpoint.healthy] or serving
+        if not candidates:
+            self.metrics['unavailable'] += 1
+            raise NoBackendAvailable(f"No LLM endpoint available for {model}")
+        least = min(endpoint.outstanding for endpoint in candidates)
+        return random.choice([endpoint for endpoint in candidates if endpoint.outstanding == least])
+
+    def _begin(self, endpoint):
+        endpoint.breaker.attempt()
+        endpoint.outstanding += 1
+        endpoint.metrics['requests'] += 1
+
+    async def _failed(self, endpoint, error, attempt, tried):
+        """Record a failed attempt; returns after the backoff delay if it should be retried, otherwise raises."""
+        if not is_retryable(error):
+            endpoint.breaker.release()
+            raise error
+        endpoint.breaker.failure()
+        endpoint.metrics['failures'] += 1
+        print(f"LLM endpoint {endpoint.name} failed: {error!r}")
+        if attempt >= self.retries:
+            self.metrics['failed'] += 1
+            raise error
+        tried.add(endpoint)
+        self.metrics['retries'] += 1
+        await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    async def _call(self, method, model, kwargs):
+        self.metrics['requests'] += 1
+        tried = set()
+        for attempt in range(self.retries + 1):
+            endpoint = self._pick(model, tried)
+            self._begin(endpoint)
+            try:
+                result = await getattr(endpoint.backend, method)(model=model, **kwargs)
+            except asyncio.CancelledError:
+                endpoint.breaker.release()
+                raise
+            except Exception as e:
+                error = e
+            else:
+                endpoint.breaker.success()
+                return result
+            finally:
+                endpoint.outstanding -= 1
+            await self._failed(endpoint, error, attempt, tried)
+
+    async def _stream(self, model, kwargs):
+        self.metrics['requests'] += 1
+        tried = set()
+        for attempt in range(self.retries + 1):
+            endpoint = self._pick(model, tried)
+            self._begin(endpoint)
+            started = False
+            try:
+                async for part in await endpoint.backend.chat(model=model, stream=True, **kwargs):
+                    if not started:
+                        started = True
+                        endpoint.breaker.success()
+                    yield part
+                if not started:
+                    endpoint.breaker.success()
+                return
+            except (asyncio.CancelledError, GeneratorExit):
+                endpoint.breaker.release()
+                raise
+            except Exception as e:
+                if started:
+                    # Part of the reply has already been used, so it can't be retried
+                    if is_retryable(e):
+                        endpoint.breaker.failure()
+                        endpoint.metrics['failures'] += 1
+                    raise
+                error = e
+            finally:
+                endpoint.outstanding -= 1
+            await self._failed(endpoint, error, attempt, tried)
+
+    async def chat(self, model='', stream=False, **kwargs):
+        if stream:
+            return self._stream(model, kwargs)
+        return await self._call('chat', model, kwargs)
+
+    async def embed(self, model='', **kwargs):
+        return await self._call('embed', model, kwargs)
+
+    async def warm_up(self, model, messages, keep_alive=None):
+        """Load `model` on every server that serves it and prefill `messages` (e.g. a system prompt) into its cache.
+
+        Returns the seconds each server took, by name; servers that fail are printed and left out."""
+        endpoints = [endpoint for endpoint in self.endpoints if endpoint.serves(model)]
+        extra = {} if keep_alive is None else {'keep_alive': keep_alive}
+
+        async def warm(endpoint):
+            start = time.monotonic()
+            try:
+                await endpoint.backend.chat(model=model, messages=messages, options={'num_predict': 1}, **extra)
+            except Exception as e:
+                print(f"Could not warm up {model} on {endpoint.name}: {e!r}")
+                return None
+            return time.monotonic() - start
+
+        timings = await asyncio.gather(*(warm(endpoint) for endpoint in endpoints))
+        return {endpoint.name: seconds for endpoint, seconds in zip(endpoints, timings) if seconds is not None}
+
+    async def keep_alive(self, model, duration):
+        """Ask every server that serves `model` to keep it loaded for `duration` from now; 0 unloads it."""
+        endpoints = [endpoint for endpoint in self.endpoints if endpoint.serves(model)]
+        results = await asyncio.gather(*(endpoint.backend.keep_alive(model, duration) for endpoint in endpoints),
+                                       return_exceptions=True)
+        for endpoint, result in zip(endpoints, results):
+            if isinstance(result, Exception):
+                print(f"Could not set keep-alive for {model} on {endpoint.name}: {result!r}")
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['endpoints'] = {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
+        return stats
+
+
+class ModelKeeper:
+    """Keeps the models loaded while a stream is live and unloads them when it goes offline.
+
+    Ollama unloads a model after five idle minutes by default, so the first question
+    after a quiet spell waits for it to load again. While live, `ping(keep_alive)` is
+    called straight away and then every `interval` seconds, asking for the models to
+    stay loaded for `keep_alive` (longer than the interval). Going offline calls
+    `ping(0)`, which unloads them to free the GPU; so does the first set_live(False),
+    as the models may have been loaded at startup.
+    """
+
+    def __init__(self, ping, interval=120, keep_alive='10m'):
+        self.ping = ping
+        self.interval = interval
+        self.keep_alive = keep_alive
+        self.live = None  # Not known until the first set_live
+        self._task = None
+        self.metrics = {'pings': 0, 'releases': 0}
+
+    async def set_live(self, live):
+        """Start or stop holding the models. Must be called from the running event loop."""
+        if live == self.live:
+            return
+        self.live = live
+        if live:
+            self._task = asyncio.create_task(self._loop())
+            return
+        await self.stop()
+        await self.release()
+
+    async def release(self):
+        """Unload the models."""
+        self.metrics['releases'] += 1
+        try:
+            await self.ping(0)
+        except Exception as e:
+            print(f"Error unloading models: {e}")
+
+    async def _loop(self):
+        while True:
+            self.metrics['pings'] += 1
+            try:
+                await self.ping(self.keep_alive)
+            except Exception as e:
+                print(f"Error keeping models loaded: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        """Stop pinging, leaving the models as they are."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['live'] = int(bool(self.live))
+        return stats
@@ -0,0 +1,39 @@
+import json
+import re
+
+BATCH_INSTRUCTION = """Several chatters asked questions at once. Answer each of these questions separately:
+{questions}
+
+Respond with JSON only, in the form {{"answers": ["answer to question 1", "answer to question 2", ...]}}, one chat reply per question, in order.
+Do not include the chatter's name in the answer. If a question needs an internet search or the current time, use null as its answer."""
+
+
+def batch_instruction(jobs):
+    """The message asking the model to answer every job in a batch in one go."""
+    questions = "\n".join(f"{number}. {', '.join(job.users)}: {job.text}" for number, job in enumerate(jobs, 1))
+    return {'role': 'user', 'content': BATCH_INSTRUCTION.format(questions=questions)}
+
+
+def parse_answers(text, count):
+    """Split a batched reply back into `count` answers. Answers that are missing or unusable are None.
+
+    Accepts the requested {"answers": [...]} as well as a bare list, an object keyed
+    by question number, or "1. ... 2. ..." text if the model ignored the format."""
+    answers = None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        data = data.get('answers', data)
+    if isinstance(data, list):
+        answers = data
+    elif isinstance(data, dict):
+        answers = [data.get(str(number)) for number in range(1, count + 1)]
+    else:
+        numbered = re.split(r"^\s*(\d+)[.):]\s+", text, flags=re.MULTILINE)
+        by_number = {int(numbered[index]): numbered[index + 1] for index in range(1, len(numbered) - 1, 2)}
+        answers = [by_number.get(number) for number in range(1, count + 1)]
+
+    answers = [answer.strip() if isinstance(answer, str) and answer.strip() else None for answer in answers]
+    return (answers + [None] * count)[:count]
@@ -0,0 +1,123 @@
+"""Exercises the LLM router against several local stub model servers.
+
+Balancing: bursts of requests go to one fast and one slow server, spread either
+alternately (round robin) or to the server with the fewest requests outstanding.
+
+Failover: halfway through a run, one of three servers starts answering 503 and
+another is shut down. Requests through a plain client pointed at one of them fail;
+the router retries on the remaining server and its circuit breakers stop sending
+requests to the broken ones.
+
+Finally, the same requests are sent to an OpenAI-compatible endpoint to check the
+translation layer.
+
+    python -m benchmarks.bench_backends --requests 200
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from backends import Endpoint, LLMRouter, OllamaBackend, OpenAIBackend
+from benchmarks.common import percentile
+from benchmarks.stub_ollama import StubOllamaServer
+
+MESSAGES = [{'role': 'user', 'content': 'what game is this?'}]
+
+
+class RoundRobin:
+    """Baseline: alternate between backends without looking at how busy they are."""
+
+    def __init__(self, backends):
+        self._next = itertools.cycle(backends)
+
+    async def chat(self, **kwargs):
+        return await next(self._next).chat(**kwargs)
+
+
+async def burst(client, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await client.chat(model='stub', messages=MESSAGES)
+            except Exception:
+                failures += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, failures, time.perf_counter() - start
+
+
+def report(name, latencies, failures, elapsed):
+    rate = len(latencies) / elapsed if elapsed else 0.0
+    print(f"{name:<18} ok {len(latencies):>4}  failed {failures:>4}  {rate:>7.1f} req/s  "
+          f"p50 {percentile(latencies, 50) * 1000:>7.1f} ms  p99 {percentile(latencies, 99) * 1000:>7.1f} ms")
+
+
+async def balancing(args):
+    with StubOllamaServer(latency=args.latency) as fast, StubOllamaServer(latency=args.latency * 6) as slow:
+        backends = [OllamaBackend(fast.url), OllamaBackend(slow.url)]
+        report('round robin', *await burst(RoundRobin(backends), args.requests, args.concurrency))
+        fast.requests = slow.requests = 0
+        router = LLMRouter([Endpoint(backend) for backend in backends])
+        report('least outstanding', *await burst(router, args.requests, args.concurrency))
+        print(f"  fast server took {fast.requests}, slow server {slow.requests}")
+
+
+async def degrade(args, make_client):
+    """Send half the requests, break two of three servers, then send the rest."""
+    with StubOllamaServer(latency=args.latency) as good, StubOllamaServer(latency=args.latency) as flaky, \
+            StubOllamaServer(latency=args.latency) as doomed:
+        client = make_client(good, flaky, doomed)
+        first_latencies, first_failures, first_elapsed = await burst(client, args.requests // 2, args.concurrency)
+        flaky.status = 503
+        doomed.stop()  # Refuses connections from here on
+        latencies, failures, elapsed = await burst(client, args.requests - args.requests // 2, args.concurrency)
+        return client, (first_latencies + latencies, first_failures + failures, first_elapsed + elapsed)
+
+
+async def failover(args):
+    _, results = await degrade(args, lambda good, flaky, doomed: OllamaBackend(flaky.url))
+    report('single server', *results)
+
+    router, results = await degrade(args, lambda *servers: LLMRouter(
+        [Endpoint(OllamaBackend(server.url)) for server in servers], backoff=0.01))
+    report('router', *results)
+    print(f"  retries {router.metrics['retries']}, breakers opened: "
+          + ", ".join(f"{endpoint.name} {endpoint.breaker.opens}x" for endpoint in router.endpoints))
+
+
+async def openai(args):
+    with StubOllamaServer(latency=args.latency) as server:
+        router = LLMRouter([Endpoint(OpenAIBackend(server.openai_url))])
+        response = await router.chat(model='stub', messages=MESSAGES, options={'temperature': 0.2})
+        streamed = ''
+        async for part in await router.chat(model='stub', messages=MESSAGES, stream=True):
+            streamed += part['message']['content']
+        check = await router.chat(model='stub', messages=MESSAGES, format='json')
+        print(f"openai-compatible  reply {response['message']['content']!r}, streamed {streamed.strip()!r}, "
+              f"check {check['message']['content']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per run (default: 200)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once (default: 8)')
+    parser.add_argument('--latency', type=float, default=0.02, help='Fast stub latency in seconds (default: 0.02)')
+    args = parser.parse_args()
+
+    asyncio.run(balancing(args))
+    asyncio.run(failover(args))
+    asyncio.run(openai(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Replays recorded chat traffic with and without micro-batching of questions.
+
+The model is a FakeGPU: one reply at a time, each costing a fixed overhead, the
+prompt tokens not already in its cache, and the words generated. Bursts of
+questions are then either answered one generation each or, with a batch window,
+several per generation. Reports answers per GPU-second (the throughput of one
+model server during bursts) and the time from question to reply.
+
+    python -m benchmarks.bench_batching --traffic benchmarks/traffic/sample_bursts.jsonl --window 0.3
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.common import load_traffic, make_bot, percentile
+from benchmarks.fakes import FakeChat, FakeGPU, make_message
+from scheduler import ACCEPTED, COALESCED
+
+DEFAULT_TRAFFIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traffic', 'sample_bursts.jsonl')
+
+
+async def replay(traffic, args, window):
+    channels = sorted({record['channel'] for record in traffic})
+    bot = make_bot(channels=channels, workers=args.workers, batch_window=window, max_batch=args.max_batch,
+                   queue_depth=len(traffic))
+    bot.USER_BURST = len(traffic)
+    bot.scheduler.user_burst = len(traffic)
+    bot.llm = FakeGPU(overhead=args.overhead, prefill=args.prefill, token_latency=args.token_latency)
+    bot.chat = FakeChat()
+
+    latencies = []
+    submit = bot.scheduler.submit
+
+    async def timed_submit(*submit_args, **kwargs):
+        asked = time.monotonic()
+        status, job = await submit(*submit_args, **kwargs)
+        if status in (ACCEPTED, COALESCED):
+            job.done.add_done_callback(lambda _: latencies.append(time.monotonic() - asked))
+        return status, job
+
+    bot.scheduler.submit = timed_submit
+    bot.scheduler.start()
+    start = time.monotonic()
+    tasks = []
+    for record in traffic:
+        await asyncio.sleep(max(0.0, start + record['at'] / args.speed - time.monotonic()))
+        message = make_message(record['user'], record['text'], room=record['channel'],
+                               mod=record.get('mod', False), subscriber=record.get('subscriber', False),
+                               vip=record.get('vip', False), broadcaster=record.get('broadcaster', False))
+        tasks.append(asyncio.create_task(bot.on_message(message)))
+    await asyncio.gather(*tasks)
+    while len(latencies) < bot.scheduler.metrics['accepted'] + bot.scheduler.metrics['coalesced']:
+        await asyncio.sleep(0.01)
+    await bot.scheduler.stop()
+    return bot, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--traffic', default=DEFAULT_TRAFFIC, help='Recorded traffic, one JSON message per line')
+    parser.add_argument('--speed', type=float, default=6.0, help='Replay this many times faster than recorded (default: 6)')
+    parser.add_argument('--window', type=float, default=0.3, help='Batch window in seconds (default: 0.3)')
+    parser.add_argument('--max-batch', type=int, default=4, help='Most questions per generation (default: 4)')
+    parser.add_argument('--workers', type=int, default=2, help='Scheduler workers (default: 2)')
+    parser.add_argument('--overhead', type=float, default=0.15, help='Fixed seconds per generation (default: 0.15)')
+    parser.add_argument('--prefill', type=float, default=0.0005, help='Seconds per uncached prompt token (default: 0.0005)')
+    parser.add_argument('--token-latency', type=float, default=0.02, help='Seconds per generated word (default: 0.02)')
+    args = parser.parse_args()
+
+    traffic = load_traffic(args.traffic)
+    print(f"Replaying {len(traffic)} messages over {traffic[-1]['at'] / args.speed:.0f}s")
+    for name, window in (('unbatched', 0.0), ('batched', args.window)):
+        bot, latencies = asyncio.run(replay(traffic, args, window))
+        answers = bot.outbox.metrics['posted']  # Replies, some of which share a chat message
+        gpu = bot.llm.busy_seconds
+        stats = bot.scheduler.stats()
+        print(f"{name:<10} {answers:>4} answers  {bot.llm.calls:>4} generations  GPU busy {gpu:>6.2f}s  "
+              f"{answers / gpu if gpu else 0:>5.1f} answers/GPU-s  "
+              f"p50 {percentile(latencies, 50):.2f}s  p99 {percentile(latencies, 99):.2f}s  "
+              f"avg batch {stats['batch_size_avg']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
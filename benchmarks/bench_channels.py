@@ -0,0 +1,126 @@
+"""Measures what an extra channel costs and whether busy channels crowd out quiet ones.
+
+Memory: a bot is built with one channel, then more are added and each one's
+history is filled to its token budget. The traced allocations per extra channel
+are compared with the resident size of a whole bot process, which is what each
+channel used to cost when every channel needed its own process.
+
+Fairness: one channel floods the shared request queue while a few quiet channels
+ask a single question each. With per-channel turns, the quiet channels are
+answered after roughly one generation instead of waiting behind the flood.
+
+    python -m benchmarks.bench_channels --channels 50 --flood 40
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks.common import ROOT, make_bot, percentile
+from benchmarks.fakes import FakeChat, FakeLLM, make_message
+
+PROCESS_RSS = """
+import resource
+from benchmarks.common import make_bot
+bot = make_bot()
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def fill(channel, bot_name, turns):
+    for turn in range(turns):
+        channel.chat_history.append({'role': 'user', 'content': f"viewer{turn % 9}: what do you think about level {turn}?"})
+        channel.chat_history.append({'role': 'assistant', 'content': f"{bot_name}: level {turn} looks tricky, good luck!"})
+
+
+def measure_memory(channels, turns):
+    bot = make_bot(history_tokens=2048)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for index in range(channels):
+        bot.add_channel(f"channel{index}")
+    empty, _ = tracemalloc.get_traced_memory()
+    for channel in list(bot.channels.values())[1:]:
+        channel.current_category = 'Benchmarking'
+        bot._render_prompt(channel)
+        fill(channel, bot.bot_name, turns)
+    full, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (empty - before) / channels, (full - before) / channels
+
+
+def process_rss():
+    """Peak resident size, in bytes, of a fresh process holding one single-channel bot (Linux/macOS only)."""
+    try:
+        output = subprocess.run([sys.executable, '-c', PROCESS_RSS], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    kilobytes = int(output.strip().splitlines()[-1])
+    return kilobytes * (1 if sys.platform == 'darwin' else 1024)
+
+
+async def measure_fairness(flood, quiet, latency):
+    rooms = ['busy'] + [f"quiet{index}" for index in range(quiet)]
+    bot = make_bot(channels=rooms, queue_depth=flood + quiet, workers=2)
+    bot.llm = FakeLLM(latency=latency)
+    bot.chat = FakeChat()
+    bot.scheduler.start()
+
+    # Replies waiting together are merged into one chat message, so time each reply rather than each message
+    answered = []
+    send = bot._send
+
+    async def timed_send(channel, text, **kwargs):
+        sent = await send(channel, text, **kwargs)
+        if sent:
+            answered.append((time.monotonic(), channel.name))
+        return sent
+
+    bot._send = timed_send
+    asked = {}
+    for index in range(flood):
+        await bot.on_message(make_message(f"viewer{index}", f"!ai question number {index}", room='busy'))
+    asked['busy'] = time.monotonic()
+    await asyncio.sleep(latency / 2)
+    for room in rooms[1:]:
+        await bot.on_message(make_message(f"{room}_viewer", f"!ai hello from {room}", room=room))
+        asked[room] = time.monotonic()
+
+    while bot.scheduler.metrics['completed'] + bot.scheduler.metrics['failed'] < flood + quiet:
+        await asyncio.sleep(0.01)
+    await bot.scheduler.stop()
+
+    replies = {}
+    for sent_at, room in answered:
+        replies.setdefault(room, []).append(sent_at - asked[room])
+    return replies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', type=int, default=50, help='Extra channels to add (default: 50)')
+    parser.add_argument('--turns', type=int, default=200, help='Question/answer pairs per channel (default: 200)')
+    parser.add_argument('--flood', type=int, default=40, help='Questions sent at once by the busy channel (default: 40)')
+    parser.add_argument('--quiet', type=int, default=3, help='Channels asking a single question (default: 3)')
+    parser.add_argument('--latency', type=float, default=0.1, help='Fake model latency in seconds (default: 0.1)')
+    args = parser.parse_args()
+
+    empty, full = measure_memory(args.channels, args.turns)
+    print(f"Memory per extra channel: {empty / 1024:.1f} KiB empty, {full / 1024:.1f} KiB with a full history")
+    rss = process_rss()
+    if rss:
+        print(f"A separate bot process: {rss / 1024 ** 2:.1f} MiB resident "
+              f"({rss / full:.0f}x a channel with a full history)")
+
+    replies = asyncio.run(measure_fairness(args.flood, args.quiet, args.latency))
+    busy = replies.pop('busy')
+    print(f"busy channel  {len(busy):>3} replies  last after {max(busy):.2f}s")
+    quiet = [latency for latencies in replies.values() for latency in latencies]
+    print(f"quiet channels {len(quiet):>2} replies  p50 {percentile(quiet, 50):.2f}s  max {max(quiet):.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Shows how many LLM moderation calls the tiered Moderator avoids.
+
+Runs a mix of typical bot replies (plain answers, repeats, leaked tool calls,
+replies touching sensitive topics) through Bot.check_message with a fake LLM
+moderator and prints the per-tier counters. --accept-on-rules lets the rules
+accept replies as the bot's option of the same name does.
+
+    python -m benchmarks.bench_moderation --messages 1000 --accept-on-rules
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import make_bot
+from benchmarks.fakes import FakeLLM
+
+SAMPLES = [
+    "The streamer is playing Hollow Knight right now!",
+    "Welcome to the stream, glad you could make it!",
+    "It's about 9pm for the streamer at the moment.",
+    "That boss is tough, most people die a few times before they get it.",
+    "You can find the full specs on the streamer's panels below the stream.",
+    '{"name": "search_internet", "arguments": {"query": "hollow knight"}}',
+    "Check out www.example.com for the patch notes.",
+    "Good luck on the next run!",
+    "",
+    "Drugs are bad, stay hydrated instead!",
+    "I will find where you live.",
+    'Here is my plan: {"a": 1}',
+    "Try a better diet, the streamer hates junk food.",
+]
+
+
+async def run(args):
+    bot = make_bot(accept_on_rules=args.accept_on_rules)
+    bot.llm = FakeLLM(latency=args.llm_latency)
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        await bot.check_message(rng.choice(SAMPLES))
+    return bot, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000, help='Messages to check (default: 1000)')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='Fake LLM seconds per check (default: 0.05)')
+    parser.add_argument('--accept-on-rules', action='store_true', help='Accept replies on the local rules alone')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bot, elapsed = asyncio.run(run(args))
+    stats = bot.moderator.stats()
+    for name, value in stats.items():
+        print(f"  {name:<20} {value}")
+    print(f"Checked {stats['checked']} messages in {elapsed:.2f}s; "
+          f"without the local tiers and cache that would have been ~{stats['checked'] * args.llm_latency:.1f}s of LLM time")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Compares sending replies straight to chat with sending them through the rate-limited outbox during a burst.
+
+Questions from different viewers arrive in one channel at --rate per second
+for --duration seconds, faster than Twitch lets a regular account answer (20
+messages in any 30 seconds, at most one a second per channel). Time runs
+--time-scale times faster than real time, and the limits and the reply
+deadline are scaled to match.
+
+Without the outbox, every reply is sent as soon as it is ready and Twitch
+drops the ones over its limits. With it, none are over the limits: replies
+waiting together are merged into one message, and answers that would arrive
+later than the deadline are dropped. The report shows how many answers
+reached chat, in how many messages, and how long they waited. A long answer
+is then sent to show it being split into messages of at most 500 characters.
+
+    python -m benchmarks.bench_outbox --rate 2 --duration 60
+"""
+import argparse
+import asyncio
+import time
+from collections import deque
+
+from benchmarks.common import make_bot
+from benchmarks.fakes import FakeChat, FakeLLM, make_message
+from outbox import RATE_LIMITS, TIER_BOT
+from streaming import TWITCH_MESSAGE_LIMIT
+
+WINDOW, WINDOW_MESSAGES, CHANNEL_INTERVAL = 30.0, 20, 1.0  # A regular account's limits, in real seconds
+
+
+class AnsweringLLM(FakeLLM):
+    """Gives each question its own answer, so replies can't be deduplicated."""
+
+    def respond(self, messages, **kwargs):
+        if messages and '"accepted"' in messages[0]['content']:
+            return super().respond(messages, **kwargs)
+        return f"That is answer number {self.calls}, thanks for asking!"
+
+
+def refused(sent, scale):
+    """How many messages Twitch would drop: over 20 in a 30 second window, or less than a second after the last."""
+    window = deque()
+    last = None
+    count = 0
+    for sent_at, _, _ in sent:
+        while window and sent_at - window[0] >= WINDOW * scale:
+            window.popleft()
+        if len(window) >= WINDOW_MESSAGES or (last is not None and sent_at - last < CHANNEL_INTERVAL * scale * 0.99):
+            count += 1
+            continue
+        window.append(sent_at)
+        last = sent_at
+    return count
+
+
+async def run(args, rate_limits):
+    scale = args.time_scale
+    bot = make_bot(workers=4, queue_depth=1000, chat_rate_limits=rate_limits)
+    bot.llm = AnsweringLLM(latency=0.5 * scale)
+    bot.chat = FakeChat()
+    bot.USER_BURST = 1000
+    bot.REPLY_DEADLINE *= scale
+    bot.outbox.duplicate_window *= scale
+    if rate_limits:
+        bot.outbox.limits = {tier: (burst, refill * scale, interval * scale)
+                             for tier, (burst, refill, interval) in RATE_LIMITS.items()}
+    bot.scheduler.start()
+
+    questions = int(args.rate * args.duration)
+    start = time.monotonic()
+    for index in range(questions):
+        await asyncio.sleep(max(0.0, start + index / args.rate * scale - time.monotonic()))
+        await bot.on_message(make_message(f"viewer{index}", f"!ai what about thing {index}?"))
+    while bot.scheduler.metrics['completed'] + bot.scheduler.metrics['failed'] < questions:
+        await asyncio.sleep(0.01)
+    await bot.scheduler.stop()
+
+    stats = bot.outbox.stats()
+    lost = refused(bot.chat.sent, scale)
+    answered = stats['sent'] + stats['merged'] + stats['deduplicated'] - (lost if not rate_limits else 0)
+    print(f"{'outbox' if rate_limits else 'direct':<7} {len(bot.chat.sent):4d} messages sent, {lost:3d} refused by Twitch, "
+          f"{answered:4d} of {questions} answers reached chat, {stats['merged']:3d} merged, {stats['stale']:3d} dropped "
+          f"as stale, queue delay avg {stats['queue_delay_total'] / max(1, stats['sent'] + stats['merged']) / scale:5.1f}s "
+          f"max {stats['queue_delay_max'] / scale:5.1f}s (real time)")
+    await bot.outbox.stop()
+    return bot
+
+
+async def split_demo(bot):
+    channel = bot.channels['bench_channel']
+    sent_before = len(bot.chat.sent)
+    answer = ' '.join(f"This is sentence number {index} of a very long answer." for index in range(30))
+    await bot._send(channel, answer, mentions=['viewer1'])
+    parts = [text for _, _, text in bot.chat.sent[sent_before:]]
+    print(f"\nlong answer   {len(answer)} characters sent as {len(parts)} messages of "
+          f"{', '.join(str(len(part)) for part in parts)} characters (limit {TWITCH_MESSAGE_LIMIT})")
+    await bot.outbox.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=2.0, help='Questions per (real) second (default: 2)')
+    parser.add_argument('--duration', type=float, default=60, help='Real seconds of questions (default: 60)')
+    parser.add_argument('--time-scale', type=float, default=0.05,
+                        help='Seconds the benchmark takes per real second (default: 0.05)')
+    args = parser.parse_args()
+    print(f"Bot account tier: {TIER_BOT}, {args.rate * args.duration:.0f} questions over {args.duration:.0f}s")
+    asyncio.run(run(args, rate_limits=False))
+    bot = asyncio.run(run(args, rate_limits=True))
+    asyncio.run(split_demo(bot))
+
+
+if __name__ == '__main__':
+    main()
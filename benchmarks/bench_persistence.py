@@ -0,0 +1,87 @@
+"""Measures how long saving chat history stalls the event loop per message.
+
+"before" rewrites the whole history as indented JSON after every message, as the
+bot used to. "after" records each message to the append-only HistoryLog, which
+writes in a background thread. A ticker task measures the worst event loop lag
+seen during each run.
+
+    python -m benchmarks.bench_persistence --messages 500 --history 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import percentile
+from history import ChatHistory
+from persistence import HistoryLog
+
+
+def make_message(index):
+    return {'role': 'user', 'content': f"viewer{index % 13}: message number {index} " + "lorem ipsum " * 10}
+
+
+async def measure_lag(stop, lags, interval=0.001):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(save, args):
+    stop = asyncio.Event()
+    lags = []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    stalls = []
+    for index in range(args.messages):
+        start = time.perf_counter()
+        save(make_message(index))
+        stalls.append(time.perf_counter() - start)
+        await asyncio.sleep(args.interval)
+    stop.set()
+    await ticker
+    return stalls, lags
+
+
+def report(name, stalls, lags):
+    print(f"{name:<7} stall/msg p50 {percentile(stalls, 50) * 1e6:8.1f} us  p99 {percentile(stalls, 99) * 1e6:8.1f} us  "
+          f"max loop lag {max(lags, default=0) * 1000:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500, help='Messages to save (default: 500)')
+    parser.add_argument('--history', type=int, default=100, help='Messages kept in the history (default: 100)')
+    parser.add_argument('--interval', type=float, default=0.002, help='Seconds between messages (default: 0.002)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = os.path.join(directory, 'legacy.json')
+        legacy_history = []
+
+        def save_legacy(message):
+            legacy_history.append(message)
+            del legacy_history[:-args.history]
+            with open(legacy_path, 'w') as f:
+                json.dump(legacy_history, f, indent=2)
+
+        report('before', *asyncio.run(run(save_legacy, args)))
+
+        log = HistoryLog(os.path.join(directory, 'history.jsonl'), flush_interval=0.05)
+        history = ChatHistory(token_budget=args.history * 40)
+        history.log = log
+        log.snapshot = history.to_records
+
+        async def run_log():
+            result = await run(history.append, args)
+            await log.flush()
+            return result
+
+        report('after', *asyncio.run(run_log()))
+        print(f"Log writes: {log.writes}, compactions: {log.compactions}")
+
+
+if __name__ == '__main__':
+    main()
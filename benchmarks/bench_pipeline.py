@@ -0,0 +1,77 @@
+"""Compares the old per-message multiprocessing path with the asyncio pipeline.
+
+Every message in a burst arrives at the same moment, and latency is measured from
+arrival to the generated reply. Both paths talk to a local stub of the Ollama
+server, so the numbers show bot overhead and scheduling rather than model speed.
+
+    python -m benchmarks.bench_pipeline --messages 50 --latency 0.05
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from benchmarks.common import make_bot, summarise
+from benchmarks.stub_ollama import StubOllamaServer
+
+
+def _legacy_generate(bot, llm_results):
+    # Mirrors the child process the bot used to start for every message
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    messages = bot._build_messages(bot.channels['bench_channel'])
+    response_text, response_tools = loop.run_until_complete(bot._get_llm_response(messages))
+    llm_results['response_text'] = response_text
+    llm_results['response_tools'] = response_tools
+
+
+async def run_legacy(bot, messages, timeout):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(messages):
+        # The old handler blocked the event loop in join(), so messages were served one by one
+        llm_results = multiprocessing.Manager().dict()
+        process = multiprocessing.Process(target=_legacy_generate, args=(bot, llm_results))
+        process.start()
+        process.join(timeout=timeout)
+        if process.is_alive():
+            process.terminate()
+        latencies.append(time.perf_counter() - start)
+    return latencies, time.perf_counter() - start
+
+
+async def run_pipeline(bot, messages):
+    start = time.perf_counter()
+
+    async def one():
+        await bot.pipeline.run(bot._get_llm_response, bot._build_messages(bot.channels['bench_channel']))
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*(one() for _ in range(messages)))
+    return list(latencies), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=50, help='Messages in the burst (default: 50)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Stub model latency in seconds (default: 0.05)')
+    parser.add_argument('--max-concurrent', type=int, default=4, help='Pipeline concurrency (default: 4)')
+    parser.add_argument('--skip-legacy', action='store_true', help='Only run the asyncio pipeline')
+    args = parser.parse_args()
+
+    with StubOllamaServer(latency=args.latency) as stub:
+        bot = make_bot(llm_host=stub.url, max_concurrent=args.max_concurrent)
+        bot.channels['bench_channel'].chat_history.append({'role': 'user', 'content': 'viewer123: what game is this?'})
+
+        print(f"Stub latency {args.latency * 1000:.0f} ms, burst of {args.messages} messages")
+        if not args.skip_legacy:
+            latencies, elapsed = asyncio.run(run_legacy(bot, args.messages, bot.GENERATION_TIMEOUT))
+            legacy_rate = summarise('legacy', latencies, elapsed)
+        latencies, elapsed = asyncio.run(run_pipeline(bot, args.messages))
+        rate = summarise('pipeline', latencies, elapsed)
+        if not args.skip_legacy and legacy_rate:
+            print(f"Speed-up: {rate / legacy_rate:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
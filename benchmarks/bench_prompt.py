@@ -0,0 +1,53 @@
+"""Reports prompt size over a long conversation.
+
+Replays a synthetic conversation through the token-budgeted history and
+PromptBuilder, with a fake LLM writing the rolling summaries. It prints the
+tokens sent compared with the old approach (which embedded the history in the
+system prompt and then sent it again as messages), the largest prompt sent, and
+how often older messages were summarized.
+
+    python -m benchmarks.bench_prompt --turns 1000
+"""
+import argparse
+import asyncio
+
+from benchmarks.common import make_bot
+from benchmarks.fakes import FakeLLM
+
+
+async def replay(args):
+    bot = make_bot(history_tokens=args.history_tokens)
+    bot.llm = FakeLLM(latency=0.01, reply="viewers asked numbered questions about the game")
+    channel = bot.channels['bench_channel']
+    largest = 0
+    for turn in range(args.turns):
+        channel.chat_history.append({'role': 'user', 'content': f"viewer{turn % 7}: question number {turn} about the game?"})
+        channel.prompt_builder.build(channel.prompt, channel.chat_history)
+        largest = max(largest, channel.prompt_builder.last_report['prompt_tokens'])
+        channel.chat_history.append({'role': 'assistant', 'content': f"{bot.bot_name}: here is answer number {turn}."})
+        await asyncio.sleep(0)
+    await channel.chat_history.wait_for_summary()
+    return channel, largest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=1000, help='Question/answer pairs to replay (default: 1000)')
+    parser.add_argument('--history-tokens', type=int, default=2048, help='History token budget (default: 2048)')
+    args = parser.parse_args()
+
+    channel, largest = asyncio.run(replay(args))
+    history = channel.chat_history.stats()
+    stats = channel.prompt_builder.stats()
+    legacy = stats['total_tokens'] + stats['total_saved_tokens']
+    print(f"Calls: {stats['calls']} (list rebuilt {stats['rebuilds']} times)")
+    print(f"Tokens sent: ~{stats['total_tokens']} vs ~{legacy} before "
+          f"({100 * stats['total_saved_tokens'] / legacy:.0f}% saved)")
+    print(f"Tokens in a prefix identical to the previous call: ~{stats['total_reused_prefix_tokens']} "
+          f"({100 * stats['total_reused_prefix_tokens'] / stats['total_tokens']:.0f}%)")
+    print(f"Largest prompt: ~{largest} tokens; history holds {history['turns']} messages "
+          f"(~{history['tokens']} tokens), {history['evicted']} evicted into {history['summaries']} summaries")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Measures indexing and search of the long-term chat memory as the archive grows.
+
+Fills a RecallIndex with --turns synthetic chat messages (with a fake --dim
+dimension bag-of-words embedding standing in for the embedding model, 768 like
+nomic-embed-text by default), with a
+few facts planted early on that have long since left the chat history. It
+reports the time to add a message, embed the backlog and reload the archive
+from disk, and search latency at each size in --sizes, keyword-only and
+hybrid (keywords plus embedding similarity). It then asks about the planted
+facts to show them being found among everything else, and compares the
+prompt size with sending the whole archive.
+
+    python -m benchmarks.bench_recall --turns 200000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import percentile
+from benchmarks.fakes import bag_of_words
+from prompt_builder import estimate_tokens
+from recall import RecallIndex
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'tu', 'ne', 'so', 'vi', 'da', 'pe', 'zu', 'ho', 'gri', 'bla', 'ster', 'fen']
+
+# (turn it is planted at, message, question asked much later, word the answer must contain)
+FACTS = [
+    (100, "viewer42: my cat is called Biscuit and she hates the vacuum", "what was my cat called again?", 'Biscuit'),
+    (5000, "SLM_Bot: the speedrun record for the forest level is 4 minutes 12 seconds",
+     "what is the forest level speedrun record?", '4 minutes'),
+    (50000, "viewer7: I'm from Lisbon, the weather there is great", "where is viewer7 from?", 'Lisbon'),
+]
+
+
+def vocabulary(size, seed):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def chat_messages(count, seed=1):
+    """Synthetic chat turns, common words far more often than rare ones, with FACTS planted among them."""
+    rng = random.Random(seed)
+    words = vocabulary(5000, seed)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    facts = {turn: text for turn, text, _, _ in FACTS}
+    for index in range(count):
+        if index in facts:
+            yield {'role': 'user' if not facts[index].startswith('SLM_Bot') else 'assistant', 'content': facts[index]}
+            continue
+        text = ' '.join(rng.choices(words, weights, k=rng.randint(4, 16)))
+        if index % 2:
+            yield {'role': 'assistant', 'content': f"SLM_Bot: {text}"}
+        else:
+            yield {'role': 'user', 'content': f"viewer{rng.randint(0, 500)}: {text}?"}
+
+
+def embedder(dim):
+    async def embed(texts):
+        return [bag_of_words(text, dim) for text in texts]
+    return embed
+
+
+def query_vector(text, dim):
+    vector = np.asarray(bag_of_words(text, dim), dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+async def search_latency(index, questions, hybrid, dim):
+    times = []
+    for question in questions:
+        vector = query_vector(question, dim) if hybrid else None
+        start = time.perf_counter()
+        index.search(question, k=3, exclude_last=40, vector=vector)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+async def run(args, path):
+    embed = embedder(args.dim)
+    index = RecallIndex(path=path, embed=embed)
+    questions = [' '.join(turn['content'].split()[1:6]) for turn in chat_messages(200, seed=2)]
+    sizes = sorted(set(size for size in args.sizes if size <= args.turns) | {args.turns})
+    messages = chat_messages(args.turns)
+    add_times = []
+    print(f"{'turns':>8}  {'add/msg':>9}  {'keyword p50':>11}  {'p99':>8}  {'hybrid p50':>10}  {'p99':>8}")
+    for size in sizes:
+        for _ in range(size - len(index)):
+            message = next(messages)
+            start = time.perf_counter()
+            index.add(message)
+            add_times.append(time.perf_counter() - start)
+        await index.wait_for_embeddings()
+        keyword = await search_latency(index, questions, hybrid=False, dim=args.dim)
+        hybrid = await search_latency(index, questions, hybrid=True, dim=args.dim)
+        print(f"{size:8d}  {percentile(add_times, 50) * 1e6:7.1f}us  {percentile(keyword, 50) * 1000:9.2f}ms  "
+              f"{percentile(keyword, 99) * 1000:6.2f}ms  {percentile(hybrid, 50) * 1000:8.2f}ms  "
+              f"{percentile(hybrid, 99) * 1000:6.2f}ms")
+
+    start = time.perf_counter()
+    await index.wait_for_embeddings()
+    index.close()
+    reloaded = RecallIndex(path=path, embed=embed)
+    reloaded.load()
+    print(f"\nreload   {len(reloaded)} turns ({reloaded.embedded} embedded) in {time.perf_counter() - start:.2f}s, "
+          f"{os.path.getsize(path) / 1e6:.0f} MB archive + {os.path.getsize(path + '.vectors') / 1e6:.0f} MB vectors")
+
+    print()
+    for turn, _, question, answer in FACTS:
+        if turn >= args.turns:
+            continue
+        keyword = reloaded.search(question, k=3, exclude_last=40)
+        hybrid = reloaded.search(question, k=3, exclude_last=40, vector=query_vector(question, args.dim))
+        print(f"turn {turn:6d}  {question!r:45}  keyword {'found' if any(answer in text for text in keyword) else 'missed'}"
+              f"  hybrid {'found' if any(answer in text for text in hybrid) else 'missed'}")
+
+    archive_tokens = sum(estimate_tokens(text) for text in reloaded._texts)
+    context = reloaded.search(FACTS[0][2], k=3, exclude_last=40)
+    print(f"\nprompt   whole archive ~{archive_tokens:,} tokens, recalled context ~{sum(map(estimate_tokens, context))} tokens")
+    reloaded.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=200000, help='Chat messages stored (default: 200000)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000, 100000],
+                        help='Archive sizes to measure search at on the way (default: 1000 10000 50000 100000)')
+    parser.add_argument('--dim', type=int, default=768, help='Embedding dimensions (default: 768)')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(args, os.path.join(directory, 'memory.jsonl')))
+
+
+if __name__ == '__main__':
+    main()
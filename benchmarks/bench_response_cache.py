@@ -0,0 +1,63 @@
+"""Measures the semantic response cache on a stream of repeated viewer questions.
+
+Questions are drawn from a few groups of paraphrases plus one-off questions and
+answered one at a time by Bot's request handler with a fake LLM, once without
+and once with the cache. Reports the cache hit rate, model time saved and mean
+reply latency.
+
+    python -m benchmarks.bench_response_cache --questions 100
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import make_bot
+from benchmarks.fakes import FakeChat, FakeLLM
+
+PARAPHRASES = [
+    ['what game is this', 'what game is this?', 'what is this game', 'which game is this'],
+    ['what are the specs', 'what are the pc specs?', 'what specs is the pc'],
+    ['how long is the stream today', 'how long is stream today?'],
+]
+
+
+async def run(embed_model, args):
+    bot = make_bot(embed_model=embed_model, workers=1)
+    bot.llm = FakeLLM(latency=args.llm_latency)
+    bot.chat = FakeChat()
+    bot.scheduler.start()
+    rng = random.Random(args.seed)
+    latencies = []
+    for index in range(args.questions):
+        if rng.random() < args.repeat_ratio:
+            question = rng.choice(rng.choice(PARAPHRASES))
+        else:
+            question = f"tell me a fact about number {index}"
+        start = time.monotonic()
+        status, job = await bot.scheduler.submit(f"viewer{index}", question, channel='bench_channel')
+        await job.done
+        latencies.append(time.monotonic() - start)
+    await bot.scheduler.stop()
+    return bot, sum(latencies) / len(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=100, help='Questions to ask (default: 100)')
+    parser.add_argument('--repeat-ratio', type=float, default=0.6, help='Share of repeated questions (default: 0.6)')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='Fake LLM seconds per call (default: 0.05)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bot, mean = asyncio.run(run(None, args))
+    print(f"no cache    mean latency {mean * 1000:7.1f} ms  LLM calls {bot.llm.calls}")
+    bot, mean = asyncio.run(run('fake-embed', args))
+    stats = bot.response_cache.stats()
+    print(f"with cache  mean latency {mean * 1000:7.1f} ms  LLM calls {bot.llm.calls} (including embeddings)")
+    print(f"hit rate {stats['hit_rate']:.0%}, model time saved {stats['seconds_saved']:.2f}s, "
+          f"embedding time {stats['embed_seconds']:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
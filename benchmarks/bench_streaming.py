@@ -0,0 +1,56 @@
+"""Compares time-to-first-message with and without streaming replies.
+
+Sends the same questions through Bot's request handler against a fake LLM that
+"generates" a multi-sentence reply word by word, once waiting for the full reply
+and once with --stream behaviour, and reports when the first chat message went out.
+
+    python -m benchmarks.bench_streaming --requests 5 --token-latency 0.03
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import make_bot, percentile
+from benchmarks.fakes import FakeChat, FakeLLM, make_message
+
+REPLY = ("Great question! The streamer is playing a roguelike where every run is different. "
+         "Each floor gets harder, and you collect items that combine in strange ways. "
+         "Most runs end on the third boss, so don't worry if you see a lot of restarts. "
+         "Feel free to ask if you want to know more about any item!")
+
+
+async def run(stream, args):
+    bot = make_bot(stream=stream, workers=1)
+    bot.llm = FakeLLM(latency=args.latency, token_latency=args.token_latency, reply=REPLY)
+    bot.chat = FakeChat()
+    bot.scheduler.start()
+    first_messages = []
+    for index in range(args.requests):
+        sent_before = len(bot.chat.sent)
+        start = time.monotonic()
+        await bot.on_message(make_message(f"viewer{index}", f"!ai what is this game? #{index}"))
+        while len(bot.chat.sent) == sent_before:
+            await asyncio.sleep(0.005)
+        first_messages.append(bot.chat.sent[sent_before][0] - start)
+        while bot.scheduler.metrics['completed'] + bot.scheduler.metrics['failed'] <= index:
+            await asyncio.sleep(0.01)
+    await bot.scheduler.stop()
+    return first_messages, len(bot.chat.sent)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5, help='Questions to ask (default: 5)')
+    parser.add_argument('--latency', type=float, default=0.2, help='Fake LLM seconds before the first token (default: 0.2)')
+    parser.add_argument('--token-latency', type=float, default=0.03, help='Fake LLM seconds per word (default: 0.03)')
+    args = parser.parse_args()
+
+    for stream in (False, True):
+        first_messages, sent = asyncio.run(run(stream, args))
+        name = 'stream' if stream else 'blocking'
+        print(f"{name:<9} time to first message p50 {percentile(first_messages, 50):.2f}s  "
+              f"max {max(first_messages):.2f}s  ({sent} chat messages)")
+
+
+if __name__ == '__main__':
+    main()
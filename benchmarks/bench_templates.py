@@ -0,0 +1,97 @@
+"""Compares the compiled prompt template with reading and formatting the prompt file on every update.
+
+Renders the system prompt for several channels through a series of category
+changes, once the old way (open, read and str.format the --prompt file each
+time) and once with PromptTemplate, and reports the time per update. It then
+checks what the template engine adds: how much of each channel's prompt is a
+shared prefix, that an edited file is picked up without a restart, and that a
+template with literal braces (a JSON example) renders instead of failing.
+
+    python -m benchmarks.bench_templates --channels 20 --updates 200
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import ROOT, make_bot
+
+JSON_TEMPLATE = 'You are {bot_name}. Answer {streamer_name}\'s chat as JSON, e.g. {"reply": "hi"}.\n'
+
+
+def legacy_render(prompt_file, bot_name, channel):
+    """What update_system_prompt used to do for each call."""
+    with open(prompt_file, 'r') as f:
+        template = f.read()
+    return template.format(bot_name=bot_name, streamer_name=channel.streamer_name,
+                           current_category=channel.current_category)
+
+
+async def run(args, prompt_file):
+    bot = make_bot(prompt_file=prompt_file, channels=[f"channel{index}" for index in range(args.channels)])
+    channels = list(bot.channels.values())
+
+    start = time.perf_counter()
+    for update in range(args.updates):
+        for channel in channels:
+            channel.current_category = f"Game {update}"
+            channel.prompt = legacy_render(prompt_file, bot.bot_name, channel)
+    legacy = (time.perf_counter() - start) / (args.updates * len(channels))
+    legacy_prompts = [channel.prompt for channel in channels]
+
+    start = time.perf_counter()
+    for update in range(args.updates):
+        for channel in channels:
+            channel.current_category = f"Game {update}"
+            await bot.update_system_prompt(channel)
+    compiled = (time.perf_counter() - start) / (args.updates * len(channels))
+    same = legacy_prompts == [channel.prompt for channel in channels]
+
+    print(f"read + format per update   {legacy * 1e6:8.1f} us")
+    print(f"compiled template          {compiled * 1e6:8.1f} us  ({legacy / compiled:.0f}x faster, "
+          f"{'identical' if same else 'DIFFERENT'} prompts)")
+    prefix = os.path.commonprefix([channel.prompt for channel in channels])
+    print(f"shared prefix              {len(prefix)} of {len(channels[0].prompt)} characters in every channel's prompt")
+    return bot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', type=int, default=20, help='Channels to render prompts for (default: 20)')
+    parser.add_argument('--updates', type=int, default=200, help='Category changes per channel (default: 200)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        prompt_file = os.path.join(directory, 'prompt.txt')
+        shutil.copy(os.path.join(ROOT, 'prompt_template.txt'), prompt_file)
+        bot = asyncio.run(run(args, prompt_file))
+
+        # Edit the file; the next request picks it up (normally checked at most once a second)
+        bot.prompt_template.check_interval = 0
+        with open(prompt_file, 'a') as f:
+            f.write("Keep every reply under 200 characters.\n")
+        os.utime(prompt_file, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        bot._build_messages(bot.channels['channel0'])
+        reloaded = all(channel.prompt.endswith("under 200 characters.\n") for channel in bot.channels.values())
+        print(f"hot reload                 {'picked up' if reloaded else 'NOT picked up'} by every channel, "
+              f"file loaded {bot.prompt_template.stats()['loads']} times in total")
+
+        with open(prompt_file, 'w') as f:
+            f.write(JSON_TEMPLATE)
+        try:
+            legacy_render(prompt_file, bot.bot_name, bot.channels['channel0'])
+            legacy = 'ok'
+        except (KeyError, ValueError, IndexError) as e:
+            legacy = f"fails ({type(e).__name__}: {e})"
+        os.utime(prompt_file, ns=(time.time_ns(), time.time_ns() + 2 * 10 ** 9))
+        bot._reload_prompt()
+        print(f"literal braces             str.format {legacy}; template gives {bot.channels['channel0'].prompt!r}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Measures the tool engine against a local fake search backend.
+
+Runs rounds of tool calls the way the model issues them (two searches and a
+time lookup at once), first one after another as the bot used to, then through
+ToolRegistry, which runs them concurrently and caches search results. A share of
+the searches repeat earlier queries.
+
+    python -m benchmarks.bench_tools --rounds 20 --search-latency 0.3
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import make_bot
+from benchmarks.fakes import FakeSearch
+from tools import SearchClient
+
+QUERIES = ['hollow knight tips', 'elden ring release date', 'best keyboard for streaming', 'ollama models']
+
+
+def make_calls(rng, index):
+    def search(query):
+        return {'function': {'name': 'search_internet', 'arguments': {'query': query}}}
+    fresh = f"question number {index}"
+    return [search(rng.choice(QUERIES)), search(fresh), {'function': {'name': 'get_current_time', 'arguments': {}}}]
+
+
+async def sequential(bot, rounds, rng):
+    start = time.perf_counter()
+    for index in range(rounds):
+        for call in make_calls(rng, index):
+            name = call['function']['name']
+            if name == 'search_internet':
+                await bot.search.backend.atext(call['function']['arguments']['query'], max_results=3)
+            else:
+                await bot.get_current_time()
+    return time.perf_counter() - start
+
+
+async def concurrent(bot, rounds, rng):
+    start = time.perf_counter()
+    for index in range(rounds):
+        await bot.tools.run(make_calls(rng, index))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20, help='Rounds of tool calls (default: 20)')
+    parser.add_argument('--search-latency', type=float, default=0.3, help='Fake search seconds (default: 0.3)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bot = make_bot()
+    backend = FakeSearch(latency=args.search_latency)
+    bot.search = SearchClient(backend=backend)
+
+    elapsed = asyncio.run(sequential(bot, args.rounds, random.Random(args.seed)))
+    print(f"sequential, uncached  {elapsed:6.2f}s  {backend.calls} searches")
+    backend.calls = 0
+    elapsed = asyncio.run(concurrent(bot, args.rounds, random.Random(args.seed)))
+    print(f"tool engine           {elapsed:6.2f}s  {backend.calls} searches "
+          f"({bot.search.cache.hits} answered from cache)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Counts the Twitch API requests made over startups, chat reconnects and restarts, with and without the Twitch cache.
+
+Runs Bot's EventSub setup and chat-ready handler against a fake Twitch API
+client (each request taking --latency seconds) for --channels channels: one
+startup, --reconnects chat reconnects, then a restart of the bot. Without the
+cache (the old behaviour) every one of them looks up the user ids or stream
+status again; with it, they are only fetched once and then kept up to date by
+EventSub. It then sends a channel update event to show the new title reaching
+the prompt without a request, and restarts during an API outage to show the
+last known status being used.
+
+    python -m benchmarks.bench_twitch_cache --channels 250 --reconnects 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import main as bot_main
+from benchmarks.common import make_bot
+from benchmarks.fakes import FakeChat, FakeEventSub, FakeTwitch, make_stream_update
+from twitch_cache import TwitchCache
+
+bot_main.EventSubWebsocket = FakeEventSub
+
+
+class Uncached(TwitchCache):
+    """Asks the API every time, as the bot did before it had a cache."""
+
+    def _fresh(self, login, entry, ttl):
+        return False
+
+
+def make_cached_bot(args, api, cache):
+    bot = make_bot(channels=[f"streamer{index}" for index in range(args.channels)])
+    bot.twitch, bot.chat, bot.twitch_cache = api, FakeChat(), cache
+    cache.api = api
+    return bot
+
+
+async def start(bot):
+    """What start() and the chat connection do with the Twitch API, without logging in."""
+    await bot.setup_eventsub()
+    await bot.on_ready(None)
+
+
+async def session(args, name, make_cache):
+    api = FakeTwitch({f"streamer{index}": (f"Game {index % 7}", f"Stream number {index}")
+                      for index in range(0, args.channels, 2)}, latency=args.latency)
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot = make_cached_bot(args, api, make_cache())
+        await start(bot)
+        started = time.perf_counter()
+        for _ in range(args.reconnects):
+            await bot.on_ready(None)
+        bot.twitch_cache.close()  # As the bot does when it shuts down
+        await start(make_cached_bot(args, api, make_cache()))
+        later = time.perf_counter() - started
+    total = sum(api.requests.values())
+    print(f"{name:<10} {total:4d} API requests ({api.requests['get_users']} get_users, "
+          f"{api.requests['get_streams']} get_streams), {later:.2f}s waiting after the first startup, "
+          f"{bot.twitch_cache.stats()['hits']} cache hits")
+    return bot, api
+
+
+async def run(args, cache_file):
+    await session(args, 'uncached', Uncached)
+    bot, api = await session(args, 'cached', lambda: TwitchCache(path=cache_file))
+
+    channel = bot.channels['streamer0']
+    requests = sum(api.requests.values())
+    with contextlib.redirect_stdout(io.StringIO()):
+        await bot.eventsub.fire('update', channel.user_id,
+                                make_stream_update('streamer0', 'Game 0', 'Speedrun attempts all night'))
+    title_line = next(line for line in channel.prompt.splitlines() if 'title' in line)
+    print(f"\ntitle update event   prompt now says {title_line!r}, "
+          f"{sum(api.requests.values()) - requests} API requests")
+
+    # Restart after the status has expired while the API is down
+    api.fail = True
+    bot.twitch_cache.close()
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot = make_cached_bot(args, api, TwitchCache(path=cache_file, stream_ttl=0))
+        await start(bot)
+    channel = bot.channels['streamer0']
+    print(f"API outage restart   streamer0 is {'live' if channel.live else 'offline'} "
+          f"playing {channel.current_category!r}, from the saved cache")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', type=int, default=250, help='Channels joined (default: 250)')
+    parser.add_argument('--reconnects', type=int, default=5, help='Chat reconnects before restarting (default: 5)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per API request (default: 0.05)')
+    args = parser.parse_args()
+
+    fd, cache_file = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    os.remove(cache_file)
+    try:
+        asyncio.run(run(args, cache_file))
+    finally:
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Measures cold start and the first reply's wait for the model, with and without warm-up and keep-alive.
+
+Startup: Bot.start() runs against simulated Twitch steps (authentication,
+EventSub and chat setup taking fixed times), a saved history file and a stub
+Ollama server that takes --load-latency seconds to load the model. The old
+startup (one step after another, no warm-up) is compared with sequential and
+concurrent startup with warm-up, reporting when chat is taken, when the bot is
+ready, and how long the first question then waits for its answer.
+
+Idle: with the stub unloading the model after --idle-unload seconds without
+requests (Ollama's five minutes, scaled down), a question is asked after a
+longer quiet spell, with and without keep-alive pings. Finally the stream goes
+offline and the model should be unloaded.
+
+    python -m benchmarks.bench_warmup --load-latency 1.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import make_bot
+from benchmarks.fakes import FakeChat, make_message, make_stream_update
+from benchmarks.stub_ollama import StubOllamaServer
+
+
+def write_history(path, turns):
+    with open(path, 'w', encoding='utf-8') as f:
+        for turn in range(turns):
+            f.write(json.dumps({'turn': {'role': 'user', 'content': f"viewer{turn % 9}: message {turn}"}}) + '\n')
+
+
+def offline_bot(server, args, history_file, **kwargs):
+    """A Bot whose Twitch steps are simulated with fixed delays."""
+    bot = make_bot(llm_host=server.url, history_file=history_file, **kwargs)
+
+    async def authenticate():
+        await asyncio.sleep(args.auth)
+
+    async def setup_eventsub():
+        await asyncio.sleep(args.eventsub)
+
+    async def connect_chat():
+        await asyncio.sleep(args.chat)
+        bot.chat = FakeChat()
+
+    bot._authenticate, bot.setup_eventsub, bot._connect_chat = authenticate, setup_eventsub, connect_chat
+    return bot
+
+
+async def ask(bot, user, text="!ai what is this game?"):
+    sent_before = len(bot.chat.sent)
+    start = time.monotonic()
+    await bot.on_message(make_message(user, text))
+    while len(bot.chat.sent) == sent_before:
+        await asyncio.sleep(0.005)
+    return bot.chat.sent[sent_before][0] - start
+
+
+async def cold_start(args, history_file, name, concurrent, warm_up):
+    with StubOllamaServer(latency=args.latency, load_latency=args.load_latency) as server:
+        bot = offline_bot(server, args, history_file, warm_up=warm_up)
+        timings = await bot.start(concurrent=concurrent)
+        first_reply = await ask(bot, 'viewer1')
+        await bot.keeper.stop()
+        await bot.scheduler.stop()
+    print(f"{name:<22} taking chat after {timings['chat_started']:5.2f}s  ready after {timings['ready']:5.2f}s  "
+          f"first reply {first_reply:5.2f}s  (history {timings['history']:.2f}s, "
+          f"warm-up {timings.get('warm_up', 0):.2f}s)")
+
+
+async def idle(args, history_file, keep_alive):
+    with StubOllamaServer(latency=args.latency, load_latency=args.load_latency,
+                          default_keep_alive=args.idle_unload) as server:
+        bot = offline_bot(server, args, history_file, warm_up=keep_alive)
+        bot.keeper.interval = args.idle_unload / 3
+        bot.keeper.keep_alive = args.idle_unload * 2
+        await bot.start()
+        streamer = bot.channels['bench_channel'].streamer_name
+        await bot.on_stream_online(make_stream_update(streamer, 'Benchmarking'))
+        await ask(bot, 'viewer1')
+        await asyncio.sleep(args.idle_unload * 2.5)
+        after_idle = await ask(bot, 'viewer2', "!ai are you still there?")
+        await bot.on_stream_offline(make_stream_update(streamer, 'Benchmarking'))
+        await asyncio.sleep(0.1)
+        print(f"{'keep-alive' if keep_alive else 'no keep-alive':<22} reply after {args.idle_unload * 2.5:.1f}s idle "
+              f"{after_idle:5.2f}s  model loads {server.loads}, pings {bot.keeper.metrics['pings']}, "
+              f"{'still loaded' if server.loaded else 'unloaded'} after going offline")
+        await bot.keeper.stop()
+        await bot.scheduler.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--load-latency', type=float, default=1.5, help='Seconds to load the model (default: 1.5)')
+    parser.add_argument('--latency', type=float, default=0.1, help='Seconds per generation once loaded (default: 0.1)')
+    parser.add_argument('--auth', type=float, default=0.4, help='Simulated token refresh seconds (default: 0.4)')
+    parser.add_argument('--eventsub', type=float, default=0.6, help='Simulated EventSub setup seconds (default: 0.6)')
+    parser.add_argument('--chat', type=float, default=0.3, help='Simulated chat setup seconds (default: 0.3)')
+    parser.add_argument('--history-turns', type=int, default=50000, help='Messages in the saved history (default: 50000)')
+    parser.add_argument('--idle-unload', type=float, default=1.0,
+                        help='Seconds the stub keeps an idle model loaded, standing in for 5 minutes (default: 1)')
+    args = parser.parse_args()
+
+    fd, history_file = tempfile.mkstemp(suffix='.jsonl')
+    os.close(fd)
+    try:
+        write_history(history_file, args.history_turns)
+        asyncio.run(cold_start(args, history_file, 'sequential, no warm-up', concurrent=False, warm_up=False))
+        asyncio.run(cold_start(args, history_file, 'sequential + warm-up', concurrent=False, warm_up=True))
+        asyncio.run(cold_start(args, history_file, 'concurrent + warm-up', concurrent=True, warm_up=True))
+        print()
+        asyncio.run(idle(args, history_file, keep_alive=False))
+        asyncio.run(idle(args, history_file, keep_alive=True))
+    finally:
+        os.remove(history_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from main import Bot  # noqa: E402
+
+
+def make_bot(llm_host=None, **kwargs):
+    """Build a Bot from a throwaway login file so no credentials are prompted for.
+
+    `llm_host` is a model server spec as accepted by --llm-host. Chat messages are sent without
+    Twitch's rate limits unless `chat_rate_limits=True` is passed."""
+    login = {
+        'app_id': 'bench',
+        'app_secret': 'bench',
+        'channel_name': 'bench_channel',
+        'bot_name': 'SLM_Bot',
+    }
+    fd, login_file = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(login, f)
+    if llm_host:
+        kwargs['llm_hosts'] = [llm_host]
+    kwargs.setdefault('chat_rate_limits', False)
+    try:
+        bot = Bot(login_file=login_file, **kwargs)
+    finally:
+        os.remove(login_file)
+    for channel in bot.channels.values():
+        channel.current_category = 'Benchmarking'
+        bot._render_prompt(channel)
+    return bot
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarise(name, latencies, elapsed):
+    """Print one line of throughput and latency stats."""
+    rate = len(latencies) / elapsed if elapsed else 0.0
+    print(f"{name:<12} {len(latencies):>5} msgs  {rate:>8.1f} msg/s  "
+          f"p50 {percentile(latencies, 50) * 1000:>8.1f} ms  p99 {percentile(latencies, 99) * 1000:>8.1f} ms")
+    return rate
+
+
+def load_traffic(path):
+    """Read recorded chat traffic: one JSON object per line with `at` (seconds from the start), `channel`,
+    `user` and `text`, plus optional `mod`, `subscriber`, `vip` and `broadcaster` flags.
+
+    A line with `category` (and optionally `title`) instead of `user` and `text` is a stream
+    update, e.g. the streamer switching games."""
+    with open(path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record['at'])
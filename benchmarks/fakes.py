@@ -0,0 +1,256 @@
+"""In-process stand-ins for the Twitch chat connection, Twitch API and the Ollama client."""
+import asyncio
+import json
+import re
+import time
+import zlib
+from types import SimpleNamespace
+
+
+def bag_of_words(text, dim=64):
+    """Embedding that comes out similar for texts sharing most of their words."""
+    vector = [0.0] * dim
+    for word in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(word.encode()) % dim] += 1.0
+    return vector
+
+
+class FakeLLM:
+    """Async replacement for ollama.AsyncClient with a configurable latency.
+
+    A call takes `latency` seconds before the first token plus `token_latency`
+    seconds per word of the reply; with stream=True the words are yielded as they
+    are "generated". A call also keeps the CPU busy for `cpu_latency` seconds,
+    blocking the event loop as a model run in the calling process would. Moderation requests (recognised by their system prompt) are
+    answered with an accepted verdict; everything else gets `reply`.
+    """
+
+    def __init__(self, latency=0.2, reply="Hello from the fake model!", token_latency=0.0, cpu_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.cpu_latency = cpu_latency
+        self.reply = reply
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def respond(self, messages, **kwargs):
+        system = messages[0]['content'] if messages else ''
+        if '"accepted"' in system:
+            return '{"accepted": true}'
+        return self.reply
+
+    async def chat(self, model='', messages=None, stream=False, **kwargs):
+        self.calls += 1
+        content = self.respond(messages or [], **kwargs)
+        busy_until = time.perf_counter() + self.cpu_latency
+        while time.perf_counter() < busy_until:
+            pass
+        if stream:
+            return self._stream(model, content, self.usage(messages or [], content))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency + self.token_latency * len(content.split()))
+        finally:
+            self.in_flight -= 1
+        return {
+            'model': model,
+            'message': {'role': 'assistant', 'content': content},
+            'done': True,
+            **self.usage(messages or [], content),
+        }
+
+    def usage(self, messages, content):
+        """Token counts and durations in the form Ollama reports them on the final response."""
+        return {
+            'prompt_eval_count': sum(len(message.get('content') or '') // 4 for message in messages),
+            'eval_count': len(content.split()),
+            'eval_duration': int(self.token_latency * len(content.split()) * 1e9),
+        }
+
+    async def embed(self, model='', input=''):
+        """Bag-of-words embedding of a text or a list of texts."""
+        self.calls += 1
+        await asyncio.sleep(self.latency / 10)
+        texts = [input] if isinstance(input, str) else input
+        return {'model': model, 'embeddings': [bag_of_words(text) for text in texts]}
+
+    async def _stream(self, model, content, usage):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            for word in content.split(' '):
+                await asyncio.sleep(self.token_latency)
+                yield {'model': model, 'message': {'role': 'assistant', 'content': word + ' '}, 'done': False}
+            yield {'model': model, 'message': {'role': 'assistant', 'content': ''}, 'done': True, **usage}
+        finally:
+            self.in_flight -= 1
+
+
+class FakeGPU(FakeLLM):
+    """A fake model server that, like Ollama on one GPU, generates one reply at a time.
+
+    A call costs `overhead` seconds, plus `prefill` seconds per prompt token
+    after the part shared with the previous call (Ollama reuses its cache for
+    that), plus `token_latency` seconds per word generated. Requests for several
+    answers in one JSON reply (see batching.py) get `reply` once per question.
+    `busy_seconds` is the total time spent generating.
+    """
+
+    def __init__(self, reply="Hello from the fake model!", overhead=0.05, prefill=0.0005, token_latency=0.02):
+        super().__init__(latency=0.0, reply=reply, token_latency=token_latency)
+        self.overhead = overhead
+        self.prefill = prefill
+        self.busy_seconds = 0.0
+        self._lock = asyncio.Lock()
+        self._last_prompt = []
+
+    def respond(self, messages, **kwargs):
+        last = messages[-1]['content'] if messages else ''
+        if kwargs.get('format') == 'json' and '"answers"' in last:
+            questions = re.findall(r"^\d+\. ", last, flags=re.MULTILINE)
+            return json.dumps({'answers': [self.reply] * len(questions)})
+        return super().respond(messages, **kwargs)
+
+    def _uncached_tokens(self, messages):
+        shared = 0
+        for previous, message in zip(self._last_prompt, messages):
+            if previous != message:
+                break
+            shared += 1
+        self._last_prompt = list(messages)
+        return sum(len(message.get('content') or '') // 4 for message in messages[shared:])
+
+    async def chat(self, model='', messages=None, stream=False, **kwargs):
+        messages = messages or []
+        content = self.respond(messages, **kwargs)
+        async with self._lock:
+            self.calls += 1
+            cost = (self.overhead + self.prefill * self._uncached_tokens(messages)
+                    + self.token_latency * len(content.split()))
+            await asyncio.sleep(cost)
+            self.busy_seconds += cost
+        message = {'role': 'assistant', 'content': content}
+        if stream:
+            return self._replay(model, message, self.usage(messages, content))
+        return {'model': model, 'message': message, 'done': True, **self.usage(messages, content)}
+
+    async def _replay(self, model, message, usage):
+        yield {'model': model, 'message': message, 'done': True, **usage}
+
+
+class FakeChat:
+    """Records sent messages instead of talking to Twitch."""
+
+    def __init__(self):
+        self.sent = []
+        self.rooms = []
+
+    def is_ready(self):
+        return True
+
+    def is_mod(self, room):
+        return False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    async def join_room(self, rooms):
+        self.rooms.extend([rooms] if isinstance(rooms, str) else rooms)
+
+    async def send_message(self, room, text):
+        self.sent.append((time.monotonic(), room, text))
+
+
+def make_message(user, text, room='bench_channel', mod=False, subscriber=False, vip=False, broadcaster=False):
+    """Build an object shaped like twitchAPI's ChatMessage."""
+    badges = {'broadcaster': '1'} if broadcaster else {}
+    chat_user = SimpleNamespace(name=user, display_name=user, mod=mod, subscriber=subscriber, vip=vip,
+                                badges=badges, id=user)
+    return SimpleNamespace(text=text, user=chat_user, room=SimpleNamespace(name=room),
+                           sent_timestamp=int(time.time() * 1000))
+
+
+def make_stream_update(streamer, category, title=''):
+    """Build an object shaped like twitchAPI's ChannelUpdateEvent."""
+    return SimpleNamespace(event=SimpleNamespace(broadcaster_user_login=streamer, broadcaster_user_name=streamer,
+                                                 category_name=category, title=title))
+
+
+class FakeTwitch:
+    """Stands in for twitchAPI's Twitch client, answering get_users and get_streams from a dict and counting requests.
+
+    `streams` maps the login of each live streamer to its (category, title); any other
+    login is a user who is offline. With `fail` set, every request raises."""
+
+    def __init__(self, streams=None, latency=0.0):
+        self.streams = streams or {}
+        self.latency = latency
+        self.fail = False
+        self.requests = {'get_users': 0, 'get_streams': 0}
+
+    async def _request(self, endpoint):
+        self.requests[endpoint] += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise ConnectionError("Twitch API unavailable")
+
+    async def get_users(self, logins=None):
+        await self._request('get_users')
+        for login in logins or []:
+            yield SimpleNamespace(id=str(zlib.crc32(login.lower().encode())), login=login.lower(), display_name=login)
+
+    async def get_streams(self, user_login=None, first=20):
+        await self._request('get_streams')
+        for login in (user_login or [])[:first]:
+            if login.lower() in self.streams:
+                category, title = self.streams[login.lower()]
+                yield SimpleNamespace(user_login=login.lower(), user_name=login, game_name=category, title=title,
+                                      type='live')
+
+
+class FakeEventSub:
+    """Stands in for twitchAPI's EventSubWebsocket, keeping the callbacks so events can be sent with fire()."""
+
+    def __init__(self, twitch=None):
+        self.callbacks = {}
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def _listen(self, kind, broadcaster_user_id, callback):
+        self.callbacks[(kind, broadcaster_user_id)] = callback
+
+    async def listen_channel_update_v2(self, broadcaster_user_id, callback):
+        await self._listen('update', broadcaster_user_id, callback)
+
+    async def listen_stream_online(self, broadcaster_user_id, callback):
+        await self._listen('online', broadcaster_user_id, callback)
+
+    async def listen_stream_offline(self, broadcaster_user_id, callback):
+        await self._listen('offline', broadcaster_user_id, callback)
+
+    async def fire(self, kind, broadcaster_user_id, event):
+        await self.callbacks[(kind, broadcaster_user_id)](event)
+
+
+class FakeSearch:
+    """Stands in for DuckDuckGo's AsyncDDGS, returning canned results after `latency` seconds."""
+
+    def __init__(self, latency=0.3):
+        self.latency = latency
+        self.calls = 0
+
+    async def atext(self, query, max_results=3):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [{'title': f"Result {index} for {query}", 'href': f"https://example.com/{index}",
+                 'body': f"Something about {query}."} for index in range(max_results)]
@@ -0,0 +1,334 @@
+"""Replays chat at the bot offline and fails if it got slower than allowed.
+
+Traffic is either recorded (--traffic, see common.load_traffic) or generated:
+--rate messages per second on average for --duration seconds, spread over
+--channels channels, with a share of repeated questions, a share that make the
+model call a tool (the time or a search), and every channel switching category
+every --update-every seconds. Each message or stream update is handed to
+Bot.on_message or Bot.on_stream_update at its time, as twitchAPI would, with an
+in-process fake Twitch chat. Model requests go over HTTP to a stub Ollama server
+whose reply takes --latency seconds plus --token-latency per word (or, with
+--llm fake, to an in-process fake that can also keep the CPU busy for
+--cpu-latency seconds per call), and searches to a fake search backend. With
+--processes, replies are generated by that many worker processes, as with the
+bot's --processes option.
+
+Reported:
+- throughput: requests answered per second
+- latency: p50/p95/p99 seconds from a request entering the queue to it being answered
+- outcomes: answered, cached, fallback replies, and requests coalesced or turned away
+- memory growth: resident size after the run minus before it (the peak on systems without /proc)
+- event loop lag: how late a 10 ms timer fires while the bot is busy, p99 and max
+
+The run exits with status 1 if any --max-*/--min-* limit is crossed, or if a
+result is more than --tolerance worse than the --baseline file (written by an
+earlier run with --save-baseline), so it can guard against regressions in CI.
+
+    python -m benchmarks.loadtest --rate 20 --duration 10 --max-p99 5 --max-loop-lag 0.1
+    python -m benchmarks.loadtest --traffic benchmarks/traffic/sample_bursts.jsonl --save-baseline baseline.json
+    python -m benchmarks.loadtest --traffic benchmarks/traffic/sample_bursts.jsonl --baseline baseline.json
+    python -m benchmarks.loadtest --llm fake --cpu-latency 0.05 --rate 40 --workers 8 --queue-depth 100 --processes 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from benchmarks.common import load_traffic, make_bot, percentile
+from benchmarks.fakes import FakeChat, FakeLLM, FakeSearch, make_message, make_stream_update
+from benchmarks.stub_ollama import StubOllamaServer
+from tools import SearchClient
+
+COMMON_QUESTIONS = ['what game is this?', 'What game is this', 'what are the specs?', 'how long is the stream?']
+TOOL_QUESTIONS = ['what time is it for you?', 'search for the speedrun world record']
+CATEGORIES = ['Just Chatting', 'Hades', 'Celeste', 'Factorio']
+FALLBACKS = ('error', 'llm_error', 'timeout')
+TURNED_AWAY = ('coalesced', 'rate_limited', 'busy')
+
+# Results compared with --baseline, and how much worse each may be on top of --tolerance to allow for noise
+HIGHER_IS_WORSE = {'p99': 0.05, 'loop_lag_p99': 0.005, 'memory_growth_mb': 2.0, 'fallbacks': 1}
+LOWER_IS_WORSE = {'throughput': 0.0, 'answered': 1}
+
+
+def generate_traffic(args):
+    """Synthetic chat: Poisson arrivals across channels, with repeats, tool questions and category changes."""
+    rng = random.Random(args.seed)
+    channels = ['bench_channel'] + [f"channel{index}" for index in range(1, args.channels)]
+    records = []
+    at = 0.0
+    index = 0
+    while True:
+        at += rng.expovariate(args.rate)
+        if at >= args.duration:
+            break
+        roll = rng.random()
+        if roll < args.tool_ratio:
+            question = rng.choice(TOOL_QUESTIONS)
+        elif roll < args.tool_ratio + args.dup_ratio:
+            question = rng.choice(COMMON_QUESTIONS)
+        else:
+            question = f"tell me something interesting #{index}"
+        records.append({'at': at, 'channel': rng.choice(channels), 'user': f"viewer{rng.randrange(args.users)}",
+                        'text': f"!ai {question}", 'subscriber': rng.random() < args.sub_ratio})
+        index += 1
+    if args.update_every:
+        for number, update_at in enumerate(range(int(args.update_every), int(args.duration), int(args.update_every))):
+            for channel in channels:
+                records.append({'at': float(update_at), 'channel': channel,
+                                'category': CATEGORIES[(number + 1) % len(CATEGORIES)]})
+    return sorted(records, key=lambda record: record['at'])
+
+
+def rss():
+    """Resident size of this process in bytes: current where /proc exists, else the peak so far."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak * (1 if sys.platform == 'darwin' else 1024)
+
+
+async def watch_loop(lags, interval=0.01):
+    """Record how much later than asked each short sleep wakes up; that delay is time the loop was blocked."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+def make_llm(args):
+    return FakeLLM(latency=args.latency, token_latency=args.token_latency, cpu_latency=args.cpu_latency)
+
+
+def run_worker(args):
+    """Run as one of the --processes workers, started by the replaying process with the same options."""
+    bot = make_bot(llm_host=args.llm_url, max_concurrent=args.workers)
+    if not args.llm_url:
+        bot.llm = make_llm(args)
+    bot.search = SearchClient(backend=FakeSearch(latency=args.search_latency))
+    asyncio.run(bot.run_worker(args.worker_socket))
+
+
+async def replay(args, records, llm_host=None):
+    channels = sorted({record['channel'] for record in records}) or ['bench_channel']
+    worker_command = [sys.executable, '-m', 'benchmarks.loadtest', *sys.argv[1:]]
+    if llm_host:
+        worker_command += ['--llm-url', llm_host]
+    bot = make_bot(llm_host=llm_host, channels=channels, workers=args.workers, max_concurrent=args.workers,
+                   queue_depth=args.queue_depth, stream=args.stream, batch_window=args.batch_window,
+                   processes=args.processes, worker_command=worker_command)
+    if not llm_host:
+        bot.llm = make_llm(args)
+    bot.chat = FakeChat()
+    bot.search = SearchClient(backend=FakeSearch(latency=args.search_latency))
+    if bot.workers is not None:
+        await bot.workers.start()
+    bot.metrics.enabled = True  # Only for counting outcomes; nothing is served or logged
+
+    latencies = []
+    in_progress = 0
+    handle_job, handle_batch = bot.scheduler.handler, bot.scheduler.batch_handler
+
+    async def timed_job(job, *rest):
+        nonlocal in_progress
+        in_progress += 1
+        try:
+            return await handle_job(job, *rest)
+        finally:
+            in_progress -= 1
+            latencies.append(time.monotonic() - job.enqueued_at)
+
+    async def timed_batch(jobs):
+        nonlocal in_progress
+        in_progress += len(jobs)
+        try:
+            return await handle_batch(jobs)
+        finally:
+            in_progress -= len(jobs)
+            done = time.monotonic()
+            latencies.extend(done - job.enqueued_at for job in jobs)
+
+    # A batch's unanswered questions are handled by Bot._handle_job directly, so are only counted once
+    bot.scheduler.handler = timed_job
+    if handle_batch:
+        bot.scheduler.batch_handler = timed_batch
+
+    lags = []
+    watcher = asyncio.create_task(watch_loop(lags))
+    memory_before = rss()
+    bot.scheduler.start()
+    tasks = set()
+    start = time.monotonic()
+    for record in records:
+        delay = start + record['at'] / args.speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if 'category' in record:
+            channel = bot.channels[record['channel'].lower()]
+            event = make_stream_update(channel.streamer_name, record['category'], record.get('title', ''))
+            task = asyncio.create_task(bot.on_stream_update(event))
+        else:
+            flags = {flag: record.get(flag, False) for flag in ('mod', 'subscriber', 'vip', 'broadcaster')}
+            task = asyncio.create_task(bot.on_message(make_message(record['user'], record['text'],
+                                                                   room=record['channel'], **flags)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    deadline = time.monotonic() + args.drain_timeout
+    while (tasks or len(bot.scheduler) or in_progress) and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.monotonic() - start
+    memory_after = rss()
+    watcher.cancel()
+    await bot.scheduler.stop()
+    workers = {'processes': 0, 'failed': 0}
+    if bot.workers is not None:
+        workers = bot.workers.stats()
+        await bot.workers.stop()
+
+    outcomes = bot.metrics.counts('requests_total', 'status')
+    return {
+        'messages': sum('text' in record for record in records),
+        'answered': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'cached': outcomes.get('cached', 0),
+        'fallbacks': sum(outcomes.get(status, 0) for status in FALLBACKS),
+        'turned_away': sum(outcomes.get(status, 0) for status in TURNED_AWAY),
+        'dropped': bot.scheduler.metrics['dropped'],
+        'memory_growth_mb': (memory_after - memory_before) / 2 ** 20,
+        'loop_lag_p99': percentile(lags, 99),
+        'loop_lag_max': max(lags, default=0.0),
+        'elapsed': elapsed,
+        'chat_messages': len(bot.chat.sent),
+        'drained': not (tasks or len(bot.scheduler) or in_progress),
+        'processes': workers['processes'],
+        'worker_failures': workers['failed'],
+        'reordered': bot.reply_order.metrics['waited'],
+    }
+
+
+def report(result):
+    print(f"Replayed {result['messages']} messages in {result['elapsed']:.1f}s "
+          f"({result['chat_messages']} chat messages sent{'' if result['drained'] else ', queue NOT drained'})")
+    print(f"  throughput     {result['throughput']:8.2f} answered/s")
+    print(f"  latency        p50 {result['p50']:.3f}s  p95 {result['p95']:.3f}s  p99 {result['p99']:.3f}s")
+    print(f"  outcomes       {result['answered']} answered ({result['cached']} from cache), "
+          f"{result['fallbacks']} fallback replies, {result['turned_away']} coalesced or turned away, "
+          f"{result['dropped']} dropped")
+    print(f"  memory growth  {result['memory_growth_mb']:8.2f} MiB")
+    print(f"  loop lag       p99 {result['loop_lag_p99'] * 1000:.1f} ms  max {result['loop_lag_max'] * 1000:.1f} ms")
+    if result['processes']:
+        print(f"  workers        {result['processes']} processes, {result['worker_failures']} requests answered "
+              f"here instead, {result['reordered']} replies held back to keep their channel's order")
+
+
+def check(result, args):
+    """Every limit or baseline comparison the result fails, as readable messages."""
+    failures = []
+    limits = [('p99', args.max_p99, '>'), ('loop_lag_p99', args.max_loop_lag, '>'),
+              ('memory_growth_mb', args.max_memory_growth, '>'), ('fallbacks', args.max_fallbacks, '>'),
+              ('throughput', args.min_throughput, '<')]
+    for name, limit, direction in limits:
+        if limit is None:
+            continue
+        if (result[name] > limit) if direction == '>' else (result[name] < limit):
+            failures.append(f"{name} {result[name]:.3f} {direction} limit {limit}")
+    if not result['drained']:
+        failures.append(f"requests still pending after --drain-timeout {args.drain_timeout}s")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        for name, allowance in HIGHER_IS_WORSE.items():
+            if name in baseline and result[name] > baseline[name] * (1 + args.tolerance) + allowance:
+                failures.append(f"{name} regressed: {result[name]:.3f} vs baseline {baseline[name]:.3f}")
+        for name, allowance in LOWER_IS_WORSE.items():
+            if name in baseline and result[name] < baseline[name] * (1 - args.tolerance) - allowance:
+                failures.append(f"{name} regressed: {result[name]:.3f} vs baseline {baseline[name]:.3f}")
+    return failures
+
+
+async def main_async(args):
+    records = load_traffic(args.traffic) if args.traffic else generate_traffic(args)
+    if args.llm == 'fake':
+        return await replay(args, records)
+    with StubOllamaServer(latency=args.latency, token_latency=args.token_latency, tool_calls=True) as server:
+        return await replay(args, records, llm_host=server.url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    traffic = parser.add_argument_group('traffic')
+    traffic.add_argument('--traffic', type=str, help='Recorded traffic to replay instead of generating it')
+    traffic.add_argument('--speed', type=float, default=1.0, help='Replay this many times faster (default: 1)')
+    traffic.add_argument('--rate', type=float, default=10, help='Generated !ai messages per second (default: 10)')
+    traffic.add_argument('--duration', type=float, default=10, help='Seconds of generated traffic (default: 10)')
+    traffic.add_argument('--channels', type=int, default=2, help='Generated channels (default: 2)')
+    traffic.add_argument('--users', type=int, default=200, help='Distinct generated chatters (default: 200)')
+    traffic.add_argument('--sub-ratio', type=float, default=0.25, help='Share of messages from subs (default: 0.25)')
+    traffic.add_argument('--dup-ratio', type=float, default=0.3, help='Share of repeated questions (default: 0.3)')
+    traffic.add_argument('--tool-ratio', type=float, default=0.1, help='Share of questions needing a tool (default: 0.1)')
+    traffic.add_argument('--update-every', type=float, default=5, help='Seconds between category changes (0: none)')
+    traffic.add_argument('--seed', type=int, default=1)
+
+    bot = parser.add_argument_group('bot and model')
+    bot.add_argument('--llm', choices=['stub', 'fake'], default='stub',
+                     help='Stub Ollama server over HTTP, or an in-process fake (default: stub)')
+    bot.add_argument('--latency', type=float, default=0.1, help='Model seconds before the first word (default: 0.1)')
+    bot.add_argument('--token-latency', type=float, default=0.01, help='Model seconds per word (default: 0.01)')
+    bot.add_argument('--search-latency', type=float, default=0.2, help='Fake search seconds (default: 0.2)')
+    bot.add_argument('--workers', type=int, default=2, help='Scheduler workers (default: 2)')
+    bot.add_argument('--queue-depth', type=int, default=20, help='Scheduler queue depth (default: 20)')
+    bot.add_argument('--stream', action='store_true', help='Stream replies')
+    bot.add_argument('--batch-window', type=float, default=0.0, help='Batch questions (default: 0, off)')
+    bot.add_argument('--cpu-latency', type=float, default=0.0,
+                     help='CPU seconds each model call takes in the process making it (--llm fake; default: 0)')
+    bot.add_argument('--processes', type=int, default=0,
+                     help='Worker processes generating the replies (default: 0, all in one process)')
+    bot.add_argument('--worker-socket', type=str, help=argparse.SUPPRESS)  # Set for the --processes workers
+    bot.add_argument('--llm-url', type=str, help=argparse.SUPPRESS)  # The stub server, for the --processes workers
+    bot.add_argument('--drain-timeout', type=float, default=60, help='Maximum seconds to wait for the queue to drain')
+
+    limits = parser.add_argument_group('regression limits')
+    limits.add_argument('--max-p99', type=float, help='Fail if p99 latency exceeds this many seconds')
+    limits.add_argument('--min-throughput', type=float, help='Fail if fewer requests than this are answered per second')
+    limits.add_argument('--max-loop-lag', type=float, help='Fail if p99 event loop lag exceeds this many seconds')
+    limits.add_argument('--max-memory-growth', type=float, help='Fail if memory grows by more than this many MiB')
+    limits.add_argument('--max-fallbacks', type=int, help='Fail if more than this many fallback replies are sent')
+    limits.add_argument('--baseline', type=str, help='Fail if results are worse than this earlier run')
+    limits.add_argument('--tolerance', type=float, default=0.2,
+                        help='Share by which results may be worse than the baseline (default: 0.2)')
+    limits.add_argument('--save-baseline', type=str, help='Write this run\'s results to a file for --baseline')
+    args = parser.parse_args()
+    if args.worker_socket:
+        run_worker(args)
+        return
+
+    result = asyncio.run(main_async(args))
+    report(result)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    failures = check(result, args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("PASS")
+
+
+if __name__ == '__main__':
+    main()
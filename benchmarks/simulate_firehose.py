@@ -0,0 +1,100 @@
+"""Drives Bot.on_message with a simulated chat spike and a fake LLM.
+
+Messages arrive at `--rate` per second for `--duration` seconds from a mix of
+viewers, subscribers and mods, with a share of repeated questions. The run then
+waits for the queue to drain and prints the scheduler's metrics and the reply
+latency for each priority lane.
+
+    python -m benchmarks.simulate_firehose --rate 20 --duration 10 --llm-latency 0.5
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import make_bot, percentile
+from benchmarks.fakes import FakeChat, FakeLLM, make_message
+from scheduler import POLICY_DROP_OLDEST, POLICY_REJECT, PRIORITY_LANES
+
+LANE_NAMES = {0: 'broadcaster', 1: 'mod', 2: 'sub/vip', 3: 'viewer'}
+COMMON_QUESTIONS = ['what game is this?', 'What game is this', 'what are the specs?', 'how long is the stream?']
+
+
+def random_message(rng, args, index):
+    user = f"viewer{rng.randrange(args.users)}"
+    roll = rng.random()
+    kind = {}
+    if roll < args.mod_ratio:
+        kind['mod'] = True
+    elif roll < args.mod_ratio + args.sub_ratio:
+        kind['subscriber'] = True
+    if rng.random() < args.dup_ratio:
+        question = rng.choice(COMMON_QUESTIONS)
+    else:
+        question = f"tell me something interesting #{index}"
+    return make_message(user, f"!ai {question}", **kind)
+
+
+async def simulate(args):
+    bot = make_bot(workers=args.workers, queue_depth=args.queue_depth, overload_policy=args.policy,
+                   max_concurrent=args.workers)
+    bot.llm = FakeLLM(latency=args.llm_latency)
+    bot.chat = FakeChat()
+
+    latencies = {lane: [] for lane in PRIORITY_LANES}
+    handle_job = bot.scheduler.handler
+
+    async def timed_handler(job):
+        result = await handle_job(job)
+        latencies[job.priority].append(time.monotonic() - job.enqueued_at)
+        return result
+
+    bot.scheduler.handler = timed_handler
+    bot.scheduler.start()
+
+    rng = random.Random(args.seed)
+    interval = 1 / args.rate
+    start = time.monotonic()
+    sent = 0
+    while time.monotonic() - start < args.duration:
+        asyncio.create_task(bot.on_message(random_message(rng, args, sent)))
+        sent += 1
+        await asyncio.sleep(interval)
+
+    deadline = time.monotonic() + args.drain_timeout
+    while (len(bot.scheduler) or bot.llm.in_flight) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.monotonic() - start
+    await bot.scheduler.stop()
+
+    print(f"Sent {sent} messages over {args.duration}s, drained after {elapsed:.1f}s")
+    for name, value in bot.scheduler.stats().items():
+        print(f"  {name:<18} {value:.3f}" if isinstance(value, float) else f"  {name:<18} {value}")
+    print("Reply latency by lane:")
+    for lane in PRIORITY_LANES:
+        values = latencies[lane]
+        if values:
+            print(f"  {LANE_NAMES[lane]:<12} n={len(values):<5} p50 {percentile(values, 50):6.2f}s  "
+                  f"p99 {percentile(values, 99):6.2f}s")
+    print(f"LLM calls: {bot.llm.calls}, chat messages sent: {len(bot.chat.sent)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=20, help='Incoming !ai messages per second (default: 20)')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of firehose (default: 10)')
+    parser.add_argument('--users', type=int, default=200, help='Distinct chatters (default: 200)')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Fake LLM seconds per call (default: 0.5)')
+    parser.add_argument('--workers', type=int, default=2, help='Scheduler workers (default: 2)')
+    parser.add_argument('--queue-depth', type=int, default=20, help='Scheduler queue depth (default: 20)')
+    parser.add_argument('--policy', choices=[POLICY_DROP_OLDEST, POLICY_REJECT], default=POLICY_DROP_OLDEST)
+    parser.add_argument('--mod-ratio', type=float, default=0.05, help='Share of messages from mods (default: 0.05)')
+    parser.add_argument('--sub-ratio', type=float, default=0.25, help='Share of messages from subs (default: 0.25)')
+    parser.add_argument('--dup-ratio', type=float, default=0.3, help='Share of repeated questions (default: 0.3)')
+    parser.add_argument('--drain-timeout', type=float, default=60, help='Maximum seconds to wait for the queue to drain')
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(simulate(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
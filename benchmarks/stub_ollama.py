@@ -0,0 +1,249 @@
+"""A tiny stand-in for the Ollama HTTP API, used by the benchmarks.
+
+Only the endpoints the bot touches are implemented, plus the OpenAI-compatible
+/v1 equivalents so both backends can be exercised. Every request sleeps for
+`latency` seconds before answering, plus `token_latency` seconds per word of
+the reply (streamed replies send each word as it is "generated"), so the
+benchmarks can model a busy model server without needing a GPU. Setting `status`
+to an HTTP error code (e.g. 503) makes every request fail with it, to simulate an
+overloaded or restarting server. With `tool_calls=True`, questions asking for
+the time or a search are answered with a call to the bot's matching tool.
+
+Like Ollama, the stub "loads" the model on the first request, taking
+`load_latency` seconds, and unloads it once it has been idle for the request's
+`keep_alive` (default `default_keep_alive` seconds). A chat request with no
+messages only loads the model, or unloads it with keep_alive=0.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOllamaServer:
+    """Runs the stub server on a background thread.
+
+    Use as a context manager; `url` is the host to pass to AsyncClient, and
+    `openai_url` the base URL for an OpenAI-compatible client.
+    """
+
+    def __init__(self, latency=0.05, reply="Hello from the stub model!", port=0, token_latency=0.0, tool_calls=False,
+                 load_latency=0.0, default_keep_alive=300):
+        self.latency = latency
+        self.load_latency = load_latency
+        self.default_keep_alive = default_keep_alive
+        self.loaded_until = 0.0  # time.monotonic() at which the model is unloaded
+        self.loads = 0
+        self._load_lock = threading.Lock()
+        self.token_latency = token_latency
+        self.reply = reply
+        self.tool_calls = tool_calls
+        self.status = 200
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openai_url(self):
+        return f"{self.url}/v1"
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload, status=200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_lines(self, lines, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.end_headers()
+                for line in lines:
+                    self.wfile.write(line.encode())
+                    self.wfile.flush()
+
+            def do_GET(self):
+                if stub.status != 200:
+                    self._send_json({'error': 'stub failure'}, stub.status)
+                elif self.path == '/api/tags':
+                    self._send_json({'models': []})
+                elif self.path == '/v1/models':
+                    self._send_json({'object': 'list', 'data': []})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                with stub._lock:
+                    stub.requests += 1
+                if self.path == '/api/chat' and not body.get('messages'):
+                    stub.load(body.get('keep_alive'))
+                    self._send_json({'model': body.get('model', ''), 'message': {'role': 'assistant', 'content': ''},
+                                     'done': True, 'done_reason': 'unload' if stub.loaded_until == 0 else 'load'})
+                    return
+                stub.load(body.get('keep_alive'))
+                time.sleep(stub.latency)
+                if not body.get('stream', self.path == '/api/chat'):
+                    time.sleep(stub.token_latency * len(stub.content(body).split()))
+                if stub.status != 200:
+                    self._send_json({'error': 'stub failure'}, stub.status)
+                elif self.path == '/api/chat' and body.get('stream', True):
+                    self._send_lines(stub.chat_stream(body), 'application/x-ndjson')
+                elif self.path == '/api/chat':
+                    self._send_json(stub.chat_response(body))
+                elif self.path == '/v1/chat/completions' and body.get('stream'):
+                    self._send_lines(stub.openai_stream(body), 'text/event-stream')
+                elif self.path == '/v1/chat/completions':
+                    self._send_json(stub.openai_response(body))
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+    @property
+    def loaded(self):
+        return time.monotonic() < self.loaded_until
+
+    def keep_alive_seconds(self, keep_alive):
+        """Ollama's keep_alive: seconds, or a duration such as '10m'; negative keeps the model loaded forever."""
+        if keep_alive is None:
+            return self.default_keep_alive
+        if isinstance(keep_alive, str):
+            units = {'s': 1, 'm': 60, 'h': 3600}
+            if keep_alive[-1:] in units:
+                return float(keep_alive[:-1]) * units[keep_alive[-1]]
+            return float(keep_alive)
+        return keep_alive
+
+    def load(self, keep_alive):
+        """Load the model if it isn't loaded, then keep it for `keep_alive` (unloading it straight away for 0)."""
+        seconds = self.keep_alive_seconds(keep_alive)
+        with self._load_lock:
+            if seconds == 0:
+                self.loaded_until = 0.0
+                return
+            if not self.loaded:
+                time.sleep(self.load_latency)
+                self.loads += 1
+            self.loaded_until = float('inf') if seconds < 0 else time.monotonic() + seconds
+
+    def tool_call(self, body):
+        """The tool call to answer with, if tools were offered and the question asks for the time or a search."""
+        messages = body.get('messages') or []
+        if not self.tool_calls or not body.get('tools') or not messages or messages[-1].get('role') != 'user':
+            return None
+        question = messages[-1].get('content') or ''
+        if 'search for' in question.lower():
+            return {'name': 'search_internet', 'arguments': {'query': question.lower().split('search for', 1)[1].strip()}}
+        if 'what time' in question.lower():
+            return {'name': 'get_current_time', 'arguments': {}}
+        return None
+
+    def content(self, body):
+        if body.get('format') == 'json' or body.get('response_format'):
+            return '{"accepted": true}'
+        if self.tool_call(body):
+            return ''
+        return self.reply
+
+    def usage(self, body, content):
+        prompt_tokens = sum(len(message.get('content') or '') // 4 for message in body.get('messages') or [])
+        return prompt_tokens, len(content.split())
+
+    def chat_response(self, body):
+        content = self.content(body)
+        message = {'role': 'assistant', 'content': content}
+        call = self.tool_call(body)
+        if call:
+            message['tool_calls'] = [{'function': call}]
+        prompt_tokens, eval_tokens = self.usage(body, content)
+        return {
+            'model': body.get('model', ''),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'message': message,
+            'done': True,
+            'done_reason': 'stop',
+            'prompt_eval_count': prompt_tokens,
+            'eval_count': eval_tokens,
+        }
+
+    def chat_stream(self, body):
+        created_at = datetime.now(timezone.utc).isoformat()
+        content = self.content(body)
+        call = self.tool_call(body)
+        if call:
+            yield json.dumps({'model': body.get('model', ''), 'created_at': created_at, 'done': False,
+                              'message': {'role': 'assistant', 'content': '', 'tool_calls': [{'function': call}]}}) + '\n'
+        for word in content.split(' ') if content else []:
+            time.sleep(self.token_latency)
+            yield json.dumps({'model': body.get('model', ''), 'created_at': created_at,
+                              'message': {'role': 'assistant', 'content': word + ' '}, 'done': False}) + '\n'
+        prompt_tokens, eval_tokens = self.usage(body, content)
+        yield json.dumps({'model': body.get('model', ''), 'created_at': created_at,
+                          'message': {'role': 'assistant', 'content': ''}, 'done': True, 'done_reason': 'stop',
+                          'prompt_eval_count': prompt_tokens, 'eval_count': eval_tokens}) + '\n'
+
+    @staticmethod
+    def _openai_tool_calls(call):
+        return [{'index': 0, 'id': 'call_0', 'type': 'function',
+                 'function': {'name': call['name'], 'arguments': json.dumps(call['arguments'])}}]
+
+    def openai_response(self, body):
+        content = self.content(body)
+        message = {'role': 'assistant', 'content': content}
+        call = self.tool_call(body)
+        if call:
+            message['tool_calls'] = self._openai_tool_calls(call)
+        prompt_tokens, eval_tokens = self.usage(body, content)
+        return {
+            'object': 'chat.completion',
+            'model': body.get('model', ''),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': 'tool_calls' if call else 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': eval_tokens},
+        }
+
+    def openai_stream(self, body):
+        content = self.content(body)
+        call = self.tool_call(body)
+        if call:
+            chunk = {'object': 'chat.completion.chunk', 'model': body.get('model', ''),
+                     'choices': [{'index': 0, 'delta': {'tool_calls': self._openai_tool_calls(call)}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        for word in content.split(' ') if content else []:
+            time.sleep(self.token_latency)
+            chunk = {'object': 'chat.completion.chunk', 'model': body.get('model', ''),
+                     'choices': [{'index': 0, 'delta': {'content': word + ' '}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
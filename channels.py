@@ -0,0 +1,97 @@
+import asyncio
+
+from history import ChatHistory
+from persistence import HistoryLog
+from prompt_builder import PromptBuilder
+
+
+def parse_channels(login_data):
+    """Read the channels to join from login data as (channel_name, streamer_name) pairs.
+
+    `channels` may list names or objects with `channel_name` and an optional
+    `streamer_name`; without it, the single `channel_name` is used."""
+    entries = login_data.get('channels') or [login_data]
+    channels = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'channel_name': entry}
+        name = entry.get('channel_name')
+        if not name:
+            continue
+        channels.append((name, entry.get('streamer_name') or name))
+    return channels
+
+
+def history_path(history_file, channel_name, shared):
+    """Where a channel's history is saved: the --history file itself, or one file per channel when several share it."""
+    if not shared:
+        return history_file
+    return f"{history_file.removesuffix('.jsonl')}_{channel_name.lower()}.jsonl"
+
+
+class Channel:
+    """Everything the bot keeps for one Twitch channel: its chat history, prompt, stream category and title.
+
+    The LLM client, request queue, message checks and tools are shared between
+    channels, so an extra channel only costs its own history and prompt.
+    """
+
+    def __init__(self, name, streamer_name=None, history_tokens=2048, summarizer=None, history_file=None, load=True,
+                 recall=None):
+        self.name = name
+        self.streamer_name = streamer_name or name
+        self.user_id = None  # The streamer's Twitch user id, filled in by EventSub setup
+        self.live = None  # Whether the stream is live; None until known
+
+        # This is updated automatically! Do not set this manually.
+        self.current_category = ""
+        self.title = ""
+        self.prompt = ""
+        self.prompt_builder = PromptBuilder()
+        self.chat_history = ChatHistory(token_budget=history_tokens, summarizer=summarizer)
+        self.last_busy_notice = 0
+        # Index of every turn ever added, for finding earlier chat relevant to a question (see recall.py)
+        self.recall = recall
+
+        # Load chat history if file specified (now, or later with load_history), then record every new message to it
+        self.history_log = None
+        if history_file:
+            self.history_log = HistoryLog(history_file)
+            if load:
+                self._restore_history(self._read_history())
+        elif recall is not None:
+            self.chat_history.recall = recall
+
+    def _read_history(self):
+        if self.recall is not None:
+            try:
+                self.recall.load()
+            except Exception as e:
+                print(f"Error loading long-term memory for {self.name}: {e}")
+        try:
+            return self.history_log.load()
+        except Exception as e:
+            print(f"Error loading chat history for {self.name}: {e}")
+            return None, []
+
+    def _restore_history(self, saved):
+        memory, turns = saved
+        try:
+            self.chat_history.load(turns, memory)
+            print(f"Loaded {len(self.chat_history)} messages from history for {self.name}")
+        except Exception as e:
+            print(f"Error loading chat history for {self.name}: {e}")
+        self.history_log.snapshot = self.chat_history.to_records
+        self.chat_history.log = self.history_log
+        if self.recall is not None:
+            if not len(self.recall):
+                self.recall.extend(turns)  # Start the index with everything still in the history file
+            self.chat_history.recall = self.recall
+
+    async def load_history(self):
+        """Load the saved chat history, reading the file in a thread so the event loop carries on meanwhile."""
+        if self.history_log is not None and self.chat_history.log is None:
+            self._restore_history(await asyncio.to_thread(self._read_history))
+
+    def __repr__(self):
+        return f"Channel({self.name!r})"
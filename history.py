@@ -0,0 +1,177 @@
+import asyncio
+from collections import deque
+from collections.abc import Sequence
+
+from prompt_builder import PromptBuilder, estimate_tokens
+
+MEMORY_PREFIX = "Summary of the earlier conversation: "
+
+
+class ChatHistory(Sequence):
+    """Token-budgeted chat history with a rolling summary of older turns.
+
+    Turns are kept in a deque together with their token counts (including the
+    chat-template framing each message costs), so the running total is known
+    without re-tokenising anything. When the total goes over
+    `token_budget`, the oldest turns are evicted in one go until the history is
+    back under `low_water` of the budget. Evicting in chunks means the front of
+    the history (and with it the model's prompt cache) changes rarely.
+
+    Evicted turns are handed to `summarizer`, an async callable taking
+    (turns, previous_summary) and returning the new summary, which runs in the
+    background. Its result becomes a single memory message at the front of the
+    history. Without a summarizer, evicted turns are simply dropped.
+
+    Behaves as a read-only sequence of message dicts: the memory message (if any)
+    followed by the turns. If `log` is set (see persistence.HistoryLog), every new
+    turn and summary is recorded to it, and if `recall` is set (see recall.RecallIndex),
+    every new turn is indexed by it.
+    """
+
+    def __init__(self, token_budget=2048, tokenizer=estimate_tokens, summarizer=None, low_water=0.75):
+        self.token_budget = token_budget
+        self.tokenizer = tokenizer
+        self.summarizer = summarizer
+        self.low_water = low_water
+        self.max_turn_tokens = token_budget // 2
+
+        self._turns = deque()
+        self._token_counts = deque()
+        self._turn_tokens = 0
+        self.memory = None  # Memory message dict, replaced whenever the summary changes
+        self._memory_tokens = 0
+
+        self._unsummarized = []
+        self._summary_task = None
+        self.log = None
+        self.recall = None
+
+        self.evicted = 0
+        self.summaries = 0
+
+    def __len__(self):
+        return len(self._turns) + (self.memory is not None)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if self.memory is not None:
+            if index == 0:
+                return self.memory
+            index -= 1
+        return self._turns[index]
+
+    def __iter__(self):
+        if self.memory is not None:
+            yield self.memory
+        yield from self._turns
+
+    @property
+    def tokens(self):
+        return self._turn_tokens + self._memory_tokens
+
+    @property
+    def turns(self):
+        return list(self._turns)
+
+    def _truncate(self, message, tokens):
+        """Cut an oversized turn (usually a tool result) down to max_turn_tokens."""
+        content = message.get('content') or ''
+        keep = int(len(content) * self.max_turn_tokens / tokens)
+        message = dict(message, content=content[:keep] + " [...]")
+        return message, self._count(message['content'])
+
+    def _count(self, content):
+        return self.tokenizer(content) + PromptBuilder.MESSAGE_OVERHEAD
+
+    def append(self, message):
+        tokens = self._count(message.get('content') or '')
+        if tokens > self.max_turn_tokens:
+            message, tokens = self._truncate(message, tokens)
+        if self.log is not None:
+            self.log.record_turn(message)
+        if self.recall is not None:
+            self.recall.add(message)
+        self._turns.append(message)
+        self._token_counts.append(tokens)
+        self._turn_tokens += tokens
+        if self.tokens > self.token_budget:
+            self._evict()
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def load(self, turns, memory=None):
+        """Restore a saved history. Call before attaching a log so nothing is recorded twice."""
+        if memory:
+            self._set_memory(memory)
+        self.extend(turns)
+        if memory:
+            # Turns that no longer fit were written before the saved summary, which already covers them
+            self._unsummarized.clear()
+
+    def to_records(self):
+        """The current history as log records, used to compact the log."""
+        records = [{'memory': self.memory['content'][len(MEMORY_PREFIX):]}] if self.memory else []
+        records.extend({'turn': turn} for turn in self._turns)
+        return records
+
+    def _evict(self):
+        target = self.token_budget * self.low_water
+        # Always keep the newest turn; it is the one being answered
+        while len(self._turns) > 1 and self.tokens > target:
+            self._unsummarized.append(self._turns.popleft())
+            self._turn_tokens -= self._token_counts.popleft()
+            self.evicted += 1
+        self._schedule_summary()
+
+    def _schedule_summary(self):
+        if self.summarizer is None:
+            self._unsummarized.clear()
+            return
+        if self._summary_task is not None and not self._summary_task.done():
+            return  # The running summary picks up these turns when it finishes
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Loaded before the bot started; summarised on the next eviction
+        self._summary_task = loop.create_task(self._summarize())
+
+    async def _summarize(self):
+        while self._unsummarized:
+            turns, self._unsummarized = self._unsummarized, []
+            previous = self.memory['content'][len(MEMORY_PREFIX):] if self.memory else ""
+            try:
+                summary = await self.summarizer(turns, previous)
+            except Exception as e:
+                print(f"Error summarizing chat history: {e}")
+                continue
+            if summary:
+                self._set_memory(summary.strip())
+                self.summaries += 1
+                if self.tokens > self.token_budget:
+                    self._evict()
+
+    def _set_memory(self, summary):
+        if self.log is not None:
+            self.log.record_memory(summary)
+        self.memory = {'role': 'system', 'content': MEMORY_PREFIX + summary}
+        self._memory_tokens = self._count(self.memory['content'])
+
+    async def wait_for_summary(self):
+        """Wait for any background summary to finish (used on shutdown and in benchmarks)."""
+        if self._summary_task is not None:
+            await asyncio.gather(self._summary_task, return_exceptions=True)
+
+    def stats(self):
+        return {
+            'turns': len(self._turns),
+            'tokens': self.tokens,
+            'token_budget': self.token_budget,
+            'memory_tokens': self._memory_tokens,
+            'evicted': self.evicted,
+            'summaries': self.summaries,
+        }
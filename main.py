@@ -1,59 +1,169 @@
 import asyncio
 from twitchAPI.twitch import Twitch
 from twitchAPI.chat import Chat, EventData, ChatMessage, ChatEvent
-from twitchAPI.helper import first
 from twitchAPI.type import AuthScope
 from twitchAPI.oauth import UserAuthenticator, refresh_access_token
 from twitchAPI.eventsub.websocket import EventSubWebsocket
-from ollama import AsyncClient
-from duckduckgo_search import AsyncDDGS
 import json
 import os
 import argparse
 import re
+import sys
+import time
 from datetime import datetime
-import multiprocessing
+from channels import Channel, parse_channels, history_path
+from pipeline import RequestPipeline, GenerationTimeout
+from backends import LLMRouter, ModelKeeper
+from batching import batch_instruction, parse_answers
+from metrics import Metrics, NULL_TRACE
+from outbox import ChatSender, RATE_LIMITS, TIER_BOT, TIER_MOD, TIER_VIP
+from recall import RecallIndex, RECALL_PREFIX
+from streaming import ChunkedReply
+from moderation import Moderator
+from tools import tool, ToolRegistry, SearchClient
+from response_cache import SemanticCache
+from templates import PromptTemplate
+from twitch_cache import TwitchCache
+from workers import ReplyOrder, WorkerError, WorkerPool, serve
+from scheduler import (WorkScheduler, ACCEPTED, COALESCED, RATE_LIMITED, BUSY, POLICY_DROP_OLDEST, POLICY_REJECT,
+                       PRIORITY_BROADCASTER, PRIORITY_MOD, PRIORITY_SUPPORTER, PRIORITY_VIEWER)
 
 class Bot:
-    MAX_HISTORY_SIZE = 100  # Maximum number of messages to keep in history
+    HISTORY_TOKEN_BUDGET = 2048  # Approximate tokens of chat history sent to the model
+    SUMMARY_MAX_WORDS = 120  # Length limit for the rolling summary of older messages
+    GENERATION_TIMEOUT = 30  # Seconds before an LLM request is cancelled
+    MAX_CONCURRENT_REQUESTS = 4  # LLM requests allowed in flight at once
+    QUEUE_DEPTH = 20  # Maximum !ai requests waiting for a worker
+    WORKER_COUNT = 2  # Requests processed at once
+    USER_BURST = 2  # Requests a single user may make in a row...
+    USER_REFILL_SECONDS = 15  # ...and the seconds it takes to earn one more
+    BUSY_NOTICE_COOLDOWN = 30  # Minimum seconds between "busy" replies in chat
+    SEMANTIC_CACHE_THRESHOLD = 0.9  # Cosine similarity needed to reuse an earlier answer
+    SEMANTIC_CACHE_TTL = 300  # Seconds an answer may be reused for
+    SEARCH_TIMEOUT = 10  # Seconds before an internet search is abandoned
+    SEARCH_CACHE_TTL = 600  # Seconds a search result is reused for the same query
+    LLM_HEALTH_INTERVAL = 15  # Seconds between health checks of each model server
+    MAX_BATCH = 4  # Questions answered by one generation when batching
+    MAX_BATCH_WAIT = 1.0  # Seconds a question may be held back waiting for a batch to fill
+    KEEP_ALIVE = '10m'  # How long the model server is asked to keep the models loaded while live...
+    KEEP_ALIVE_INTERVAL = 120  # ...renewed this often, in seconds
+    REPLY_DEADLINE = 90  # Seconds after a question is asked that its answer may still be sent
+    RECALL_RESULTS = 3  # Earlier chat messages added to the prompt with --recall
+
+    ERROR_MESSAGE = 'There was an error processing your request. Please try again later.'
+    LLM_ERROR_MESSAGE = 'There was an error connecting to the LLM. Please try again later.'
+    TIMEOUT_MESSAGE = "Sorry, the generation took too long. Please try again later."
+
+    # Used when no --prompt file is given; the lines before the first per-channel variable are shared by all channels
+    DEFAULT_PROMPT = """
+You are {bot_name}, a chatbot on a Twitch stream alongside your host.
+You are a helpful assistant that chats with the stream chat, answers questions about the streamer's game, etc.
+You should respond to recent messages in the chat history with your response content only.
+Do not respond with anything other than your text reply.
+DO NOT use any tool calls unless necessary. ONLY use tool calls when a user specifically asks. DO NOT search the internet unecessarily.
+
+The streamer's name is {streamer_name}.
+The current game is {current_category}. If the stream is offline, feel free to chat still.
+The stream title is "{stream_title}".
+
+Example Chat:
+    viewer123: Hello bot!
+    {bot_name}: Hi there! Welcome to the stream! What game are you watching today?
+    viewer123: {streamer_name} is playing {current_category} today.
+
+The conversation history follows as chat messages.
+"""
     
-    def __init__(self, history_file=None, login_file=None, prompt_file=None, model="llama3.2:3b-instruct-q4_0"):
+    def __init__(self, history_file=None, login_file=None, prompt_file=None, model="llama3.2:3b-instruct-q4_0",
+                 max_concurrent=MAX_CONCURRENT_REQUESTS, queue_depth=QUEUE_DEPTH, workers=WORKER_COUNT,
+                 overload_policy=POLICY_DROP_OLDEST, history_tokens=HISTORY_TOKEN_BUDGET, stream=False,
+                 blocklist_file=None, embed_model=None, channels=None, llm_hosts=None, moderation_model=None,
+                 moderation_hosts=None, batch_window=0.0, max_batch=MAX_BATCH, metrics_port=None, metrics_log=None,
+                 warm_up=True, twitch_cache_file=None, vip_channels=None, chat_rate_limits=True, recall=0,
+                 processes=0, worker_command=None, accept_on_rules=False):
+        channel_list = []
         if login_file and os.path.exists(login_file):
             try:
                 with open(login_file, 'r') as f:
                     login_data = json.load(f)
                 self.app_id = login_data.get('app_id')
                 self.app_secret = login_data.get('app_secret')
-                self.channel_name = login_data.get('channel_name')
-                self.streamer_name = login_data.get('streamer_name', self.channel_name)
                 self.bot_name = login_data.get('bot_name', 'SLM_Bot')
+                channel_list = parse_channels(login_data)
                 print("Loaded credentials from login file")
             except Exception as e:
                 print(f"Error loading login file: {e}")
-                self._prompt_credentials()
+                channel_list = self._prompt_credentials()
         else:
-            self._prompt_credentials()
+            channel_list = self._prompt_credentials()
+        if channels:
+            channel_list = [(name, name) for name in channels]
+        if not channel_list:
+            raise ValueError("No channel to join: set channel_name or channels in the login file")
 
-        self.llm = AsyncClient()
+        # One router shared by every request, bounded by the pipeline, spreading them over the model servers
+        self.llm = LLMRouter.from_hosts(llm_hosts, health_interval=self.LLM_HEALTH_INTERVAL)
         self.model = model
-        self.chat_history = []
-        self.history_file = history_file
-        self.prompt_file = prompt_file
+        # Message checks can use a smaller, faster model, on servers of their own (None: same as generation)
+        self.moderation_model = moderation_model or model
+        self.moderation_llm = None
+        if moderation_hosts:
+            self.moderation_llm = LLMRouter.from_hosts(moderation_hosts, health_interval=self.LLM_HEALTH_INTERVAL)
+        self.stream = stream
 
-        # This is updated automatically! Do not set this manually.
-        self.current_category = ""
-        self.prompt = ""
-        
-        # Load chat history if file specified and exists
-        if self.history_file and os.path.exists(self.history_file):
+        blocklist = []
+        if blocklist_file:
             try:
-                with open(self.history_file, 'r') as f:
-                    self.chat_history = json.load(f)
-                print(f"Loaded {len(self.chat_history)} messages from history")
+                blocklist = Moderator.load_blocklist(blocklist_file)
+                print(f"Loaded {len(blocklist)} blocklisted terms")
             except Exception as e:
-                print(f"Error loading chat history: {e}")
-                self.chat_history = []
-        
+                print(f"Error loading blocklist: {e}")
+        self.moderator = Moderator(self._llm_check_message, blocklist=blocklist, accept_on_rules=accept_on_rules)
+        self.search = SearchClient(ttl=self.SEARCH_CACHE_TTL)
+
+        # Answers to recent questions, reused for questions that mean the same thing
+        self.embed_model = embed_model
+        self.response_cache = None
+        if embed_model:
+            self.response_cache = SemanticCache(self._embed, threshold=self.SEMANTIC_CACHE_THRESHOLD,
+                                                ttl=self.SEMANTIC_CACHE_TTL)
+        # Earlier chat relevant to each question, found in an index of everything ever said (0: off)
+        self.recall_results = recall
+        self.tools = ToolRegistry(self)
+        self.pipeline = RequestPipeline(max_concurrent=max_concurrent, timeout=self.GENERATION_TIMEOUT)
+        if processes > workers:
+            # Each scheduler worker waits on one request at a time, so fewer would leave worker processes idle
+            print(f"Answering {processes} requests at once, one per worker process, instead of {workers}")
+            workers = processes
+        self.scheduler = WorkScheduler(
+            self._handle_job,
+            workers=workers,
+            max_queue=queue_depth,
+            policy=overload_policy,
+            user_burst=self.USER_BURST,
+            user_refill_seconds=self.USER_REFILL_SECONDS,
+            # Questions arriving within batch_window of each other are answered together
+            batch_handler=self._handle_batch if batch_window > 0 and max_batch > 1 else None,
+            max_batch=max_batch,
+            batch_window=batch_window,
+            max_batch_wait=self.MAX_BATCH_WAIT
+        )
+        self.history_file = history_file
+        # The --prompt file if it can be read, reloaded whenever it is edited; otherwise the default prompt
+        self.prompt_file = prompt_file
+        self.prompt_template = PromptTemplate(self.DEFAULT_PROMPT, path=prompt_file)
+
+        # Each channel keeps its own history, prompt and category; everything above is shared
+        self.channels = {}
+        self._streamers = {}  # Streamer login -> Channel, for routing API results and EventSub events
+        for name, streamer_name in channel_list:
+            # Saved histories are loaded on start(), alongside connecting to Twitch
+            self.add_channel(name, streamer_name, history_tokens=history_tokens, load=False,
+                             history_file=history_path(history_file, name, len(channel_list) > 1) if history_file else None)
+        # The first channel is used wherever a single channel is expected
+        self.channel_name = channel_list[0][0]
+        self.streamer_name = channel_list[0][1]
+
         self.user_scope = [
             AuthScope.CHAT_READ,
             AuthScope.CHAT_EDIT,
@@ -62,167 +172,207 @@ class Bot:
             AuthScope.MODERATOR_READ_FOLLOWERS  # Added for EventSub
         ]
 
+        # Models are loaded before the first question and kept loaded while any channel is live
+        self.warm_up = warm_up
+        self.keeper = ModelKeeper(self._keep_models_loaded, interval=self.KEEP_ALIVE_INTERVAL, keep_alive=self.KEEP_ALIVE)
+        self._warm_up_task = None  # Loading the models again when a stream goes live
+        self.startup_times = {}
+        self._started_at = None
+
+        # Every chat message goes out through one queue that keeps within Twitch's rate limits
+        self.vip_channels = {name.lower() for name in vip_channels or []}
+        self.outbox = ChatSender(self._send_to_chat, tier=self._chat_tier,
+                                 limits=RATE_LIMITS if chat_rate_limits else None)
+
+        # User ids and stream status, updated by EventSub and saved so reconnects and restarts skip the API calls
+        self.twitch_cache = TwitchCache(path=twitch_cache_file)
+
+        # With processes, replies are generated and checked by that many worker processes started with
+        # worker_command (see workers.py); this process keeps the history and sends each channel's replies in order
+        self.workers = None
+        if processes:
+            self.workers = WorkerPool(worker_command, processes, timeout=3 * self.GENERATION_TIMEOUT)
+        self.reply_order = ReplyOrder()
+
+        # Timings and counters; when neither the endpoint nor the log is wanted, recording them is skipped
+        self.metrics_port = metrics_port
+        self.metrics = Metrics(enabled=bool(metrics_port or metrics_log), log_path=metrics_log)
+        self.metrics.collect('scheduler', self.scheduler.stats)
+        self.metrics.collect('pipeline', self.pipeline.stats)
+        self.metrics.collect('llm_router', lambda: self.llm.stats() if isinstance(self.llm, LLMRouter) else {})
+        self.metrics.collect('moderation', self.moderator.stats)
+        self.metrics.collect('tools', self.tools.stats)
+        self.metrics.collect('prompt_template', self.prompt_template.stats)
+        self.metrics.collect('prompt', self._prompt_stats)
+        self.metrics.collect('model_keeper', self.keeper.stats)
+        self.metrics.collect('startup_seconds', lambda: self.startup_times)
+        self.metrics.collect('twitch_cache', self.twitch_cache.stats)
+        self.metrics.collect('outbox', self.outbox.stats)
+        if self.workers is not None:
+            self.metrics.collect('workers', self.workers.stats)
+            self.metrics.collect('reply_order', self.reply_order.stats)
+        if self.response_cache is not None:
+            self.metrics.collect('response_cache', self.response_cache.stats)
+        if self.recall_results:
+            self.metrics.collect('recall', self._recall_stats)
+
         self.twitch = None
         self.chat = None
         self.eventsub = None
-        self.user_id = None
 
     def _prompt_credentials(self):
-        """Prompt user for Twitch credentials if not loaded from file."""
+        """Prompt user for Twitch credentials if not loaded from file. Returns the channel to join."""
         self.app_id = input("Enter your Twitch application ID: ")
         self.app_secret = input("Enter your Twitch application secret: ")
-        self.channel_name = input("Enter your channel name here: ")
-        self.streamer_name = input("Enter your streamer's name here (leave blank for channel name): ")
-        if not self.streamer_name:
-            self.streamer_name = self.channel_name
-
-    async def update_system_prompt(self):
-        # Load custom prompt from file if specified
-        if self.prompt_file and os.path.exists(self.prompt_file):
-            try:
-                with open(self.prompt_file, 'r') as f:
-                    template = f.read()
-                template = template.format(
-                    bot_name=self.bot_name,
-                    streamer_name=self.streamer_name,
-                    current_category=self.current_category,
-                    chat_history=self.chat_history
-                )
-                self.prompt = template.format(
-                    streamer_name=self.streamer_name,
-                    current_category=self.current_category
-                )
-                print("Loaded custom prompt template")
-            except Exception as e:
-                print(f"Error loading prompt template: {e}")
-                self._use_default_prompt()
-        else:
-            self._use_default_prompt()
+        self.bot_name = 'SLM_Bot'
+        channel_name = input("Enter your channel name here: ")
+        streamer_name = input("Enter your streamer's name here (leave blank for channel name): ")
+        return [(channel_name, streamer_name or channel_name)]
 
-    def _use_default_prompt(self):
-        """Set the default system prompt."""
-        self.prompt = f"""
-        You are {self.bot_name}, a chatbot on a Twitch stream alongside your host.
-        You are a helpful assistant that chats with the stream chat, answers questions about the streamer's game, etc.
-        You should respond to recent messages in the chat history with your response content only.
-        Do not respond with anything other than your text reply.
+    def add_channel(self, name, streamer_name=None, history_tokens=HISTORY_TOKEN_BUDGET, history_file=None, load=True):
+        """Start keeping state for another channel. Chat only joins it once connected (see on_ready)."""
+        recall = None
+        if self.recall_results:
+            # Kept next to the history file, which only holds what still fits in the prompt
+            recall = RecallIndex(path=f"{history_file.removesuffix('.jsonl')}.memory.jsonl" if history_file else None,
+                                 embed=self._embed_many if self.embed_model else None)
+        channel = Channel(name, streamer_name, history_tokens=history_tokens,
+                          summarizer=self._summarize_history, history_file=history_file, load=load, recall=recall)
+        self.channels[name.lower()] = channel
+        self._streamers[channel.streamer_name.lower()] = channel
+        return channel
 
-        The streamer's name is {self.streamer_name}.
-        The current game is {self.current_category}. If the stream is offline, feel free to chat still.
+    def _channel_for_streamer(self, login):
+        return self._streamers.get(login.lower())
 
-        Example Chat:
-            viewer123: Hello bot!
-            {self.bot_name}: Hi there! Welcome to the stream! What game are you watching today?
-            viewer123: {self.streamer_name} is playing {self.current_category} today.
+    async def update_system_prompt(self, channel):
+        """Render the channel's system prompt with its current category, picking up any edit to the prompt file."""
+        if not self._reload_prompt():
+            self._render_prompt(channel)
 
-        DO NOT use any tool calls unless necessary. ONLY use tool calls when a user specifically asks. DO NOT search the internet unecessarily.
+    def _reload_prompt(self):
+        """Re-render every channel's prompt if the prompt file changed. Returns True if it did."""
+        if not self.prompt_template.reload():
+            return False
+        for channel in self.channels.values():
+            self._render_prompt(channel)
+        return True
 
-        The conversation history is as follows:
-        {self.chat_history}
-        """
+    def _render_prompt(self, channel):
+        channel.prompt = self.prompt_template.render(
+            bot_name=self.bot_name,
+            streamer_name=channel.streamer_name,
+            channel_name=channel.name,
+            current_category=channel.current_category,
+            stream_title=channel.title or "[No Stream Title]"
+        )
+
+    def _build_messages(self, channel, context=None):
+        """The system prompt followed by the channel's chat history, as sent to the model.
+
+        `context` (see _recall) goes just before the newest message, leaving the prefix the model server has cached unchanged."""
+        self._reload_prompt()
+        return self._with_context(channel.prompt_builder.build(channel.prompt, channel.chat_history), context)
+
+    @staticmethod
+    def _with_context(messages, context):
+        return messages[:-1] + [context] + messages[-1:] if context else messages
 
     async def on_ready(self, ready_event: EventData):
         """Called when the chat connection is ready."""
+        names = [channel.name for channel in self.channels.values()]
         try:
-            await self.chat.join_room(self.channel_name)
-            print(f'Connected to {self.channel_name}\'s chat')
+            # One connection joins every channel
+            await self.chat.join_room(names)
+            print(f'Connected to {", ".join(names)}\'s chat')
+        except Exception as e:
+            print(f'Failed to connect to {", ".join(names)}\'s chat: {e}')
+            return
 
-            # Get current game from Twitch API
-            try:
-                stream = await first(self.twitch.get_streams(user_login=self.streamer_name))
-                if stream:
-                    self.current_category = stream.game_name
-                    print(f"Detected game: {self.current_category}")
-                else:
-                    self.current_category = "[Stream Offline]"
-                    print("Stream appears to be offline")
-            except Exception as e:
-                self.current_category = "[Unknown Category]"
-                print(f"Could not detect current category: {e}")
+        # Get current games from the cache, or the Twitch API for streams it doesn't know about
+        streams = await self.twitch_cache.stream_info([channel.streamer_name for channel in self.channels.values()])
+        for channel in self.channels.values():
+            self._apply_stream(channel, streams.get(channel.streamer_name.lower()))
 
-            # Update system prompt with new game information
-            await self.update_system_prompt()
+        # Update system prompts with new game information
+        for channel in self.channels.values():
+            print(f"Detected game for {channel.name}: {channel.current_category}")
+            await self.update_system_prompt(channel)
+        await self._update_model_keeper()
+        if self._started_at is not None and 'joined' not in self.startup_times:
+            self.startup_times['joined'] = time.monotonic() - self._started_at
+            print(f"Joined chat {self.startup_times['joined']:.2f}s after starting")
 
-        except Exception as e:
-            print(f'Failed to connect to {self.channel_name}\'s chat: {e}')
+    def _apply_stream(self, channel, stream):
+        """Set a channel's live status, category and title from a TwitchCache stream status (None if unknown)."""
+        if stream is None or stream['live'] is None:
+            channel.live = None
+            self._set_category(channel, "[Unknown Category]")
+        elif stream['live']:
+            channel.live = True
+            self._set_category(channel, stream['category'] or "[No Stream Category]")
+        else:
+            channel.live = False
+            self._set_category(channel, "[Stream Offline]")
+        channel.title = (stream or {}).get('title') or ""
+
+    def _set_category(self, channel, category):
+        """Change a channel's category, forgetting cached answers about the old one. Returns the old category."""
+        old_category = channel.current_category
+        channel.current_category = category
+        if old_category != category and self.response_cache is not None:
+            self.response_cache.invalidate((channel.name, old_category))
+        return old_category
 
     async def save_history(self):
-        """Save chat history to file if history_file is specified."""
-        if self.history_file:
-            try:
-                # Create directory if it doesn't exist
-                os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
-                with open(self.history_file, 'w') as f:
-                    json.dump(self.chat_history, f, indent=2)
-            except Exception as e:
-                print(f"Error saving chat history: {e}")
+        """Write any unsaved chat history to file if history_file is specified.
+
+        New messages are recorded as they are added and written in the background,
+        so this only needs calling to force an immediate write."""
+        for channel in self.channels.values():
+            if channel.history_log:
+                try:
+                    await channel.history_log.flush()
+                except Exception as e:
+                    print(f"Error saving chat history for {channel.name}: {e}")
 
+    @tool('Skips the tool call and sends a message to the user.', name='respond_to_user', timeout=1)
     async def null_tool_call(self):
         return ''
 
+    @tool(
+        'Search the internet using DuckDuckGo. Returns up to 3 results. To be used only when a chat user asks for an internet search.',
+        parameters={
+            'query': {
+                'type': 'string',
+                'description': 'The query to search for.'
+            }
+        },
+        required=['query'],
+        timeout=SEARCH_TIMEOUT
+    )
     async def search_internet(self, query):
-        results = await AsyncDDGS().atext(query, max_results=3)
-        return results
+        return await self.search.text(query)
 
+    @tool('Returns the current time in UTC. To be used only when a chat user asks for the current time.', timeout=1)
     async def get_current_time(self):
         return datetime.now().isoformat()
 
     def _get_available_tools(self):
-        return [
-            {
-                'type': 'function',
-                'function': {
-                    'name': 'respond_to_user',
-                    'description': 'Skips the tool call and sends a message to the user.',
-                    'parameters': {
-                        'type': 'object',
-                        'properties': {},
-                    },
-                    'required': []
-                }
-            },
-            {
-                'type': 'function',
-                'function': {
-                    'name': 'search_internet',
-                    'description': 'Search the internet using DuckDuckGo. Returns up to 3 results. To be used only when a chat user asks for an internet search.',
-                    'parameters': {
-                        'type': 'object',
-                        'properties': {
-                            'query': {
-                                'type': 'string',
-                                'description': 'The query to search for.'
-                            }
-                        },
-                    },
-                    'required': ['query']
-                }
-            },
-            {
-                'type': 'function',
-                'function': {
-                    'name': 'get_current_time',
-                    'description': 'Returns the current time in UTC. To be used only when a chat user asks for the current time.',
-                    'parameters': {
-                        'type': 'object',
-                        'properties': {},
-                    },
-                    'required': []
-                }
-            }
-        ]
+        return self.tools.schemas()
 
-    async def _get_llm_response(self, llm_results):
+    async def _get_llm_response(self, messages, trace=NULL_TRACE):
         # Get response from LLM
         try:
             response = await self.llm.chat(
                 model=self.model, 
-                messages=[{'role': 'system', 'content': self.prompt}] + self.chat_history,
+                messages=messages,
                 tools = self._get_available_tools(),
                 options={
                     'temperature': 0.2
                 }
             )
+            self.metrics.record_llm(response, trace)
             response_text = response['message']['content']
             try:
                 response_tools = response['message']['tool_calls']
@@ -230,18 +380,139 @@ class Bot:
                 response_tools = []
         except Exception as e:
             print(f"Error connecting to LLM: {e}")
-            response_text = 'There was an error connecting to the LLM. Please try again later.'
+            self.metrics.inc('errors_total', stage='llm')
+            response_text = self.LLM_ERROR_MESSAGE
             response_tools = []
 
-        llm_results['response_text'] = response_text
-        llm_results['response_tools'] = response_tools
         return response_text, response_tools
 
+    async def _stream_llm_response(self, messages, on_text, trace=NULL_TRACE):
+        """Like _get_llm_response, but streams the reply, passing each piece of text to on_text as it arrives."""
+        response_text = ''
+        response_tools = []
+        try:
+            stream = await self.llm.chat(
+                model=self.model,
+                messages=messages,
+                tools=self._get_available_tools(),
+                options={
+                    'temperature': 0.2
+                },
+                stream=True
+            )
+            async for part in stream:
+                content = part['message'].get('content') or ''
+                if content:
+                    response_text += content
+                    on_text(content)
+                response_tools.extend(part['message'].get('tool_calls') or [])
+                if part.get('done'):
+                    self.metrics.record_llm(part, trace)
+        except Exception as e:
+            print(f"Error connecting to LLM: {e}")
+            self.metrics.inc('errors_total', stage='llm')
+
+        return response_text, response_tools
+
+    async def _embed(self, text):
+        response = await self.llm.embed(model=self.embed_model, input=text)
+        return response['embeddings'][0]
+
+    async def _embed_many(self, texts):
+        response = await self.llm.embed(model=self.embed_model, input=texts)
+        return response['embeddings']
+
+    async def _recall(self, channel, question, embedding=None):
+        """A system message quoting the earlier chat most relevant to a question, or None.
+
+        `embedding` is the question's embedding from the response cache, if it has one.
+        Messages still in the chat history the model sees are left out."""
+        if channel.recall is None:
+            return None
+        vector = embedding
+        if vector is None and channel.recall.embed is not None:
+            try:
+                vector = await self.pipeline.run(channel.recall.query_vector, question, timeout=5)
+            except GenerationTimeout:
+                pass
+        in_history = sum(1 for turn in channel.chat_history.turns if turn['role'] in ('user', 'assistant'))
+        texts = channel.recall.search(question, k=self.recall_results, vector=vector, exclude_last=in_history)
+        if not texts:
+            return None
+        return {'role': 'system', 'content': RECALL_PREFIX + '\n'.join(texts)}
+
+    def _prompt_stats(self):
+        """Prompt tokens sent and reused from the previous call, over all channels (see PromptBuilder)."""
+        totals = {}
+        for channel in self.channels.values():
+            for key, value in channel.prompt_builder.stats().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _recall_stats(self):
+        totals = {}
+        for channel in self.channels.values():
+            if channel.recall is not None:
+                for key, value in channel.recall.stats().items():
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    async def _find_cached_reply(self, question, category):
+        """Look for a recent answer to the same question. Returns (answer or None, question embedding or None).
+
+        `category` should include the channel, as answers often mention the streamer."""
+        if self.response_cache is None:
+            return None, None
+        try:
+            embedding = await self.pipeline.run(self.response_cache.embedding, question, timeout=5)
+        except Exception as e:
+            print(f"Error embedding question: {e}")
+            return None, None
+        return self.response_cache.lookup(embedding, category), embedding
+
+    def _remember_reply(self, embedding, category, response_text, job):
+        """Cache a generated answer unless it is one of the canned error replies."""
+        if embedding is None or response_text in (self.ERROR_MESSAGE, self.LLM_ERROR_MESSAGE, self.TIMEOUT_MESSAGE):
+            return
+        self.response_cache.store(embedding, category, response_text, cost=time.monotonic() - job.started_at)
+
+    async def _summarize_history(self, turns, previous_summary):
+        """Fold messages that fell out of the history window into a short running summary."""
+        summary_prompt = f"""
+        You summarize Twitch chat for a chatbot's memory.
+        Combine the existing summary and the new messages into one summary of at most {self.SUMMARY_MAX_WORDS} words.
+        Keep names of chatters, questions still unanswered, and facts about the stream. Drop greetings and small talk.
+        Respond with the summary text only.
+        """
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        response = await self.pipeline.run(
+            self.llm.chat,
+            model=self.model,
+            messages=[
+                {'role': 'system', 'content': summary_prompt},
+                {'role': 'user', 'content': f"Existing summary: {previous_summary or '(none)'}\n\nNew messages:\n{transcript}"}
+            ],
+            options={
+                'temperature': 0.2,
+                'num_predict': self.SUMMARY_MAX_WORDS * 2
+            }
+        )
+        self.metrics.record_llm(response, role='summary')
+        print(f"Summarized {len(turns)} older messages")
+        return response['message']['content']
+
     async def check_message(self, msg: str):
-        """Checks the LLM generated message content with another LLM to:
+        """Checks the LLM generated message content to:
         1. Ensure the message is not harmful or illegal,
         2. Make sure the message is actually a message, and not JSON,
-        3. Check that no other errors are present. """
+        3. Check that no other errors are present.
+
+        Cheap local rules reject leaks and blocklisted terms, and a cache of earlier verdicts
+        settles repeats; the rest go to the LLM moderator (only ambiguous ones with accept_on_rules)."""
+        return await self.moderator.check(msg)
+
+    async def _llm_check_message(self, msg: str):
+        """Ask the LLM whether a message is OK to send. Returns None if no verdict could be had."""
 
         check_prompt = f"""
         You are a message-checking system for an AI chatbot.
@@ -254,25 +525,42 @@ class Bot:
         """
 
         try:
-            response = await self.llm.chat(
-                model=self.model, 
+            response = await self.pipeline.run(
+                (self.moderation_llm or self.llm).chat,
+                model=self.moderation_model,
                 messages=[{'role': 'system', 'content': check_prompt}, {'role': 'user', 'content': msg}],
+                format='json',
                 options={
                     'temperature': 0.2
                 }
             )
+            self.metrics.record_llm(response, role='moderation')
             response_text = response['message']['content']
-            print(f"Checked message: {response_text}")
+            print(f"Checked message (llm): {response_text}")
+        except GenerationTimeout:
+            print("Message check timed out")
+            self.metrics.inc('timeouts_total', stage='check')
+            return None
         except Exception as e:
             print(f"Error checking message: {e}")
-            return False
+            self.metrics.inc('errors_total', stage='check')
+            return None
 
-        try:
-            response = json.loads(response_text)
-            return response['accepted']
-        except Exception as e:
-            print(f"Error checking message: {e}")
-            return False
+        verdict = Moderator.parse_verdict(response_text)
+        if verdict is None:
+            print(f"Error checking message: no verdict in {response_text!r}")
+        return verdict
+
+    def _get_priority(self, msg: ChatMessage):
+        """Work out which queue lane a chatter's request belongs in."""
+        badges = msg.user.badges or {}
+        if 'broadcaster' in badges or msg.user.name.lower() == msg.room.name.lower():
+            return PRIORITY_BROADCASTER
+        if msg.user.mod:
+            return PRIORITY_MOD
+        if msg.user.subscriber or msg.user.vip:
+            return PRIORITY_SUPPORTER
+        return PRIORITY_VIEWER
 
     async def on_message(self, msg: ChatMessage):
         """Called when a message is received in chat."""
@@ -280,152 +568,487 @@ class Bot:
         if not msg.text.startswith('!ai'):
             return
 
+        channel = self.channels.get(msg.room.name.lower())
+        if channel is None:
+            return
+
+        trace = self.metrics.trace()
+        if getattr(msg, 'sent_timestamp', None):
+            # Time from Twitch receiving the message to the bot seeing it
+            trace.add('receive', max(0.0, time.time() - msg.sent_timestamp / 1000))
         msg.text = msg.text[4:].strip()
 
-        print(f"Received message from {msg.user.name}: {msg.text}")
+        print(f"Received message from {msg.user.name} in {channel.name}: {msg.text}")
+
+        # Queue the request; the scheduler's workers call _handle_job
+        priority = self._get_priority(msg)
+        trace.set(channel=channel.name, user=msg.user.name, priority=priority)
+        status, job = await self.scheduler.submit(msg.user.name, msg.text, priority=priority,
+                                                  payload=trace, channel=channel.name.lower())
+        if status != ACCEPTED:
+            self.metrics.inc('requests_total', status=status)
+        if status == COALESCED:
+            print(f"Merged {msg.user.name}'s question with a queued duplicate")
+        elif status == RATE_LIMITED:
+            print(f"Ignoring {msg.user.name}: too many requests")
+        elif status == BUSY:
+            print(f"Queue full, turning away {msg.user.name}")
+            now = time.monotonic()
+            if now - channel.last_busy_notice >= self.BUSY_NOTICE_COOLDOWN:
+                channel.last_busy_notice = now
+                await self._send(channel, f"@{msg.user.name} I'm a bit busy right now, please try again later!",
+                                 mentions=[msg.user.name])
+
+    async def _send_to_chat(self, channel_name, text):
+        await self.chat.send_message(channel_name, text)
+
+    def _chat_tier(self, channel_name):
+        """How fast the bot may send in a channel: as its broadcaster or a moderator, a VIP or a regular user."""
+        if channel_name.lower() == self.bot_name.lower() or (self.chat is not None and self.chat.is_mod(channel_name)):
+            return TIER_MOD
+        if channel_name.lower() in self.vip_channels:
+            return TIER_VIP
+        return TIER_BOT
+
+    async def _send(self, channel, text, mentions=(), deadline=None, trace=NULL_TRACE, turn=None):
+        """Send a message to a channel's chat through the outbox. Returns False if it was dropped instead.
+
+        With a `turn` (see workers.ReplyOrder), the channel's earlier replies are sent first."""
+        if turn is not None:
+            with trace.span('reply_order'):
+                await self.reply_order.wait(turn, deadline - time.monotonic())
+        with trace.span('send'):
+            delay = await self.outbox.send(channel.name, text, mentions=mentions, deadline=deadline)
+        if delay is None:
+            return False
+        trace.add('send_queue', delay)
+        self.metrics.observe('send_queue_seconds', delay)
+        return True
+
+    def _reply_deadline(self, job):
+        return job.enqueued_at + self.REPLY_DEADLINE
+
+    def _job_channel(self, job):
+        return self.channels[job.channel] if job.channel else self.channels[self.channel_name.lower()]
+
+    async def _handle_job(self, job, lookup=None):
+        """Generate, check and send the reply to one queued request.
+
+        `lookup` is the result of _find_cached_reply, if it has already been done."""
+        if self.workers is None:
+            await self._answer_job(job, lookup)
+            return
+        # Worker processes finish in any order, but each channel's replies go out (and into the history) in turn
+        key = self._job_channel(job).name.lower()
+        turn = self.reply_order.take(key)
+        try:
+            await self._answer_job(job, lookup, turn)
+        finally:
+            self.reply_order.release(key, turn)
+
+    async def _answer_job(self, job, lookup=None, turn=None):
+        channel = self._job_channel(job)
+        trace = job.payload or NULL_TRACE
+        trace.add('queue', job.queue_wait)
 
         # Add user message to chat history
-        self.chat_history.append({
+        channel.chat_history.append({
             'role': 'user', 
-            'content': f"{msg.user.name}: {msg.text}"
+            'content': f"{', '.join(job.users)}: {job.text}"
         })
+        # Taken before any await: other requests from the channel may add their questions while this one is answered
+        messages = self._build_messages(channel)
+
+        # Everyone whose question was merged into this one gets a mention
+        mention = ' '.join('@' + user for user in job.users) if len(job.users) > 1 else ''
+
+        category = (channel.name, channel.current_category)
+        with trace.span('cache'):
+            cached_text, embedding = lookup or await self._find_cached_reply(job.text, category)
+        if cached_text is not None:
+            print(f"Answering from cache: {cached_text}")
+            if not await self._send(channel, f"{mention} {cached_text}".strip(), mentions=job.users,
+                                    deadline=self._reply_deadline(job), trace=trace, turn=turn):
+                self.metrics.finish(trace, status='dropped')
+                return
+            with trace.span('persist'):
+                channel.chat_history.append({
+                    'role': 'assistant',
+                    'content': f"{self.bot_name}: {cached_text}"
+                })
+            self.metrics.finish(trace, status='cached')
+            return
+
+        with trace.span('recall'):
+            context = await self._recall(channel, job.text, embedding)
+        messages = self._with_context(messages, context)
+
+        if self.stream:
+            response_text, cacheable = await self._stream_reply(channel, job, mention, messages, trace)
+            if cacheable:
+                self._remember_reply(embedding, category, response_text, job)
+            self.metrics.finish(trace, status=self._reply_status(response_text))
+            return
+
+        response_text = None
+        if self.workers is not None:
+            try:
+                # Leave time to answer here before the deadline if the workers can't, when there is enough for both
+                remaining = self._reply_deadline(job) - time.monotonic()
+                timeout = remaining - self.GENERATION_TIMEOUT if remaining > 2 * self.GENERATION_TIMEOUT else remaining
+                response_text, tool_messages = await self.workers.generate_reply(messages, trace, timeout=timeout)
+            except WorkerError as e:
+                self.metrics.inc('errors_total', stage='worker')
+                if time.monotonic() >= self._reply_deadline(job):
+                    print(f"Dropping a reply no worker process gave in time: {e}")
+                    self.metrics.finish(trace, status='dropped')
+                    return
+                print(f"Answering in this process instead of a worker: {e}")
+        if response_text is None:
+            response_text, tool_messages = await self._generate_reply(messages, trace)
+
+        # Answers that needed tools are too situational to cache
+        if not tool_messages:
+            self._remember_reply(embedding, category, response_text, job)
+        status = self._reply_status(response_text)
+
+        if mention:
+            response_text = f"{mention} {response_text.strip()}"
         
-        # Keep only the most recent messages
-        if len(self.chat_history) > self.MAX_HISTORY_SIZE:
-            self.chat_history = self.chat_history[-self.MAX_HISTORY_SIZE:]
+        # Send response to chat; a reply that waited too long to be sent isn't added to the history
+        if not await self._send(channel, response_text, mentions=job.users, deadline=self._reply_deadline(job),
+                                trace=trace, turn=turn):
+            self.metrics.finish(trace, status='dropped')
+            return
 
-        # Get response from LLM
-        def generate_response(llm_results):
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            response_text, response_tools = loop.run_until_complete(self._get_llm_response(llm_results))
-            llm_results['response_text'] = response_text
-            llm_results['response_tools'] = response_tools
-
-        llm_results = multiprocessing.Manager().dict()
-        response_process = multiprocessing.Process(target=generate_response, args=(llm_results,))
-        response_process.start()
-        response_process.join(timeout=30)  # Wait for 30 seconds
-
-        if response_process.is_alive():
-            response_process.terminate()  # Terminate the process if it exceeds the time limit
-            response_text = "Sorry, the generation took too long. Please try again later."
+        # Add the tool results and bot's response to chat history
+        with trace.span('persist'):
+            for message in tool_messages:
+                channel.chat_history.append(message)
+            channel.chat_history.append({
+                'role': 'assistant',
+                'content': f"{self.bot_name}: {response_text}"
+            })
+        self.metrics.finish(trace, status=status)
+
+    async def _generate_reply(self, messages, trace=NULL_TRACE):
+        """Generate a reply to `messages`, running any tools the model asks for and generating again, then check it.
+
+        Returns the reply (a canned one if generation failed or the check rejected it) and the
+        tool result messages, for the caller to add to the history. Runs in the worker processes
+        with --processes."""
+        try:
+            with trace.span('llm'):
+                response_text, response_tools = await self.pipeline.run(self._get_llm_response, messages, trace)
+        except GenerationTimeout:
+            self.metrics.inc('timeouts_total', stage='llm')
+            response_text = self.TIMEOUT_MESSAGE
             response_tools = []
-        else:
-            response_text = llm_results['response_text']
-            response_tools = llm_results['response_tools']
 
         print(f"Generated response: {response_text}")
         print(f"Generated tools: {response_tools}")
 
+        tool_messages = []
         if response_tools:
-            for tool in response_tools:
-                if tool['function']['name'] == 'respond_to_user':
-                    tool_response = await self.null_tool_call()
-                    self.chat_history.append({
-                        'role': 'tool',
-                        'content': f"Null tool call was used."
-                    })
-                if tool['function']['name'] == 'search_internet':
-                    query = tool['function']['arguments']['query']
-                    try:
-                        tool_response = await self.search_internet(query)
-                        self.chat_history.append({
-                            'role': 'tool',
-                            'content': f"Tool {tool['function']['name']} returned {len(tool_response)} results. Results: {tool_response}"
-                        })
-                    except Exception as e:
-                        print(f"Error searching internet: {e}")
-                        self.chat_history.append({
-                            'role': 'tool',
-                            'content': f"Tool {tool['function']['name']} returned an error: {e}"
-                        })
-                if tool['function']['name'] == 'get_current_time':
-                    try:
-                        tool_response = await self.get_current_time()
-                        self.chat_history.append({
-                            'role': 'tool',
-                            'content': f"Tool {tool['function']['name']} returned {tool_response}"
-                        })
-                    except Exception as e:
-                        print(f"Error getting current time: {e}")
-                        self.chat_history.append({
-                            'role': 'tool',
-                            'content': f"Tool {tool['function']['name']} returned an error: {e}"
-                        })
-            response_text, _ = await self._get_llm_response(llm_results)
+            with trace.span('tools'):
+                tool_messages = await self.tools.run(response_tools)
+            try:
+                with trace.span('llm2'):
+                    response_text, _ = await self.pipeline.run(self._get_llm_response, messages + tool_messages, trace)
+            except GenerationTimeout:
+                self.metrics.inc('timeouts_total', stage='llm2')
+                response_text = self.TIMEOUT_MESSAGE
 
         if len(response_text) == 0:
-            response_text = 'There was an error processing your request. Please try again later.'
+            response_text = self.ERROR_MESSAGE
 
-        response_text = re.sub(rf"^{re.escape(self.bot_name)}:", "", response_text, flags=re.MULTILINE)
+        response_text = self._strip_bot_name(response_text)
 
         print(f"Sending response: {response_text}")
 
         # Check if message is OK to send
-        if not await self.check_message(response_text):
-            response_text = 'There was an error processing your request. Please try again later.'
-            response_tools = []
-        
-        # Send response to chat
-        await self.chat.send_message(self.channel_name, response_text)
-        
+        with trace.span('check'):
+            accepted = await self.check_message(response_text)
+        if not accepted:
+            response_text = self.ERROR_MESSAGE
+        return response_text, tool_messages
+
+    def _reply_status(self, response_text):
+        """'ok', or which canned reply was sent instead of an answer, counting it as a fallback."""
+        kind = {
+            self.ERROR_MESSAGE: 'error',
+            self.LLM_ERROR_MESSAGE: 'llm_error',
+            self.TIMEOUT_MESSAGE: 'timeout'
+        }.get(response_text.strip())
+        if kind is None:
+            return 'ok'
+        self.metrics.inc('fallbacks_total', kind=kind)
+        return kind
+
+    async def _get_batch_response(self, messages, jobs, context=None):
+        """Ask the model to answer several questions in one generation. Returns one answer (or None) per job."""
+        response = await self.llm.chat(
+            model=self.model,
+            # The questions are only added to the history once answered, so the prompt's prefix is unchanged
+            messages=messages + ([context] if context else []) + [batch_instruction(jobs)],
+            format='json',
+            options={
+                'temperature': 0.2
+            }
+        )
+        self.metrics.record_llm(response, role='batch')
+        return parse_answers(response['message']['content'], len(jobs))
+
+    async def _handle_batch(self, jobs):
+        """Answer several queued requests from the same channel with one generation.
+
+        Questions that the cache can answer, or that the model leaves unanswered (e.g.
+        because they need a tool), are handled one at a time as usual."""
+        channel = self._job_channel(jobs[0])
+        category = (channel.name, channel.current_category)
+        lookups = await asyncio.gather(*(self._find_cached_reply(job.text, category) for job in jobs))
+        batch = [(job, lookup) for job, lookup in zip(jobs, lookups) if lookup[0] is None]
+        single = [(job, lookup) for job, lookup in zip(jobs, lookups) if lookup[0] is not None]
+
+        answers = [None] * len(batch)
+        generation = 0.0
+        if len(batch) > 1:
+            start = time.monotonic()
+            try:
+                messages = self._build_messages(channel)
+                context = await self._recall(channel, ' '.join(job.text for job, _ in batch))
+                answers = await self.pipeline.run(self._get_batch_response, messages, [job for job, _ in batch], context)
+            except GenerationTimeout:
+                self.metrics.inc('timeouts_total', stage='batch')
+            except Exception as e:
+                print(f"Error generating batched response: {e}")
+                self.metrics.inc('errors_total', stage='batch')
+            generation = time.monotonic() - start
+            print(f"Answered {sum(answer is not None for answer in answers)} of {len(batch)} questions in one generation")
+
+        answered = [(job, lookup, self._strip_bot_name(answer).strip())
+                    for (job, lookup), answer in zip(batch, answers) if answer]
+        single += [(job, lookup) for (job, lookup), answer in zip(batch, answers) if not answer]
+        start = time.monotonic()
+        verdicts = await asyncio.gather(*(self.check_message(text) for _, _, text in answered))
+        checking = time.monotonic() - start
+        replies = []
+        for (job, (_, embedding), response_text), accepted in zip(answered, verdicts):
+            trace = job.payload or NULL_TRACE
+            trace.add('queue', job.queue_wait)
+            trace.add('llm', generation)
+            trace.add('check', checking)
+            trace.set(batch_size=len(batch))
+            if accepted:
+                self._remember_reply(embedding, category, response_text, job)
+            else:
+                response_text = self.ERROR_MESSAGE
+            status = self._reply_status(response_text)
+            response_text = f"{' '.join('@' + user for user in job.users)} {response_text}"
+            print(f"Sending response: {response_text}")
+            replies.append((job, trace, response_text, status))
+
+        # Sent together, so the outbox can merge answers that are waiting for the rate limit at the same time
+        sent = await asyncio.gather(*(self._send(channel, response_text, mentions=job.users,
+                                                 deadline=self._reply_deadline(job), trace=trace)
+                                      for job, trace, response_text, _ in replies))
+        for (job, trace, response_text, status), delivered in zip(replies, sent):
+            if not delivered:
+                self.metrics.finish(trace, status='dropped')
+                continue
+            with trace.span('persist'):
+                channel.chat_history.append({'role': 'user', 'content': f"{', '.join(job.users)}: {job.text}"})
+                channel.chat_history.append({'role': 'assistant', 'content': f"{self.bot_name}: {response_text}"})
+            self.metrics.finish(trace, status=status)
+
+        for job, lookup in single:
+            await self._handle_job(job, lookup)
+
+    def _strip_bot_name(self, text):
+        """Remove the '{bot_name}:' prefix the model copies from the chat history."""
+        return re.sub(rf"^{re.escape(self.bot_name)}:", "", text, flags=re.MULTILINE)
+
+    async def _stream_reply(self, channel, job, mention, messages, trace=NULL_TRACE):
+        """Stream the reply to `messages`, checking and sending it in sentence-bounded chunks while it is generated.
+
+        Returns the text that was sent and whether it is a complete answer that may be cached.
+        Chunks are checked and sent while the model is still generating, so those stages overlap 'llm'."""
+        async def check(text):
+            with trace.span('check'):
+                return await self.check_message(text)
+
+        mentioned = False
+
+        async def send(text):
+            # Only the first chunk is a reply to mention the users in; merging later ones with it would repeat them
+            nonlocal mentioned
+            mentions, mentioned = (() if mentioned else job.users), True
+            await self._send(channel, text, mentions=mentions, deadline=self._reply_deadline(job), trace=trace)
+
+        reply = ChunkedReply(
+            check=check,
+            send=send,
+            prefix=mention,
+            started_at=job.enqueued_at,
+            clean=self._strip_bot_name
+        )
+        fallback = self.ERROR_MESSAGE
+        completed = True
+        response_tools = []
+        try:
+            with trace.span('llm'):
+                _, response_tools = await self.pipeline.run(self._stream_llm_response, messages, reply.feed, trace)
+            print(f"Generated tools: {response_tools}")
+            if response_tools:
+                with trace.span('tools'):
+                    tool_messages = await self.tools.run(response_tools)
+                    for message in tool_messages:
+                        channel.chat_history.append(message)
+                with trace.span('llm2'):
+                    await self.pipeline.run(self._stream_llm_response, messages + tool_messages, reply.feed, trace)
+        except GenerationTimeout:
+            self.metrics.inc('timeouts_total', stage='llm')
+            fallback = self.TIMEOUT_MESSAGE
+            completed = False
+        except Exception:
+            await reply.cancel()
+            raise
+
+        response_text = await reply.finish(flush=completed)
+        if reply.rejected:
+            print("Stopped streaming: a chunk failed the message check")
+        if not reply.sent:
+            response_text = fallback
+            await send(f"{mention} {response_text}".strip())
+            print(f"Time to first message: {time.monotonic() - job.enqueued_at:.2f}s (fallback)")
+        else:
+            trace.set(first_message_ms=round(reply.time_to_first_message * 1000, 1), chunks=len(reply.sent))
+            print(f"Time to first message: {reply.time_to_first_message:.2f}s "
+                  f"({job.queue_wait:.2f}s queued), {len(reply.sent)} chunks sent")
+
         # Add bot's response to chat history
-        self.chat_history.append({
-            'role': 'assistant',
-            'content': f"{self.bot_name}: {response_text}"
-        })
-        
-        # Keep history within size limit after adding response
-        if len(self.chat_history) > self.MAX_HISTORY_SIZE:
-            self.chat_history = self.chat_history[-self.MAX_HISTORY_SIZE:]
-        
-        # Save history after each message if file is specified
-        await self.save_history()
+        with trace.span('persist'):
+            channel.chat_history.append({
+                'role': 'assistant',
+                'content': f"{self.bot_name}: {response_text}"
+            })
+        return response_text, completed and bool(reply.sent) and not reply.rejected and not response_tools
 
     async def setup_eventsub(self):
         """Set up EventSub for stream updates."""
         try:
-            # Get the broadcaster's user ID
-            user = await first(self.twitch.get_users(logins=[self.streamer_name]))
-            self.user_id = user.id
+            # Get the broadcasters' user IDs from the cache, or the Twitch API for any it doesn't know
+            user_ids = await self.twitch_cache.user_ids([channel.streamer_name for channel in self.channels.values()])
+            for channel in self.channels.values():
+                channel.user_id = user_ids.get(channel.streamer_name.lower())
             
-            # Initialize EventSub
+            # Initialize EventSub; one websocket carries the subscriptions for every channel
             self.eventsub = EventSubWebsocket(self.twitch)
             self.eventsub.start()
             
             # Subscribe to channel update events
-            await self.eventsub.listen_channel_update_v2(
-                broadcaster_user_id=self.user_id,
-                callback=self.on_stream_update
-            )
-            print(f"Listening for stream updates from {self.streamer_name}")
+            for channel in self.channels.values():
+                if channel.user_id is None:
+                    print(f"Could not find Twitch user {channel.streamer_name}")
+                    continue
+                await self.eventsub.listen_channel_update_v2(
+                    broadcaster_user_id=channel.user_id,
+                    callback=self.on_stream_update
+                )
+                await self.eventsub.listen_stream_online(broadcaster_user_id=channel.user_id, callback=self.on_stream_online)
+                await self.eventsub.listen_stream_offline(broadcaster_user_id=channel.user_id, callback=self.on_stream_offline)
+                self.twitch_cache.watch(channel.streamer_name)
+                print(f"Listening for stream updates from {channel.streamer_name}")
         except Exception as e:
             print(f"Failed to set up EventSub: {e}")
 
+    async def on_stream_online(self, data):
+        """Called when a stream goes live: make sure the model is loaded for it."""
+        channel = self._channel_for_streamer(data.event.broadcaster_user_login)
+        if channel is None:
+            return
+        channel.live = True
+        self.twitch_cache.update_stream(channel.streamer_name, live=True)
+        print(f"{channel.streamer_name} went live")
+        # stream.online doesn't say what's being played; the category last seen in a channel update is used
+        self._apply_stream(channel, self.twitch_cache.stream(channel.streamer_name))
+        await self.update_system_prompt(channel)
+        if not self.keeper.live and self.warm_up and (self._warm_up_task is None or self._warm_up_task.done()):
+            self._warm_up_task = asyncio.create_task(self._warm_up_models())
+        await self._update_model_keeper()
+
+    async def on_stream_offline(self, data):
+        """Called when a stream ends: once no channel is live, the model is unloaded."""
+        channel = self._channel_for_streamer(data.event.broadcaster_user_login)
+        if channel is None:
+            return
+        channel.live = False
+        self.twitch_cache.update_stream(channel.streamer_name, live=False)
+        print(f"{channel.streamer_name} went offline")
+        self._set_category(channel, "[Stream Offline]")
+        await self.update_system_prompt(channel)
+        await self._update_model_keeper()
+
+    async def _update_model_keeper(self):
+        if not self.warm_up:
+            return
+        # A channel whose state is unknown counts as live, so the model isn't unloaded by mistake
+        await self.keeper.set_live(any(channel.live is not False for channel in self.channels.values()))
+
+    def _models(self):
+        """The (client, model) pairs the bot generates with."""
+        models = [(self.llm, self.model)]
+        if self.moderation_llm or self.moderation_model != self.model:
+            models.append((self.moderation_llm or self.llm, self.moderation_model))
+        return models
+
+    async def _keep_models_loaded(self, keep_alive):
+        await asyncio.gather(*(llm.keep_alive(model, keep_alive) for llm, model in self._models()))
+
+    async def _warm_up_models(self):
+        """Load the models and prefill the start of the system prompt every channel shares, so the first reply
+        doesn't wait for either. Returns the seconds each server took, by model."""
+        prompt = self.prompt_template.static_prefix(bot_name=self.bot_name)
+        messages = [{'role': 'system', 'content': prompt}]
+        timings = await asyncio.gather(*(llm.warm_up(model, messages, keep_alive=self.KEEP_ALIVE)
+                                         for llm, model in self._models()))
+        for (_, model), servers in zip(self._models(), timings):
+            for server, seconds in servers.items():
+                print(f"Warmed up {model} on {server} in {seconds:.2f}s")
+        return timings
+
     async def on_stream_update(self, data):
         """Called when the stream information updates."""
         try:
+            channel = self._channel_for_streamer(data.event.broadcaster_user_login)
+            if channel is None:
+                return
             new_category = data.event.category_name
+            self.twitch_cache.update_stream(channel.streamer_name, category=new_category or None, title=data.event.title)
+            title_changed = data.event.title != channel.title
+            channel.title = data.event.title
             if new_category == None or len(new_category) == 0:
-                print("Stream category changed to nothing.")
+                print(f"Stream category in {channel.name} changed to nothing.")
                 new_category = "[No Stream Category]"
-                await self.update_system_prompt()
-                await self.chat.send_message(self.channel_name, 
-                    f"I notice we've switched to an empty stream category! Here's a little reminder to set a stream category {self.streamer_name}.")
-            if new_category != self.current_category:
-                old_category = self.current_category
-                self.current_category = new_category
-                print(f"Stream category changed from {old_category} to {self.current_category}")
-                await self.update_system_prompt()
-                await self.chat.send_message(self.channel_name, 
-                    f"I notice we've switched from {old_category} to {self.current_category}! Let me update my knowledge.")
+                await self.update_system_prompt(channel)
+                await self._send(channel,
+                    f"I notice we've switched to an empty stream category! Here's a little reminder to set a stream category {channel.streamer_name}.")
+            if new_category != channel.current_category:
+                old_category = self._set_category(channel, new_category)
+                print(f"Stream category in {channel.name} changed from {old_category} to {channel.current_category}")
+                await self.update_system_prompt(channel)
+                await self._send(channel,
+                    f"I notice we've switched from {old_category} to {channel.current_category}! Let me update my knowledge.")
+            elif title_changed:
+                print(f"Stream title in {channel.name} changed to {channel.title}")
+                await self.update_system_prompt(channel)
         except Exception as e:
             print(f"Error handling stream update: {e}")
 
-    async def run(self):
+    async def _authenticate(self):
         # Connect to Twitch API
         self.twitch = Twitch(self.app_id, self.app_secret)
+        self.twitch_cache.api = self.twitch
 
         # Check if we have a refresh token stored
         refresh_token_file = 'token.json'
@@ -454,25 +1077,114 @@ class Bot:
             except Exception as e:
                 print(f"Error authenticating with Twitch: {e}")
 
-        # Set up EventSub for game detection
-        await self.setup_eventsub()
-        
+    async def _connect_chat(self):
         # Initialize chat
         self.chat = await Chat(self.twitch)
-        
+
         # Register handlers
         self.chat.register_event(ChatEvent.READY, self.on_ready)
         self.chat.register_event(ChatEvent.MESSAGE, self.on_message)
-        
-        # Start chat
+
+    async def _load_histories(self):
+        await asyncio.gather(*(channel.load_history() for channel in self.channels.values()))
+
+    async def start(self, concurrent=True):
+        """Connect to Twitch, load the chat history and warm up the model, then start answering chat.
+
+        With concurrent=True, steps that don't depend on each other run at the same time:
+        authentication (then EventSub and chat setup together), loading the history and
+        warming up the model. Chat starts once the history is loaded, without waiting for
+        the model. Returns the seconds each step took."""
+        self._started_at = time.monotonic()
+        timings = self.startup_times
+
+        async def timed(name, step):
+            start = time.monotonic()
+            try:
+                return await step
+            finally:
+                timings[name] = time.monotonic() - start
+
+        # Start the metrics endpoint, model server health checks and request workers
+        if self.metrics_port:
+            await self.metrics.serve(port=self.metrics_port)
+        self.llm.start()
+        if self.moderation_llm:
+            self.moderation_llm.start()
+        self.scheduler.start()
+
+        warm_up = None
+        if concurrent:
+            async def connect():
+                await timed('auth', self._authenticate())
+                await asyncio.gather(timed('eventsub', self.setup_eventsub()), timed('chat', self._connect_chat()))
+
+            if self.warm_up:
+                warm_up = asyncio.create_task(timed('warm_up', self._warm_up_models()))
+            steps = [connect(), timed('history', self._load_histories())]
+            if self.workers is not None:
+                steps.append(timed('workers', self.workers.start()))
+            await asyncio.gather(*steps)
+        else:
+            await timed('auth', self._authenticate())
+            await timed('eventsub', self.setup_eventsub())
+            await timed('chat', self._connect_chat())
+            await timed('history', self._load_histories())
+            if self.workers is not None:
+                await timed('workers', self.workers.start())
+            if self.warm_up:
+                await timed('warm_up', self._warm_up_models())
+
+        # Messages are only taken once the history they are added to is loaded
         self.chat.start()
-        
+        timings['chat_started'] = time.monotonic() - self._started_at
+        if warm_up:
+            await warm_up
+        if self.warm_up and all(channel.live is False for channel in self.channels.values()):
+            # Every channel turned out to be offline while the models were loading
+            await self.keeper.release()
+        timings['ready'] = time.monotonic() - self._started_at
+        steps = ', '.join(f"{name} {timings[name]:.2f}s"
+                          for name in ('auth', 'eventsub', 'chat', 'history', 'workers', 'warm_up') if name in timings)
+        print(f"Cold start: ready in {timings['ready']:.2f}s, taking chat after {timings['chat_started']:.2f}s ({steps})")
+        return timings
+
+    async def run(self, concurrent_startup=True):
         try:
+            await self.start(concurrent=concurrent_startup)
+
             # Keep the bot running
             while True:
                 await asyncio.sleep(1)
         finally:
             # Clean up
+            if self._warm_up_task is not None:
+                self._warm_up_task.cancel()
+                await asyncio.gather(self._warm_up_task, return_exceptions=True)
+            await self.keeper.stop()
+            await self.scheduler.stop()
+            await self.outbox.stop()
+            if self.workers is not None:
+                await self.workers.stop()
+            await self.save_history()
+            for channel in self.channels.values():
+                if channel.recall is not None:
+                    channel.recall.close()
+            self.twitch_cache.close()
+            await self.llm.stop()
+            if self.moderation_llm:
+                await self.moderation_llm.stop()
+            await self.metrics.stop()
+            print(f"LLM servers: {self.llm.stats()}")
+            print(f"Message checks: {self.moderator.stats()}")
+            print(f"Chat messages: {self.outbox.stats()}")
+            print(f"Prompts: {self._prompt_stats()}")
+            if self.workers is not None:
+                print(f"Worker processes: {self.workers.stats()}")
+            if self.response_cache is not None:
+                print(f"Response cache: {self.response_cache.stats()}")
+            if self.recall_results:
+                print(f"Long-term memory: {self._recall_stats()}")
             if self.eventsub:
                 await self.eventsub.stop()
             if self.chat:
@@ -480,6 +1192,19 @@ class Bot:
             if self.twitch:
                 await self.twitch.close()
 
+    async def run_worker(self, socket_path):
+        """Run as one of the --processes workers: generate and check replies for the front process until it exits."""
+        self.metrics.enabled = True  # For the token counts sent back with each reply; nothing is served
+        self.llm.start()
+        if self.moderation_llm:
+            self.moderation_llm.start()
+        try:
+            await serve(self._generate_reply, socket_path)
+        finally:
+            await self.llm.stop()
+            if self.moderation_llm:
+                await self.moderation_llm.stop()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Twitch Chat Bot with LLM integration')
@@ -487,18 +1212,91 @@ if __name__ == "__main__":
     parser.add_argument('--login', type=str, help='JSON file containing login credentials')
     parser.add_argument('--prompt', type=str, help='Text file containing custom system prompt template')
     parser.add_argument('--model', type=str, default='llama3.2:3b-instruct-q4_0', help='LLM model to use (default: llama3.2:3b-instruct-q4_0)')
+    parser.add_argument('--queue-depth', type=int, default=Bot.QUEUE_DEPTH, help=f'Maximum !ai requests waiting to be answered (default: {Bot.QUEUE_DEPTH})')
+    parser.add_argument('--workers', type=int, default=Bot.WORKER_COUNT, help=f'Number of !ai requests answered at once (default: {Bot.WORKER_COUNT})')
+    parser.add_argument('--overload-policy', choices=[POLICY_DROP_OLDEST, POLICY_REJECT], default=POLICY_DROP_OLDEST,
+                        help='What to do when the queue is full: drop the oldest request or reject the new one (default: drop-oldest)')
+    parser.add_argument('--history-tokens', type=int, default=Bot.HISTORY_TOKEN_BUDGET,
+                        help=f'Approximate token budget for chat history sent to the model (default: {Bot.HISTORY_TOKEN_BUDGET})')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream replies into chat a few sentences at a time instead of waiting for the full reply')
+    parser.add_argument('--blocklist', type=str, help='Text file of words and phrases the bot must never send, one per line')
+    parser.add_argument('--accept-on-rules', action='store_true',
+                        help='Send replies without sensitive words or links unchecked by the model, which saves a model call '
+                             'per reply but lets through anything harmful in plain words')
+    parser.add_argument('--semantic-cache', type=str, metavar='EMBED_MODEL',
+                        help='Reuse answers to repeated questions, matched with this Ollama embedding model (e.g. nomic-embed-text)')
+    parser.add_argument('--channels', type=str, nargs='+', metavar='CHANNEL',
+                        help='Join these channels instead of the ones in the login file, sharing one connection and model')
+    parser.add_argument('--llm-host', type=str, action='append', metavar='URL',
+                        help='Model server to use; repeat to spread requests over several. Prefix an OpenAI-compatible '
+                             'server with openai+ (e.g. openai+http://localhost:8000/v1). Default: the local Ollama')
+    parser.add_argument('--moderation-model', type=str,
+                        help='Smaller, faster model for checking replies before they are sent (default: --model)')
+    parser.add_argument('--moderation-host', type=str, action='append', metavar='URL',
+                        help='Model server(s) for message checks, in the same format as --llm-host (default: the --llm-host servers)')
+    parser.add_argument('--batch-window', type=float, default=0.0, metavar='SECONDS',
+                        help='Answer questions from the same channel that arrive within this many seconds of each other '
+                             'with one generation (default: 0, off)')
+    parser.add_argument('--max-batch', type=int, default=Bot.MAX_BATCH,
+                        help=f'Most questions answered by one generation when batching (default: {Bot.MAX_BATCH})')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics (default: off)')
+    parser.add_argument('--metrics-log', type=str,
+                        help='Append a JSON line with the stage timings of every !ai request to this file (default: off)')
+    parser.add_argument('--no-warm-up', action='store_true',
+                        help='Don\'t load the model at startup or keep it loaded while the stream is live')
+    parser.add_argument('--sequential-startup', action='store_true',
+                        help='Connect, load history and warm up the model one after another instead of at the same time')
+    parser.add_argument('--twitch-cache', type=str, default='twitch_cache.json',
+                        help='File to keep Twitch user ids and stream status in between restarts (default: twitch_cache.json)')
+    parser.add_argument('--vip-channels', type=str, nargs='+', metavar='CHANNEL',
+                        help='Channels where the bot account is a VIP, so it may send faster (moderator status is detected)')
+    parser.add_argument('--recall', type=int, nargs='?', const=Bot.RECALL_RESULTS, default=0, metavar='N',
+                        help=f'Add the N earlier chat messages most relevant to each question to the prompt, searched in '
+                             f'an index of all chat kept next to the --history file, using the --semantic-cache model '
+                             f'too if given (default N: {Bot.RECALL_RESULTS}; off without the flag)')
+    parser.add_argument('--processes', type=int, default=0, metavar='N',
+                        help='Generate and check replies in N worker processes, keeping Twitch, the queue and the chat '
+                             'history in this one (default: 0, all in this process; needs --login)')
+    parser.add_argument('--worker-socket', type=str, help=argparse.SUPPRESS)  # Set for the --processes workers
+    parser.add_argument('--max-concurrent', type=int, default=Bot.MAX_CONCURRENT_REQUESTS, help=f'Maximum LLM requests in flight at once (default: {Bot.MAX_CONCURRENT_REQUESTS})')
     args = parser.parse_args()
+    if args.processes and not args.login:
+        parser.error('--processes needs --login, so the worker processes can start without asking for credentials')
+
+    if args.worker_socket:
+        # One of the --processes workers, started by the front process: only what generating and checking replies uses
+        worker = Bot(login_file=args.login, model=args.model, max_concurrent=args.max_concurrent,
+                     blocklist_file=args.blocklist, channels=args.channels, llm_hosts=args.llm_host,
+                     moderation_model=args.moderation_model, moderation_hosts=args.moderation_host, warm_up=False,
+                     accept_on_rules=args.accept_on_rules)
+        try:
+            asyncio.run(worker.run_worker(args.worker_socket))
+        except KeyboardInterrupt:
+            pass
+        sys.exit()
     
     history_file = args.history
-    if history_file and not history_file.endswith('.json'):
-        history_file = f"{history_file}.json"
+    if history_file:
+        history_file = f"{history_file.removesuffix('.jsonl').removesuffix('.json')}.jsonl"
     
-    bot = Bot(history_file=history_file, login_file=args.login, prompt_file=args.prompt)
+    bot = Bot(history_file=history_file, login_file=args.login, prompt_file=args.prompt, model=args.model,
+              max_concurrent=args.max_concurrent, queue_depth=args.queue_depth, workers=args.workers,
+              overload_policy=args.overload_policy, history_tokens=args.history_tokens, stream=args.stream,
+              blocklist_file=args.blocklist, embed_model=args.semantic_cache, channels=args.channels,
+              llm_hosts=args.llm_host, moderation_model=args.moderation_model, moderation_hosts=args.moderation_host,
+              batch_window=args.batch_window, max_batch=args.max_batch,
+              metrics_port=args.metrics_port, metrics_log=args.metrics_log, warm_up=not args.no_warm_up,
+              twitch_cache_file=args.twitch_cache, vip_channels=args.vip_channels, recall=args.recall,
+              processes=args.processes, worker_command=[sys.executable, os.path.abspath(__file__), *sys.argv[1:]],
+              accept_on_rules=args.accept_on_rules)
 
     try:
-        asyncio.run(bot.run())
+        asyncio.run(bot.run(concurrent_startup=not args.sequential_startup))
     except KeyboardInterrupt:
         print("\nShutting down bot...")
-        if history_file:
-            asyncio.run(bot.save_history())
+        for channel in bot.channels.values():
+            if channel.history_log:
+                channel.history_log.close()
         print("Goodbye!")
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+PREFIX = 'twitch_llm'
+
+# Upper bounds, in seconds, of the timing histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('trace', 'stage', 'start')
+
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.stage, time.monotonic() - self.start)
+        return False
+
+
+class NullTrace:
+    """Stands in for a Trace when metrics are disabled; every method does nothing."""
+
+    def span(self, stage):
+        return NULL_SPAN
+
+    def add(self, stage, seconds):
+        pass
+
+    def set(self, **fields):
+        pass
+
+    def count(self, **amounts):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class Trace:
+    """Timings and details of one !ai request, from receiving it to saving the reply.
+
+    Use `with trace.span('llm'):` around a stage, or add() a duration measured
+    elsewhere. Time spent in a stage more than once (e.g. two LLM calls) adds up.
+    """
+
+    __slots__ = ('started', 'stages', 'fields')
+
+    def __init__(self, started=None):
+        self.started = time.monotonic() if started is None else started
+        self.stages = {}
+        self.fields = {}
+
+    def span(self, stage):
+        return _Span(self, stage)
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def count(self, **amounts):
+        """Add to numeric fields, e.g. the tokens used by each LLM call."""
+        for name, amount in amounts.items():
+            self.fields[name] = self.fields.get(name, 0) + amount
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Metrics:
+    """Counters, timing histograms and per-request traces for the bot.
+
+    Counters and histograms are exposed in Prometheus text format by render(),
+    served over HTTP by serve(), along with the numeric values of any stats()
+    method registered with collect(). Finished traces are also written one JSON
+    object per line to `log_path`, if given.
+
+    With enabled=False every method returns straight away and trace() hands out
+    a shared NullTrace, so instrumented code costs next to nothing.
+    """
+
+    def __init__(self, enabled=True, log_path=None):
+        self.enabled = enabled
+        self.log_path = log_path
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._collectors = []
+        self._log = None
+        self._server = None
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+        index = bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram[index] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+    def counts(self, name, label):
+        """Current values of counter `name`, keyed by the value of one of its labels."""
+        counts = {}
+        for (counter, labels), value in self._counters.items():
+            if counter == name:
+                key = dict(labels).get(label)
+                counts[key] = counts.get(key, 0) + value
+        return counts
+
+    def collect(self, name, stats):
+        """Export the numeric values of `stats()` (a dict) as gauges named name_key."""
+        self._collectors.append((name, stats))
+
+    def trace(self, started=None):
+        return Trace(started) if self.enabled else NULL_TRACE
+
+    def record_llm(self, response, trace=NULL_TRACE, role='generate'):
+        """Count the tokens and model time Ollama reports with each response (durations are in nanoseconds)."""
+        if not self.enabled:
+            return
+        prompt_tokens = response.get('prompt_eval_count') or 0
+        eval_tokens = response.get('eval_count') or 0
+        self.inc('llm_requests_total', role=role)
+        self.inc('llm_prompt_tokens_total', prompt_tokens, role=role)
+        self.inc('llm_eval_tokens_total', eval_tokens, role=role)
+        for field in ('load_duration', 'prompt_eval_duration', 'eval_duration'):
+            if response.get(field):
+                self.inc(f"llm_{field.removesuffix('_duration')}_seconds_total", response[field] / 1e9, role=role)
+        trace.count(prompt_tokens=prompt_tokens, eval_tokens=eval_tokens,
+                    eval_seconds=(response.get('eval_duration') or 0) / 1e9)
+
+    def finish(self, trace, status='ok'):
+        """Record a finished request's stage timings and write it to the log."""
+        if not self.enabled:
+            return
+        total = time.monotonic() - trace.started
+        self.inc('requests_total', status=status)
+        self.observe('request_seconds', total)
+        for stage, seconds in trace.stages.items():
+            self.observe('stage_seconds', seconds, stage=stage)
+        if self.log_path:
+            record = {'time': datetime.now(timezone.utc).isoformat(), 'status': status, 'total_ms': round(total * 1000, 1),
+                      'stages_ms': {stage: round(seconds * 1000, 1) for stage, seconds in trace.stages.items()}}
+            record.update(trace.fields)
+            if self._log is None:
+                self._log = open(self.log_path, 'a', encoding='utf-8')
+            self._log.write(json.dumps(record) + '\n')
+
+    def render(self):
+        """All metrics in Prometheus text exposition format."""
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self._counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}_{name} counter")
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram):
+                cumulative += count
+                lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+            lines.append(f"{PREFIX}_{name}_sum{_labels(labels)} {histogram[-2]}")
+            lines.append(f"{PREFIX}_{name}_count{_labels(labels)} {histogram[-1]}")
+        for name, stats in self._collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Error collecting {name} metrics: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"{PREFIX}_{name}_{key} {value}")
+        return '\n'.join(lines) + '\n'
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # Skip the headers
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                body = self.render().encode()
+                status = '200 OK'
+            else:
+                body = b'Not found\n'
+                status = '404 Not Found'
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except Exception as e:
+            print(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=9464):
+        """Serve GET /metrics on the running event loop."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._log:
+            self._log.close()
+            self._log = None
@@ -0,0 +1,132 @@
+import json
+import re
+
+from cache import TTLCache, normalize_text
+
+# Topics that aren't necessarily a problem but need a closer look from the LLM moderator.
+# Terms match whole words only, so list the forms to catch
+DEFAULT_WATCHLIST = [
+    'kill', 'kills', 'killed', 'killing', 'die', 'dies', 'died', 'dying', 'dead', 'death', 'suicide', 'self harm',
+    'murder', 'weapon', 'weapons', 'gun', 'guns', 'bomb', 'bombs', 'shoot', 'shooting',
+    'drug', 'drugs', 'cocaine', 'heroin', 'meth', 'sex', 'sexual', 'nude', 'naked', 'porn',
+    'nazi', 'nazis', 'hitler', 'racist', 'racism', 'slur', 'slurs', 'hate', 'hatred', 'terror', 'terrorist',
+    'terrorism', 'abuse', 'rape', 'religion', 'election', 'politics', 'political', 'address', 'password',
+    'phone number', 'where you live',
+]
+
+URL_PATTERN = re.compile(r"https?://|www\.|\b[\w-]+\.(?:com|net|org|gg|tv|io|ru|xyz)\b", re.IGNORECASE)
+
+# Signs that the model leaked a tool call or other structured output instead of a chat message
+LEAK_PATTERNS = [
+    re.compile(r"[\[{]\s*[\"\[{]"),  # A JSON object or array anywhere in the message
+    re.compile(r"\"(?:name|function|arguments|tool_calls|parameters)\"\s*:"),
+    re.compile(r"<\|?\s*(?:tool_call|python_tag|eot_id|start_header_id|im_start|im_end)", re.IGNORECASE),
+    re.compile(r"\b(?:respond_to_user|search_internet|get_current_time)\s*\("),
+    re.compile(r"^\s*(?:system|assistant)\s*:|<<\s*/?SYS\s*>>|\[/?INST\]", re.IGNORECASE | re.MULTILINE),  # Prompt text
+]
+
+
+def normalize_message(text):
+    """Cache key for a message: @mentions are dropped so merged replies share verdicts."""
+    return normalize_text(re.sub(r"@\w+", "", text))
+
+
+def _word_pattern(terms):
+    if not terms:
+        return None
+    alternation = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternation})\b", re.IGNORECASE)
+
+
+class Moderator:
+    """Tiered message check that only asks the LLM about ambiguous messages.
+
+    1. Local rejections: empty or overlong messages, leaked JSON/tool calls and
+       blocklisted terms.
+    2. Local acceptance of messages without watchlisted terms or links, only with
+       `accept_on_rules`: the rules can't see threats or insults in plain words.
+    3. A cache of earlier LLM verdicts, keyed on the normalized text.
+    4. `llm_check`, an async callable returning True/False, for everything else.
+
+    `counters` records how many messages each tier decided.
+    """
+
+    def __init__(self, llm_check, blocklist=(), watchlist=DEFAULT_WATCHLIST, max_length=1500,
+                 cache_size=1024, cache_ttl=600, accept_on_rules=False):
+        self.llm_check = llm_check
+        self.accept_on_rules = accept_on_rules
+        self.max_length = max_length
+        self._blocklist = _word_pattern(blocklist)
+        self._watchlist = _word_pattern(watchlist)
+        self.cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self.counters = {
+            'checked': 0,
+            'rejected_length': 0,
+            'rejected_leak': 0,
+            'rejected_blocklist': 0,
+            'accepted_rules': 0,
+            'cache_hits': 0,
+            'llm_calls': 0,
+            'llm_rejected': 0,
+        }
+
+    @staticmethod
+    def load_blocklist(path):
+        """Read a blocklist file: one term per line, blank lines and #comments ignored."""
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    def local_verdict(self, text):
+        """Decide using rules alone. Returns (verdict, reason), with verdict None if the rules can't tell."""
+        if not text.strip() or len(text) > self.max_length:
+            return False, 'length'
+        if any(pattern.search(text) for pattern in LEAK_PATTERNS):
+            return False, 'leak'
+        if self._blocklist and self._blocklist.search(text):
+            return False, 'blocklist'
+        if not self.accept_on_rules or URL_PATTERN.search(text) or (self._watchlist and self._watchlist.search(text)):
+            return None, 'ambiguous'
+        return True, 'rules'
+
+    async def check(self, text):
+        """Return True if the message is OK to send."""
+        self.counters['checked'] += 1
+        verdict, reason = self.local_verdict(text)
+        if verdict is not None:
+            self.counters['accepted_rules' if verdict else f'rejected_{reason}'] += 1
+            print(f"Checked message ({reason}): {'accepted' if verdict else 'rejected'}")
+            return verdict
+
+        key = normalize_message(text)
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            self.counters['cache_hits'] += 1
+            print(f"Checked message (cache): {'accepted' if verdict else 'rejected'}")
+            return verdict
+
+        self.counters['llm_calls'] += 1
+        verdict = await self.llm_check(text)
+        if verdict is None:
+            return False  # The moderator failed; fail closed without caching
+        if not verdict:
+            self.counters['llm_rejected'] += 1
+        self.cache.put(key, verdict)
+        return verdict
+
+    @staticmethod
+    def parse_verdict(response_text):
+        """Read {"accepted": bool} from a model reply, tolerating prose around the JSON. Returns None if absent."""
+        try:
+            return bool(json.loads(response_text)['accepted'])
+        except (ValueError, KeyError, TypeError):
+            pass
+        match = re.search(r"\"?accepted\"?\s*:\s*(true|false)", response_text, re.IGNORECASE)
+        if match:
+            return match.group(1).lower() == 'true'
+        return None
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['llm_calls_avoided'] = stats['checked'] - stats['llm_calls']
+        stats['cache_size'] = len(self.cache)
+        return stats
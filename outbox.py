@@ -0,0 +1,235 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from scheduler import TokenBucket
+from streaming import TWITCH_MESSAGE_LIMIT, split_message
+
+# What the bot account is in a channel, which decides how fast it may send there
+TIER_BOT = 'bot'
+TIER_VIP = 'vip'
+TIER_MOD = 'mod'  # Moderators and the broadcaster
+
+# Per tier: (burst, seconds to earn another message, minimum seconds between two messages in one channel).
+# Twitch allows 20 messages in any 30 seconds, or 100 as a moderator, VIP or broadcaster; a burst of half
+# that plus what is earned over 30 seconds never goes past it.
+RATE_LIMITS = {
+    TIER_BOT: (10, 3.0, 1.0),
+    TIER_VIP: (50, 0.6, 0.0),
+    TIER_MOD: (50, 0.6, 0.0),
+}
+
+
+def with_mentions(text, users):
+    """Prefix text with an @mention of each user it doesn't already start by mentioning."""
+    leading = set()
+    for word in text.split(' '):
+        if not word.startswith('@'):
+            break
+        leading.add(word[1:].lower())
+    missing = [f"@{user}" for user in users if user.lower() not in leading]
+    return ' '.join(missing + [text]) if missing else text
+
+
+class _Message:
+    __slots__ = ('channel', 'text', 'mentions', 'shared', 'deadline', 'posted_at', 'future')
+
+    def __init__(self, channel, text, mentions, deadline, posted_at):
+        self.channel = channel
+        self.text = text
+        self.mentions = mentions
+        self.shared = False  # Also answers users who asked later, so it needs their mentions
+        self.deadline = deadline
+        self.posted_at = posted_at
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class ChatSender:
+    """Queues outgoing chat messages and sends them within Twitch's rate limits.
+
+    `send_message(channel, text)` does the sending and `tier(channel)` says whether the
+    bot is a regular user, VIP or moderator there, choosing one of the `limits`; each
+    tier has a token bucket shared by its channels. With `limits=None`, messages are
+    sent as fast as they come.
+
+    Channels take turns, so a busy one can't hold up the rest. While a message waits:
+    - a reply (a message with `mentions`) identical to one already waiting is not sent
+      again; the waiting one mentions both users instead,
+    - replies waiting together in a channel are merged into one message if they fit,
+      each starting with its @mentions, and
+    - it is dropped once its deadline passes, rather than answering a stale question.
+    Messages longer than Twitch's limit are split at sentence ends. Twitch refuses a
+    regular user's message identical to the last one less than `duplicate_window` seconds
+    ago, so such a reply gets @mentions of its users added, and other messages are dropped.
+    """
+
+    def __init__(self, send_message, tier=None, limits=RATE_LIMITS, max_delay=30, duplicate_window=30,
+                 limit=TWITCH_MESSAGE_LIMIT):
+        self.send_message = send_message
+        self.tier = tier or (lambda channel: TIER_BOT)
+        self.limits = limits
+        self.max_delay = max_delay
+        self.duplicate_window = duplicate_window
+        self.limit = limit
+
+        self._queues = OrderedDict()  # Lower-case channel name -> deque of _Message, in turn order
+        self._buckets = {}  # Tier -> TokenBucket
+        self._last_sent = {}  # Lower-case channel name -> (time, text)
+        self._task = None
+        self._wakeup = None
+
+        self.metrics = {'posted': 0, 'sent': 0, 'merged': 0, 'deduplicated': 0, 'split': 0, 'stale': 0,
+                        'duplicates': 0, 'errors': 0, 'queue_delay_total': 0.0, 'queue_delay_max': 0.0}
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop sending. Messages still waiting are dropped."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for queue in self._queues.values():
+            while queue:
+                self._finish([queue.popleft()], None)
+
+    async def send(self, channel, text, mentions=(), deadline=None):
+        """Queue a message and wait until it is sent. Returns the seconds it waited, or None if it was dropped.
+
+        `mentions` are the users a reply answers, which allows merging it with other replies.
+        It is dropped if it can't be sent by `deadline` (a time.monotonic() time), by default
+        `max_delay` seconds from now."""
+        text = text.strip()
+        if not text:
+            return None
+        self.metrics['posted'] += 1
+        now = time.monotonic()
+        if deadline is None:
+            deadline = now + self.max_delay
+        mentions = list(mentions)
+        queue = self._queues.setdefault(channel.lower(), deque())
+
+        if mentions:
+            for message in queue:
+                if message.mentions and message.text == text:
+                    message.mentions += [user for user in mentions if user not in message.mentions]
+                    message.shared = True
+                    self.metrics['deduplicated'] += 1
+                    return await asyncio.shield(message.future)
+
+        parts = split_message(text, self.limit)
+        self.metrics['split'] += len(parts) - 1
+        messages = [_Message(channel, part, mentions if index == 0 else [], deadline, now)
+                    for index, part in enumerate(parts)]
+        queue.extend(messages)
+        self._start()
+        self._wakeup.set()
+        results = await asyncio.gather(*(message.future for message in messages))
+        return results[0]
+
+    def _bucket(self, channel):
+        tier = self.tier(channel)
+        bucket = self._buckets.get(tier)
+        if bucket is None:
+            burst, refill_seconds, _ = self.limits.get(tier, self.limits[TIER_BOT])
+            bucket = self._buckets[tier] = TokenBucket(burst, refill_seconds)
+        return tier, bucket
+
+    def _wait_time(self, key, channel):
+        """Seconds until a message may be sent in a channel."""
+        if self.limits is None:
+            return 0.0
+        tier, bucket = self._bucket(channel)
+        min_interval = self.limits.get(tier, self.limits[TIER_BOT])[2]
+        last = self._last_sent.get(key)
+        interval_wait = last[0] + min_interval - time.monotonic() if last else 0.0
+        return max(bucket.wait_time(), interval_wait)
+
+    def _finish(self, messages, delay):
+        for message in messages:
+            if not message.future.done():
+                message.future.set_result(delay)
+
+    def _drop_stale(self):
+        now = time.monotonic()
+        for queue in self._queues.values():
+            stale = [message for message in queue if message.deadline < now]
+            for message in stale:
+                queue.remove(message)
+                self.metrics['stale'] += 1
+                print(f"Dropped a message to {message.channel} after {now - message.posted_at:.1f}s: too late to send")
+                self._finish([message], None)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._drop_stale()
+            # The first channel in turn order that can send soonest
+            best, best_wait = None, None
+            for key, queue in self._queues.items():
+                if queue:
+                    wait = self._wait_time(key, queue[0].channel)
+                    if best is None or wait < best_wait:
+                        best, best_wait = key, wait
+            if best is None:
+                await self._wakeup.wait()
+            elif best_wait > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), best_wait)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self._send_next(best)
+
+    def _take_batch(self, queue):
+        """The next message, merged with the replies waiting after it while the result fits in one message."""
+        batch = [queue.popleft()]
+        text = with_mentions(batch[0].text, batch[0].mentions) if batch[0].shared else batch[0].text
+        while queue and batch[0].mentions and queue[0].mentions:
+            merged = ' '.join(with_mentions(message.text, message.mentions) for message in batch + [queue[0]])
+            if len(merged) > self.limit:
+                break
+            batch.append(queue.popleft())
+            text = merged
+        return batch, text
+
+    async def _send_next(self, key):
+        queue = self._queues[key]
+        batch, text = self._take_batch(queue)
+        channel = batch[0].channel
+        now = time.monotonic()
+        if self.limits is not None:
+            last = self._last_sent.get(key)
+            if last and last[1] == text and now - last[0] < self.duplicate_window and self.tier(channel) == TIER_BOT:
+                # The same answer for someone else can still be sent by mentioning them
+                text = with_mentions(text, batch[0].mentions)
+                if text == last[1]:
+                    self.metrics['duplicates'] += len(batch)
+                    print(f"Not sending a duplicate message to {channel}: {text}")
+                    self._finish(batch, None)
+                    return
+            self._bucket(channel)[1].take()
+        self._last_sent[key] = (now, text)
+        self._queues.move_to_end(key)
+        try:
+            await self.send_message(channel, text)
+        except Exception as e:
+            self.metrics['errors'] += 1
+            print(f"Error sending message to {channel}: {e}")
+            self._finish(batch, None)
+            return
+        self.metrics['sent'] += 1
+        self.metrics['merged'] += len(batch) - 1
+        for message in batch:
+            delay = now - message.posted_at
+            self.metrics['queue_delay_total'] += delay
+            self.metrics['queue_delay_max'] = max(self.metrics['queue_delay_max'], delay)
+            self._finish([message], delay)
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['waiting'] = sum(len(queue) for queue in self._queues.values())
+        return stats
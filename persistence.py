@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+
+from history import MEMORY_PREFIX
+
+
+class HistoryLog:
+    """Append-only JSON Lines log of the chat history.
+
+    Each line is one record: {"turn": message} for a message added to the
+    history, or {"memory": summary} when the rolling summary changes. Records are
+    buffered on the event loop and written by a background thread at most every
+    `flush_interval` seconds, so saving never blocks the chat.
+
+    Every write appends whole lines and is fsynced. If the bot is killed in the
+    middle of a write, only the last line can be incomplete; load() discards it and
+    cuts the file back to the last complete line. After every `compact_after`
+    appended records, the log is rewritten as a snapshot of the current history
+    into a temporary file that atomically replaces it.
+    """
+
+    def __init__(self, path, flush_interval=1.0, compact_after=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after
+        self.snapshot = None  # Callable returning the records that make up the current history
+
+        self._buffer = []
+        self._records = 0  # Records in the file plus the buffer
+        self._compacted_records = 0  # Records in the file after the last load or compaction
+        self._flush_handle = None
+        self._flush_task = None
+        self._lock = None
+
+        self.writes = 0
+        self.compactions = 0
+
+    @staticmethod
+    def _encode(record):
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def load(self):
+        """Read the log and return (memory, turns). Migrates a legacy JSON list file if one is found."""
+        legacy_path = os.path.splitext(self.path)[0] + '.json'
+        if not os.path.exists(self.path) and legacy_path != self.path and os.path.exists(legacy_path):
+            self._migrate(legacy_path)
+        if not os.path.exists(self.path):
+            return None, []
+
+        memory = None
+        turns = []
+        good_bytes = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partial line left by an interrupted write
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"Skipping unreadable line in {self.path}")
+                    good_bytes += len(line)
+                    continue
+                good_bytes += len(line)
+                self._records += 1
+                if 'turn' in record:
+                    turns.append(record['turn'])
+                elif 'memory' in record:
+                    memory = record['memory']
+
+        self._compacted_records = self._records
+        if good_bytes < os.path.getsize(self.path):
+            print(f"Discarding incomplete last record in {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_bytes)
+        return memory, turns
+
+    def _migrate(self, legacy_path):
+        """Convert a history file written by older versions (one JSON list) into the log format."""
+        with open(legacy_path, 'r') as f:
+            messages = json.load(f)
+        records = [{'turn': message} for message in messages]
+        first = messages[0] if messages else {}
+        if first.get('role') == 'system' and first.get('content', '').startswith(MEMORY_PREFIX):
+            records[0] = {'memory': first['content'][len(MEMORY_PREFIX):]}
+        self._write_snapshot(records)
+        print(f"Migrated {len(messages)} messages from {legacy_path} to {self.path}")
+
+    def record_turn(self, message):
+        self._append({'turn': message})
+
+    def record_memory(self, summary):
+        self._append({'memory': summary})
+
+    def _append(self, record):
+        self._buffer.append(self._encode(record))
+        self._records += 1
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Not running yet; written by the next flush or close()
+        self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        """Write buffered records in a background thread, compacting the log if it has grown too long."""
+        self._flush_handle = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.snapshot is not None and self._records - self._compacted_records > self.compact_after:
+                # The snapshot already contains everything in the buffer
+                records = self.snapshot()
+                self._buffer = []
+                await asyncio.to_thread(self._write_snapshot, records)
+                self._compacted_records = len(records)
+                self._records = len(records) + len(self._buffer)
+                self.compactions += 1
+            elif self._buffer:
+                lines, self._buffer = self._buffer, []
+                await asyncio.to_thread(self._write_lines, lines)
+
+    def _write_lines(self, lines):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        self.writes += 1
+
+    def _write_snapshot(self, records):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write("".join(self._encode(record) for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.writes += 1
+
+    def close(self):
+        """Synchronously write anything still buffered. Safe to call outside the event loop."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._buffer:
+            lines, self._buffer = self._buffer, []
+            self._write_lines(lines)
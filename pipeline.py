@@ -0,0 +1,52 @@
+import asyncio
+
+
+class GenerationTimeout(Exception):
+    """Raised when a request takes longer than the pipeline's time limit."""
+
+
+class RequestPipeline:
+    """Runs LLM requests on the bot's own event loop with bounded concurrency.
+
+    Every request shares the bot's pooled AsyncClient. At most `max_concurrent`
+    requests are sent to the model at once; anything beyond that waits for a free
+    slot. A request that runs for longer than `timeout` seconds is cancelled and
+    raises GenerationTimeout.
+    """
+
+    def __init__(self, max_concurrent=4, timeout=30):
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+        self.in_flight = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.failed = 0
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """Await `func(*args, **kwargs)` once a slot is free, cancelling it after the timeout."""
+        timeout = self.timeout if timeout is None else timeout
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise GenerationTimeout(f"Request exceeded {timeout}s and was cancelled")
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.in_flight -= 1
+        self.completed += 1
+        return result
+
+    def stats(self):
+        return {
+            'max_concurrent': self.max_concurrent,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'timed_out': self.timed_out,
+            'failed': self.failed,
+        }
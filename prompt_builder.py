@@ -0,0 +1,95 @@
+from itertools import islice
+
+
+def estimate_tokens(text):
+    """Rough token count for English chat text (about four characters per token)."""
+    return max(1, len(text) // 4) if text else 0
+
+
+class PromptBuilder:
+    """Builds the message list sent to the model, reusing it between calls.
+
+    The system prompt carries only the bot's instructions, never the chat history,
+    so it stays the same from call to call. Turns added to the history since the
+    last call are appended to the cached list, which keeps everything already sent
+    identical and lets Ollama reuse its KV cache for that prefix. The list is only
+    rebuilt when the system prompt changes or old turns are trimmed off the front.
+    """
+
+    MESSAGE_OVERHEAD = 4  # Approximate tokens of chat-template framing per message
+
+    def __init__(self, tokenizer=estimate_tokens):
+        self.tokenizer = tokenizer
+        self._messages = []
+        self._token_counts = []
+        self._last_sent = 0  # Messages in the list at the end of the previous call
+
+        self.calls = 0
+        self.rebuilds = 0
+        self.total_tokens = 0
+        self.total_saved = 0
+        self.total_reused = 0
+        self.last_report = {}
+
+    def _count(self, message):
+        return self.tokenizer(message.get('content') or '') + self.MESSAGE_OVERHEAD
+
+    def _is_prefix_of(self, system_prompt, history):
+        """True if the cached list is still the start of [system] + history."""
+        if not self._messages or self._messages[0]['content'] != system_prompt:
+            return False
+        cached_turns = len(self._messages) - 1
+        if cached_turns > len(history):
+            return False
+        if cached_turns == 0:
+            return True
+        # History is only ever appended to or trimmed from the front, so checking both ends is enough
+        return self._messages[1] is history[0] and self._messages[-1] is history[cached_turns - 1]
+
+    def build(self, system_prompt, history):
+        """Return [system] + history as a new list, which stays as it is when later turns are added."""
+        if self._is_prefix_of(system_prompt, history):
+            reused = self._last_sent
+            for message in islice(history, len(self._messages) - 1, None):
+                self._messages.append(message)
+                self._token_counts.append(self._count(message))
+        else:
+            self.rebuilds += 1
+            reused = 0
+            system = {'role': 'system', 'content': system_prompt}
+            self._messages = [system] + list(history)
+            self._token_counts = [self._count(message) for message in self._messages]
+
+        self._last_sent = len(self._messages)
+        self._report(reused)
+        return list(self._messages)
+
+    def _report(self, reused_messages):
+        system_tokens = self._token_counts[0]
+        history_tokens = sum(self._token_counts[1:])
+        prompt_tokens = system_tokens + history_tokens
+        reused_tokens = sum(self._token_counts[:reused_messages])
+        # The old prompt embedded the whole history in the system message and sent it again as messages
+        legacy_tokens = prompt_tokens + history_tokens
+
+        self.calls += 1
+        self.total_tokens += prompt_tokens
+        self.total_saved += legacy_tokens - prompt_tokens
+        self.total_reused += reused_tokens
+        self.last_report = {
+            'prompt_tokens': prompt_tokens,
+            'legacy_tokens': legacy_tokens,
+            'saved_tokens': legacy_tokens - prompt_tokens,
+            'reused_prefix_tokens': reused_tokens,
+            'messages': len(self._messages),
+        }
+        return self.last_report
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'rebuilds': self.rebuilds,
+            'total_tokens': self.total_tokens,
+            'total_saved_tokens': self.total_saved,
+            'total_reused_prefix_tokens': self.total_reused,
+        }
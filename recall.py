@@ -0,0 +1,326 @@
+import asyncio
+import json
+import math
+import os
+import re
+from array import array
+
+import numpy as np
+
+RECALL_PREFIX = "Earlier chat that may be relevant (it may be old):\n"
+
+_WORD = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset("""
+a about after again all also am an and any are as at be because been before being but by can could did do does
+doing don't for from get got had has have he her here him his how i i'm if in into is it it's its just know like
+me more most my no not now of on one or our out so some than that that's the their them then there these they
+this to too up us very was we were what when where which who why will with would you your yours
+""".split())
+
+
+def _top(values, n):
+    """Indices of the `n` largest values, largest first, without sorting the rest."""
+    indices = np.argpartition(values, -n)[-n:] if len(values) > n else np.arange(len(values))
+    return indices[np.argsort(values[indices])[::-1]]
+
+
+def keywords(text):
+    """The words of a message worth indexing: lower case, without stop words and single letters."""
+    return [word for word in _WORD.findall(text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+class RecallIndex:
+    """Long-term memory of every chat turn, searched for the few most relevant to a question.
+
+    Every turn added is archived and indexed straight away in a keyword inverted index
+    (word -> ids of the turns using it), scored with BM25. Given `embed`, an async callable
+    turning a list of texts into a list of vectors, turns are also embedded in the
+    background, in batches, into a matrix of normalised float32 rows; a search then
+    adds the cosine similarity of the question to each candidate's score.
+
+    Search cost doesn't grow with the archive: keyword postings are only read for the
+    question's words (skipping words in more than `max_df` of all turns), and vectors are
+    compared only for the newest `vector_window` turns plus the keyword candidates.
+
+    Given a `path`, turns are appended to it as JSON Lines and their vectors to
+    `path + '.vectors'`, memory-mapped so the matrix lives in the page cache rather than
+    the bot's heap; load() reads both back, so nothing is embedded twice. Like
+    persistence.HistoryLog, turns are buffered and written by a background thread at
+    most every `flush_interval` seconds, as are the vectors of each embedded batch.
+    Every write is fsynced, and buffered turns are written before any vectors, so the
+    vectors file never holds rows for turns the archive lacks (load() drops any extra).
+    """
+
+    K1 = 1.2  # BM25 term frequency saturation
+    B = 0.75  # BM25 length normalisation
+    EMBED_BATCH = 64  # Turns embedded per request
+
+    def __init__(self, path=None, embed=None, vector_window=20000, max_df=0.1, min_similarity=0.5,
+                 flush_interval=1.0):
+        self.path = path
+        self.embed = embed
+        self.vector_window = vector_window
+        self.max_df = max_df
+        self.min_similarity = min_similarity
+        self.flush_interval = flush_interval
+
+        self._texts = []
+        self._postings = {}  # Word -> array of turn ids
+        self._lengths = array('H')  # Indexed words per turn
+        self._total_length = 0
+        self._vectors = None  # Memory-mapped (or in-memory) matrix of embedded turns, row i = turn i
+        self._buffer = None  # Backing array of the in-memory matrix, without a path
+        self._dim = None
+        self._buffer_lines = []  # Archive lines not written yet
+        self._flush_handle = None
+        self._flush_task = None
+        self._lock = None
+        self._embed_task = None
+
+        self.metrics = {'turns': 0, 'searches': 0, 'results': 0, 'embedded': 0, 'embed_errors': 0}
+
+    def __len__(self):
+        return len(self._texts)
+
+    @property
+    def _vectors_path(self):
+        return f"{self.path}.vectors"
+
+    @property
+    def embedded(self):
+        return 0 if self._vectors is None else len(self._vectors)
+
+    def load(self):
+        """Read the archive and its vectors. Run before any turn is added (it can take a while; use a thread)."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        good_bytes = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partial line left by an interrupted write
+                good_bytes += len(line)
+                try:
+                    self._index(json.loads(line)['content'])
+                except (ValueError, KeyError):
+                    print(f"Skipping unreadable line in {self.path}")
+        if good_bytes < os.path.getsize(self.path):
+            # Cut it off, or the next turn appended would continue it
+            print(f"Discarding incomplete last turn in {self.path}")
+            os.truncate(self.path, good_bytes)
+        meta_path = f"{self.path}.meta.json"
+        if os.path.exists(meta_path) and os.path.exists(self._vectors_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self._dim = json.load(f)['dim']
+            row_bytes = self._dim * 4
+            rows = min(os.path.getsize(self._vectors_path) // row_bytes, len(self._texts))
+            # Drop a partly written row, and vectors of turns that didn't make it into the archive
+            os.truncate(self._vectors_path, rows * row_bytes)
+            self._map_vectors(rows)
+        print(f"Loaded {len(self._texts)} turns ({self.embedded} embedded) into long-term memory from {self.path}")
+
+    def _map_vectors(self, rows):
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(rows, self._dim)) \
+            if rows else None
+
+    def _index(self, text):
+        turn = len(self._texts)
+        self._texts.append(text)
+        words = keywords(text)
+        for word in set(words):
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = array('i')
+            postings.append(turn)
+        self._lengths.append(min(len(words), 65535))
+        self._total_length += len(words)
+        self.metrics['turns'] += 1
+
+    def add(self, message):
+        """Archive and index one chat turn (a message dict). Only chat messages with text are kept."""
+        text = message.get('content')
+        if message.get('role') not in ('user', 'assistant') or not text:
+            return
+        self._index(text)
+        if self.path:
+            self._buffer_lines.append(json.dumps({'role': message['role'], 'content': text}, ensure_ascii=False) + "\n")
+            self._schedule_flush()
+        self._embed_later()
+
+    def extend(self, messages):
+        for message in messages:
+            self.add(message)
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Not running yet; written by the next flush or close()
+        self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        """Write buffered turns to the archive in a background thread."""
+        self._flush_handle = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._buffer_lines:
+                lines, self._buffer_lines = self._buffer_lines, []
+                await asyncio.to_thread(self._write_lines, lines)
+
+    def _write_lines(self, lines):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _embed_later(self):
+        if self.embed is None or (self._embed_task is not None and not self._embed_task.done()):
+            return
+        try:
+            self._embed_task = asyncio.get_running_loop().create_task(self._embed_pending())
+        except RuntimeError:
+            pass  # Not running yet; embedded once the next turn is added
+
+    async def _embed_pending(self):
+        while self.embedded < len(self._texts):
+            start = self.embedded
+            texts = self._texts[start:start + self.EMBED_BATCH]
+            try:
+                vectors = np.asarray(await self.embed(texts), dtype=np.float32)
+            except Exception as e:
+                self.metrics['embed_errors'] += 1
+                print(f"Error embedding chat for long-term memory: {e}")
+                return
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms > 0, norms, 1)
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+            if self.path:
+                await self.flush()
+                # Searches use the matrix mapped so far until the new one is ready
+                self._vectors = await asyncio.to_thread(self._write_vectors, vectors, self.embedded + len(vectors))
+            else:
+                self._append_vectors(vectors)
+            self.metrics['embedded'] += len(texts)
+
+    def _write_vectors(self, vectors, rows):
+        """Append vectors to the file and map it again with them. Runs in a thread."""
+        if rows == len(vectors):  # The first vectors in the file
+            with open(f"{self.path}.meta.json", 'w', encoding='utf-8') as f:
+                json.dump({'dim': self._dim}, f)
+                f.flush()
+                os.fsync(f.fileno())
+        with open(self._vectors_path, 'ab') as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(rows, self._dim))
+
+    def _append_vectors(self, vectors):
+        """Add vectors to the in-memory matrix, without a path."""
+        rows = self.embedded + len(vectors)
+        # Grown by doubling, so adding a turn doesn't copy the whole matrix
+        if self._buffer is None or rows > len(self._buffer):
+            buffer = np.empty((max(rows, 1024, 2 * self.embedded), self._dim), dtype=np.float32)
+            if self._vectors is not None:
+                buffer[:self.embedded] = self._vectors
+            self._buffer = buffer
+        self._buffer[self.embedded:rows] = vectors
+        self._vectors = self._buffer[:rows]
+
+    async def query_vector(self, text):
+        """The normalised embedding of a question, or None without an embedding model."""
+        if self.embed is None:
+            return None
+        try:
+            vector = np.asarray((await self.embed([text]))[0], dtype=np.float32)
+        except Exception as e:
+            print(f"Error embedding question for long-term memory: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _keyword_scores(self, words, turns):
+        """BM25 scores of the turns sharing words with the question, as (turn ids, scores)."""
+        ids, weights = [], []
+        for word in set(words):
+            postings = self._postings.get(word)
+            if not postings or len(postings) > self.max_df * turns and turns >= 1000:
+                continue
+            idf = math.log(1 + (turns - len(postings) + 0.5) / (len(postings) + 0.5))
+            ids.append(np.frombuffer(postings, dtype=np.int32))
+            weights.append(np.full(len(postings), idf, dtype=np.float32))
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate(ids)
+        weights = np.concatenate(weights)
+        lengths = np.frombuffer(self._lengths, dtype=np.uint16)[ids]
+        average = self._total_length / turns or 1
+        weights *= (self.K1 + 1) / (1 + self.K1 * (1 - self.B + self.B * lengths / average))
+        unique, inverse = np.unique(ids, return_inverse=True)
+        return unique, np.bincount(inverse, weights=weights)
+
+    def search(self, question, k=3, exclude_last=0, vector=None, candidates=50):
+        """The texts of up to `k` past turns most relevant to `question`, oldest first.
+
+        The newest `exclude_last` turns (those still in the chat history the model sees)
+        are left out. `vector` is the question's normalised embedding, if there is one."""
+        self.metrics['searches'] += 1
+        turns = len(self._texts) - exclude_last
+        if turns <= 0 or k <= 0:
+            return []
+        scores = {}
+
+        ids, keyword_scores = self._keyword_scores(keywords(question), len(self._texts))
+        keep = ids < turns
+        ids, keyword_scores = ids[keep], keyword_scores[keep]
+        if len(ids):
+            top = _top(keyword_scores, candidates)
+            best = keyword_scores[top[0]]
+            for turn, score in zip(ids[top].tolist(), keyword_scores[top].tolist()):
+                scores[turn] = score / best
+
+        embedded = min(self.embedded, turns)
+        if vector is not None and embedded and vector.shape[0] == self._dim:
+            # Similarity to the newest turns, and to older keyword candidates
+            start = max(0, embedded - self.vector_window)
+            similarity = self._vectors[start:embedded] @ vector
+            for index in _top(similarity, candidates).tolist():
+                if similarity[index] >= self.min_similarity:
+                    scores.setdefault(start + index, 0.0)
+            older = [turn for turn in scores if turn < embedded]
+            if older:
+                for turn, value in zip(older, (self._vectors[older] @ vector).tolist()):
+                    if value >= self.min_similarity:
+                        scores[turn] += value
+
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        self.metrics['results'] += len(best)
+        return [self._texts[turn] for turn in sorted(best)]
+
+    async def wait_for_embeddings(self):
+        """Wait for background embedding to catch up (used in benchmarks)."""
+        if self._embed_task is not None:
+            await asyncio.gather(self._embed_task, return_exceptions=True)
+
+    def close(self):
+        """Synchronously write any turns still buffered. Safe to call outside the event loop."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._buffer_lines:
+            lines, self._buffer_lines = self._buffer_lines, []
+            self._write_lines(lines)
+
+    def stats(self):
+        return {**self.metrics, 'stored': len(self._texts), 'words': len(self._postings),
+                'embedded_turns': self.embedded}
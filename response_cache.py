@@ -0,0 +1,127 @@
+import time
+
+import numpy as np
+
+
+class SemanticCache:
+    """Reuses answers to questions that mean the same thing, e.g. "what game is this" / "which game is this?".
+
+    Questions are embedded with `embed`, an async callable returning a vector.
+    Embeddings are stored normalised, one row per entry, in a preallocated NumPy
+    matrix, so a lookup is a single matrix-vector product over the live rows.
+    A cached answer is used when its question has a cosine similarity of at least
+    `threshold`, it was stored under the same stream category, and it is younger
+    than `ttl` seconds. When full, the least recently used entry is replaced.
+    """
+
+    def __init__(self, embed, threshold=0.9, ttl=300, max_size=512):
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._vectors = None  # Allocated once the embedding size is known
+        self._created = np.zeros(max_size)
+        self._last_used = np.full(max_size, -np.inf)  # -inf marks a free slot
+        self._categories = np.full(max_size, -1)  # Category ids, see _category_id
+        self._category_ids = {}  # Any hashable, e.g. (channel, stream category)
+        self._next_category_id = 0
+        self._answers = [None] * max_size
+        self._costs = np.zeros(max_size)  # Seconds it took to produce each answer
+
+        self.metrics = {
+            'lookups': 0,
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'seconds_saved': 0.0,
+            'embed_seconds': 0.0,
+        }
+
+    def __len__(self):
+        return int(np.isfinite(self._last_used).sum())
+
+    async def embedding(self, text):
+        """Embed and normalise a question."""
+        start = time.monotonic()
+        vector = np.asarray(await self.embed(text), dtype=np.float32)
+        self.metrics['embed_seconds'] += time.monotonic() - start
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _category_id(self, category):
+        if category not in self._category_ids:
+            self._category_ids[category] = self._next_category_id
+            self._next_category_id += 1
+        return self._category_ids[category]
+
+    def lookup(self, vector, category):
+        """Return the cached answer closest to `vector` in this category, or None."""
+        self.metrics['lookups'] += 1
+        if self._vectors is None or vector.shape[0] != self._vectors.shape[1]:
+            self.metrics['misses'] += 1
+            return None
+
+        now = time.monotonic()
+        live = np.isfinite(self._last_used) & (self._created > now - self.ttl)
+        live &= self._categories == self._category_id(category)
+        if not live.any():
+            self.metrics['misses'] += 1
+            return None
+
+        similarity = np.where(live, self._vectors @ vector, -1.0)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            self.metrics['misses'] += 1
+            return None
+
+        self._last_used[best] = now
+        self.metrics['hits'] += 1
+        self.metrics['seconds_saved'] += self._costs[best]
+        return self._answers[best]
+
+    def store(self, vector, category, answer, cost=0.0):
+        """Cache an answer. `cost` is how long it took to produce, counted as saved on every hit."""
+        if self._vectors is None or vector.shape[0] != self._vectors.shape[1]:
+            self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            self._last_used[:] = -np.inf
+
+        now = time.monotonic()
+        expired = self._created <= now - self.ttl
+        # Free or expired slots first, otherwise the least recently used one
+        slot = int(np.argmin(np.where(expired, -np.inf, self._last_used)))
+        if np.isfinite(self._last_used[slot]) and not expired[slot]:
+            self.metrics['evictions'] += 1
+
+        self._vectors[slot] = vector
+        self._created[slot] = now
+        self._last_used[slot] = now
+        self._categories[slot] = self._category_id(category)
+        self._answers[slot] = answer
+        self._costs[slot] = cost
+        self.metrics['stores'] += 1
+
+    def invalidate(self, category=None):
+        """Forget the cached answers for one category, or every cached answer, e.g. when the stream category changes."""
+        self.metrics['invalidations'] += 1
+        if category is not None:
+            if category not in self._category_ids:
+                return
+            stale = self._categories == self._category_ids.pop(category)
+            self._last_used[stale] = -np.inf
+            self._categories[stale] = -1
+            for slot in np.flatnonzero(stale):
+                self._answers[slot] = None
+            return
+        self._last_used[:] = -np.inf
+        self._answers = [None] * self.max_size
+        self._categories[:] = -1
+        self._category_ids.clear()
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['entries'] = len(self)
+        stats['hit_rate'] = stats['hits'] / stats['lookups'] if stats['lookups'] else 0.0
+        return stats
@@ -0,0 +1,340 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from cache import normalize_text
+
+# Priority lanes, served lowest number first
+PRIORITY_BROADCASTER = 0
+PRIORITY_MOD = 1
+PRIORITY_SUPPORTER = 2  # Subscribers and VIPs
+PRIORITY_VIEWER = 3
+PRIORITY_LANES = (PRIORITY_BROADCASTER, PRIORITY_MOD, PRIORITY_SUPPORTER, PRIORITY_VIEWER)
+
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_REJECT = 'reject'
+
+# Results of WorkScheduler.submit
+ACCEPTED = 'accepted'
+COALESCED = 'coalesced'
+RATE_LIMITED = 'rate_limited'
+BUSY = 'busy'
+
+
+class Job:
+    """A queued !ai request. Coalesced duplicates add their users to the same job."""
+
+    def __init__(self, key, text, user, priority, payload=None, channel=None):
+        self.key = key
+        self.text = text
+        self.users = [user]
+        self.priority = priority
+        self.payload = payload
+        self.channel = channel
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    @property
+    def queue_wait(self):
+        if self.started_at is None:
+            return time.monotonic() - self.enqueued_at
+        return self.started_at - self.enqueued_at
+
+
+class TokenBucket:
+    """Rate limit: `burst` actions (e.g. a user's requests), refilled at one every `refill_seconds`."""
+
+    def __init__(self, burst, refill_seconds):
+        self.burst = burst
+        self.refill_seconds = refill_seconds
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.refill_seconds > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.refill_seconds)
+        else:
+            self.tokens = self.burst
+        self.updated = now
+
+    def take(self):
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def full(self):
+        """Whether the bucket has refilled completely, so a new one would be no different."""
+        self._refill()
+        return self.tokens >= self.burst
+
+    def wait_time(self):
+        """Seconds until take() will succeed."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) * self.refill_seconds)
+
+
+class WorkScheduler:
+    """Bounded priority queue between on_message and the LLM.
+
+    `handler` is awaited with each Job by one of `workers` worker tasks. The queue
+    holds at most `max_queue` jobs across all lanes; once full, `policy` decides
+    whether a job of equal or lower priority is dropped to make room (drop-oldest)
+    or the new request is turned away (reject). Identical pending questions are
+    merged into one job, and each user may only submit `user_burst` requests per
+    `user_refill_seconds`.
+
+    Within a lane, each channel has its own queue and the channels take turns, so
+    one busy channel can't starve the others; when a job has to be dropped, it is
+    the oldest job of the channel with the most queued.
+
+    With a `batch_handler`, a worker that takes a job also takes up to
+    `max_batch` - 1 more from the same channel, waiting up to `batch_window`
+    seconds for them to arrive, and awaits batch_handler with the list. No job is
+    held back more than `max_batch_wait` seconds from being queued to waiting for
+    a batch.
+    """
+
+    def __init__(self, handler, workers=2, max_queue=20, policy=POLICY_DROP_OLDEST,
+                 user_burst=2, user_refill_seconds=15, batch_handler=None, max_batch=4,
+                 batch_window=0.0, max_batch_wait=1.0):
+        if policy not in (POLICY_DROP_OLDEST, POLICY_REJECT):
+            raise ValueError(f"Unknown overload policy: {policy}")
+        self.handler = handler
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self.user_burst = user_burst
+        self.user_refill_seconds = user_refill_seconds
+        self.batch_handler = batch_handler
+        self.max_batch = max_batch if batch_handler else 1
+        self.batch_window = batch_window
+        self.max_batch_wait = max_batch_wait
+
+        self._lanes = {lane: OrderedDict() for lane in PRIORITY_LANES}  # Channel -> deque, in turn order
+        self._size = 0
+        self._pending = {}  # Coalescing key -> queued Job
+        self._buckets = {}  # (channel, user) -> TokenBucket, for users who asked recently
+        self._swept_at = time.monotonic()
+        self._wakeup = None
+        self._workers = []
+        self._collecting = {}  # Channel -> (batch being gathered, event set when a job joins it)
+
+        self.metrics = {
+            'submitted': 0,
+            'accepted': 0,
+            'coalesced': 0,
+            'rate_limited': 0,
+            'rejected_busy': 0,
+            'dropped': 0,
+            'completed': 0,
+            'failed': 0,
+            'batches': 0,
+            'batched_jobs': 0,
+            'max_depth': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+        }
+
+    def __len__(self):
+        return self._size
+
+    def queued(self, channel):
+        """Number of jobs waiting for one channel."""
+        return sum(len(lane.get(channel, ())) for lane in self._lanes.values())
+
+    def start(self):
+        """Start the worker tasks. Must be called from the running event loop."""
+        self._wakeup = asyncio.Condition()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for lane in self._lanes.values():
+            for queue in lane.values():
+                for job in queue:
+                    job.done.cancel()
+            lane.clear()
+        self._size = 0
+        self._pending.clear()
+
+    def _rate_limited(self, user):
+        # A bucket idle long enough to refill completely is forgotten; a new one starts out full anyway
+        now = time.monotonic()
+        if now - self._swept_at >= max(self.user_burst * self.user_refill_seconds, 1):
+            self._buckets = {key: bucket for key, bucket in self._buckets.items() if not bucket.full()}
+            self._swept_at = now
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            bucket = self._buckets[user] = TokenBucket(self.user_burst, self.user_refill_seconds)
+        return not bucket.take()
+
+    def _pop(self, lane, channel):
+        queue = self._lanes[lane][channel]
+        job = queue.popleft()
+        if queue:
+            self._lanes[lane].move_to_end(channel)
+        else:
+            del self._lanes[lane][channel]
+        self._size -= 1
+        self._pending.pop(job.key, None)
+        return job
+
+    def _drop_oldest(self, priority):
+        """Drop the oldest job of the busiest channel at or below `priority`, lowest lane first.
+
+        Returns False if there is none."""
+        for lane in reversed(PRIORITY_LANES):
+            if lane < priority:
+                break
+            if self._lanes[lane]:
+                queues = self._lanes[lane]
+                channel = max(queues, key=lambda name: (len(queues[name]), -queues[name][0].enqueued_at))
+                job = self._pop(lane, channel)
+                job.done.cancel()
+                self.metrics['dropped'] += len(job.users)
+                print(f"Dropped queued request from {', '.join(job.users)} to make room")
+                return True
+        return False
+
+    async def submit(self, user, text, priority=PRIORITY_VIEWER, payload=None, key=None, channel=None):
+        """Queue a request. Returns (status, job), where job is None unless accepted or coalesced."""
+        self.metrics['submitted'] += 1
+        key = (channel, normalize_text(text)) if key is None else key
+
+        if self._rate_limited((channel, user)):
+            self.metrics['rate_limited'] += 1
+            return RATE_LIMITED, None
+
+        job = self._pending.get(key)
+        if job is not None:
+            if user not in job.users:
+                job.users.append(user)
+            self.metrics['coalesced'] += 1
+            return COALESCED, job
+
+        # A worker waiting to fill a batch for this channel takes the job straight away
+        collecting = self._collecting.get(channel)
+        if collecting and len(collecting[0]) < self.max_batch:
+            batch, arrived = collecting
+            job = Job(key, text, user, priority, payload, channel)
+            batch.append(job)
+            self._pending[key] = job
+            self.metrics['accepted'] += 1
+            arrived.set()
+            return ACCEPTED, job
+
+        if len(self) >= self.max_queue:
+            if self.policy == POLICY_REJECT or not self._drop_oldest(priority):
+                self.metrics['rejected_busy'] += 1
+                return BUSY, None
+
+        job = Job(key, text, user, priority, payload, channel)
+        queue = self._lanes[priority].get(channel)
+        if queue is None:
+            queue = self._lanes[priority][channel] = deque()
+        queue.append(job)
+        self._size += 1
+        self._pending[key] = job
+        self.metrics['accepted'] += 1
+        self.metrics['max_depth'] = max(self.metrics['max_depth'], len(self))
+        async with self._wakeup:
+            self._wakeup.notify()
+        return ACCEPTED, job
+
+    def _next_job(self):
+        for lane in PRIORITY_LANES:
+            if self._lanes[lane]:
+                # The channel at the front has waited longest for a turn
+                return self._pop(lane, next(iter(self._lanes[lane])))
+        return None
+
+    def _take(self, channel, count):
+        """Take up to `count` queued jobs for one channel, highest priority first."""
+        jobs = []
+        for lane in PRIORITY_LANES:
+            while len(jobs) < count and channel in self._lanes[lane]:
+                jobs.append(self._pop(lane, channel))
+        return jobs
+
+    async def _gather_batch(self, job):
+        """Collect more jobs for the same channel as `job` into a batch."""
+        batch = [job] + self._take(job.channel, self.max_batch - 1)
+        # Jobs in the batch can still have duplicates merged into them until it is handled
+        for queued in batch:
+            self._pending[queued.key] = queued
+        oldest = min(queued.enqueued_at for queued in batch)
+        deadline = min(time.monotonic() + self.batch_window, oldest + self.max_batch_wait)
+        # Only one worker at a time waits for more of a channel's jobs
+        if len(batch) < self.max_batch and deadline > time.monotonic() and job.channel not in self._collecting:
+            arrived = asyncio.Event()
+            self._collecting[job.channel] = (batch, arrived)
+            try:
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    arrived.clear()
+                    try:
+                        await asyncio.wait_for(arrived.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+            finally:
+                del self._collecting[job.channel]
+        for queued in batch:
+            self._pending.pop(queued.key, None)
+        return batch
+
+    async def _worker(self):
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(lambda: len(self) > 0)
+                job = self._next_job()
+            batch = [job]
+            try:
+                if self.max_batch > 1:
+                    batch = await self._gather_batch(job)
+                started_at = time.monotonic()
+                for queued in batch:
+                    queued.started_at = started_at
+                    wait = queued.queue_wait
+                    self.metrics['queue_wait_total'] += wait
+                    self.metrics['queue_wait_max'] = max(self.metrics['queue_wait_max'], wait)
+                if len(batch) > 1:
+                    self.metrics['batches'] += 1
+                    self.metrics['batched_jobs'] += len(batch)
+                    result = await self.batch_handler(batch)
+                else:
+                    result = await self.handler(job)
+            except asyncio.CancelledError:
+                for queued in batch:
+                    queued.done.cancel()
+                raise
+            except Exception as e:
+                print(f"Error handling request from {', '.join(user for queued in batch for user in queued.users)}: {e}")
+                self.metrics['failed'] += len(batch)
+                for queued in batch:
+                    if not queued.done.done():
+                        queued.done.set_exception(e)
+                        # Nobody is required to await the future, so don't warn about it
+                        queued.done.exception()
+            else:
+                self.metrics['completed'] += len(batch)
+                for queued in batch:
+                    if not queued.done.done():
+                        queued.done.set_result(result)
+
+    def stats(self):
+        stats = dict(self.metrics)
+        started = stats['completed'] + stats['failed']
+        stats['queue_depth'] = len(self)
+        stats['rate_limit_buckets'] = len(self._buckets)
+        stats['queue_wait_avg'] = stats['queue_wait_total'] / started if started else 0.0
+        stats['batch_size_avg'] = stats['batched_jobs'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
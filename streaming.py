@@ -0,0 +1,150 @@
+import asyncio
+import re
+import time
+
+TWITCH_MESSAGE_LIMIT = 500  # Maximum characters in one Twitch chat message
+
+# End of a sentence: closing punctuation (plus any closing quotes/brackets) followed by whitespace, or a newline
+SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s+|\n+")
+
+
+def _cut_point(text, limit):
+    """Index to cut `text` at so the first part fits in `limit`: the last sentence end, else the last space."""
+    best = 0
+    for match in SENTENCE_END.finditer(text, 0, limit + 1):
+        best = match.end()
+    if best:
+        return best
+    space = text.rfind(' ', 0, limit + 1)
+    return space + 1 if space > 0 else limit
+
+
+def split_message(text, limit=TWITCH_MESSAGE_LIMIT):
+    """Split text into chat-sized pieces, preferring sentence boundaries."""
+    parts = []
+    text = text.strip()
+    while len(text) > limit:
+        cut = _cut_point(text, limit)
+        parts.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+class SentenceChunker:
+    """Turns streamed text into chat-sized chunks that end on sentence boundaries.
+
+    The first complete sentence is released straight away so a reply starts
+    appearing quickly; after that, sentences are grouped until a chunk is at least
+    `min_length` characters so chat isn't flooded with one-liners.
+    """
+
+    def __init__(self, max_length=TWITCH_MESSAGE_LIMIT, min_length=120):
+        self.max_length = max_length
+        self.min_length = min_length
+        self._buffer = ""
+        self._emitted = 0
+
+    def feed(self, text):
+        """Add streamed text and return any chunks that are now complete."""
+        self._buffer += text
+        chunks = []
+        while self._buffer:
+            if len(self._buffer) > self.max_length:
+                cut = _cut_point(self._buffer, self.max_length)
+            else:
+                cut = 0
+                for match in SENTENCE_END.finditer(self._buffer):
+                    cut = match.end()
+                if not cut or (self._emitted and cut < self.min_length):
+                    break
+            chunk, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:]
+            if chunk:
+                chunks.append(chunk)
+                self._emitted += 1
+        return chunks
+
+    def flush(self):
+        """Return whatever is left once the stream has ended."""
+        chunks = split_message(self._buffer, self.max_length)
+        self._buffer = ""
+        self._emitted += len(chunks)
+        return chunks
+
+
+class ChunkedReply:
+    """Checks and sends a streamed reply chunk by chunk while generation continues.
+
+    Chunks are queued by feed() and handled in order by a background task that
+    runs `check(chunk)` and, if it passes, `send(chunk)`, waiting at least
+    `min_interval` seconds between messages. The first rejected chunk stops the
+    reply; nothing after it is sent. `prefix` (e.g. @mentions) is added to the
+    first message.
+    """
+
+    def __init__(self, check, send, prefix="", started_at=None, min_interval=1.0, clean=None):
+        self.check = check
+        self.send = send
+        self.prefix = prefix
+        self.clean = clean or (lambda chunk: chunk)
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.min_interval = min_interval
+
+        limit = TWITCH_MESSAGE_LIMIT - (len(prefix) + 1 if prefix else 0)
+        self._chunker = SentenceChunker(max_length=limit)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._deliver())
+        self._last_sent = 0
+
+        self.sent = []
+        self.rejected = False
+        self.first_message_at = None
+
+    @property
+    def time_to_first_message(self):
+        if self.first_message_at is None:
+            return None
+        return self.first_message_at - self.started_at
+
+    def feed(self, text):
+        if self.rejected:
+            return
+        for chunk in self._chunker.feed(text):
+            self._queue.put_nowait(chunk)
+
+    async def _deliver(self):
+        while True:
+            chunk = await self._queue.get()
+            if chunk is None:
+                return
+            chunk = self.clean(chunk).strip()
+            if not chunk:
+                continue
+            if not await self.check(chunk):
+                self.rejected = True
+                return
+            wait = self._last_sent + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            text = f"{self.prefix} {chunk}" if self.prefix and not self.sent else chunk
+            await self.send(text)
+            self._last_sent = time.monotonic()
+            if self.first_message_at is None:
+                self.first_message_at = self._last_sent
+            self.sent.append(chunk)
+
+    async def finish(self, flush=True):
+        """Wait for delivery to finish and return the text that was sent.
+
+        With flush=False (e.g. after a timeout) any unfinished sentence is dropped instead of sent."""
+        if flush and not self.rejected:
+            for chunk in self._chunker.flush():
+                self._queue.put_nowait(chunk)
+        self._queue.put_nowait(None)
+        await self._task
+        return " ".join(self.sent)
+
+    async def cancel(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
@@ -0,0 +1,129 @@
+import os
+import re
+import time
+
+# The variables a prompt template can use; see docs/VARIABLES.md
+VARIABLES = ('bot_name', 'streamer_name', 'channel_name', 'current_category', 'stream_title')
+# Variables with the same value in every channel
+SHARED_VARIABLES = ('bot_name',)
+
+_TOKEN = re.compile(r"\{\{|\}\}|\{(\w+)\}")
+
+
+def _parse(text, unknown):
+    """Compile template text into a list of literal strings and variable names (as 1-tuples)."""
+    parts = []
+    literal = []
+    position = 0
+    for match in _TOKEN.finditer(text):
+        literal.append(text[position:match.start()])
+        position = match.end()
+        name = match.group(1)
+        if name is None:
+            literal.append(match.group()[0])  # {{ or }}
+        elif name in VARIABLES:
+            parts.append(''.join(literal))
+            parts.append((name,))
+            literal = []
+        else:
+            unknown.add(name)
+            literal.append(match.group())
+    literal.append(text[position:])
+    parts.append(''.join(literal))
+    return [part for part in parts if part != '']
+
+
+def _render(parts, values):
+    return ''.join(part if isinstance(part, str) else str(values.get(part[0], '{' + part[0] + '}'))
+                   for part in parts)
+
+
+def _uses_channel_variables(line):
+    return any(match.group(1) in VARIABLES and match.group(1) not in SHARED_VARIABLES
+               for match in _TOKEN.finditer(line))
+
+
+class PromptTemplate:
+    """A system prompt template, compiled once and rendered with safe variable substitution.
+
+    `{name}` is replaced by the value of one of VARIABLES. Values are inserted as they
+    are and never parsed again, and any other braces (JSON examples, unknown names) are
+    left alone; `{{` and `}}` still give single braces, as with str.format.
+
+    The template is kept in two sections. The static one runs up to the first line
+    using a per-channel variable; it is rendered once per bot name and reused for every
+    call and every channel, so all channels' prompts start with the same text. Only the
+    dynamic section after it is rendered again, e.g. when a channel's category changes.
+
+    Given a `path`, the file is loaded straight away and reload() reads it again only
+    if its modification time has changed, checking at most every `check_interval` seconds.
+    """
+
+    def __init__(self, text='', path=None, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.loaded = False
+        self._mtime = None
+        self._checked = 0.0
+        self._error = None
+        self.metrics = {'loads': 0, 'renders': 0, 'static_reused': 0}
+        self._compile(text)
+        if path:
+            self.reload(force=True)
+
+    def _compile(self, text):
+        lines = text.splitlines(keepends=True)
+        split = next((index for index, line in enumerate(lines) if _uses_channel_variables(line)), len(lines))
+        unknown = set()
+        self._static = _parse(''.join(lines[:split]), unknown)
+        self._dynamic = _parse(''.join(lines[split:]), unknown)
+        self._static_cache = {}  # Shared variable values -> rendered static section
+        if unknown:
+            print(f"Unknown prompt template variables left as written: {', '.join(sorted(unknown))}")
+
+    def reload(self, force=False):
+        """Load the file again if it was modified since it was last loaded. Returns True if the template changed.
+
+        If the file can't be read, the last template that loaded is kept."""
+        if not self.path:
+            return False
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            with open(self.path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except OSError as e:
+            if str(e) != self._error:  # Only once while the file stays unreadable
+                print(f"Error loading prompt template {self.path}: {e}")
+                self._error = str(e)
+            return False
+        self._error = None
+        self._mtime = mtime
+        self._compile(text)
+        self.loaded = True
+        self.metrics['loads'] += 1
+        print(f"Loaded prompt template {self.path}")
+        return True
+
+    def static_prefix(self, **values):
+        """The rendered static section, which every prompt rendered with the same shared values starts with."""
+        shared = tuple(values.get(name) for name in SHARED_VARIABLES)
+        static = self._static_cache.get(shared)
+        if static is None:
+            static = self._static_cache[shared] = _render(self._static, values)
+        else:
+            self.metrics['static_reused'] += 1
+        return static
+
+    def render(self, **values):
+        """The prompt with each variable replaced by its value. Variables not given are left as written."""
+        self.metrics['renders'] += 1
+        return self.static_prefix(**values) + _render(self._dynamic, values)
+
+    def stats(self):
+        return dict(self.metrics)
@@ -0,0 +1,138 @@
+import asyncio
+import inspect
+
+from duckduckgo_search import AsyncDDGS
+
+from cache import TTLCache, normalize_text
+
+
+def tool(description, parameters=None, required=(), timeout=10, name=None):
+    """Mark a method as a tool the model may call.
+
+    `parameters` maps each argument name to its JSON schema, e.g.
+    {'query': {'type': 'string', 'description': '...'}}. Calls that take longer
+    than `timeout` seconds are cancelled.
+    """
+    def decorate(func):
+        func.tool_spec = {
+            'name': name or func.__name__,
+            'description': description,
+            'parameters': parameters or {},
+            'required': list(required),
+            'timeout': timeout,
+        }
+        return func
+    return decorate
+
+
+class ToolRegistry:
+    """The tools defined on an object with @tool, their schemas, and a way to run calls to them."""
+
+    def __init__(self, owner):
+        self._tools = {}
+        # Walk the class hierarchy base-first so tools keep their definition order
+        for cls in reversed(type(owner).__mro__):
+            for attribute, value in vars(cls).items():
+                spec = getattr(value, 'tool_spec', None)
+                if spec is not None:
+                    self._tools[spec['name']] = (spec, getattr(owner, attribute))
+        self._schemas = [self._schema(spec) for spec, _ in self._tools.values()]
+        self.metrics = {'calls': 0, 'timeouts': 0, 'errors': 0, 'unknown': 0}
+
+    @staticmethod
+    def _schema(spec):
+        return {
+            'type': 'function',
+            'function': {
+                'name': spec['name'],
+                'description': spec['description'],
+                'parameters': {
+                    'type': 'object',
+                    'properties': spec['parameters'],
+                    'required': spec['required'],
+                },
+            }
+        }
+
+    def schemas(self):
+        """Tool definitions in the format Ollama expects. The same list is returned every time."""
+        return self._schemas
+
+    def __contains__(self, name):
+        return name in self._tools
+
+    async def _call(self, tool_call):
+        name = tool_call['function']['name']
+        self.metrics['calls'] += 1
+        if name not in self._tools:
+            self.metrics['unknown'] += 1
+            return f"Tool {name} does not exist."
+        spec, func = self._tools[name]
+        arguments = tool_call['function'].get('arguments') or {}
+        accepted = inspect.signature(func).parameters
+        kwargs = {key: value for key, value in arguments.items() if key in accepted}
+        try:
+            result = await asyncio.wait_for(func(**kwargs), spec['timeout'])
+        except asyncio.TimeoutError:
+            print(f"Tool {name} timed out")
+            self.metrics['timeouts'] += 1
+            return f"Tool {name} timed out after {spec['timeout']} seconds."
+        except Exception as e:
+            print(f"Error running tool {name}: {e}")
+            self.metrics['errors'] += 1
+            return f"Tool {name} returned an error: {e}"
+        if result is None or result == '':
+            return f"Tool {name} was used."
+        if isinstance(result, list):
+            return f"Tool {name} returned {len(result)} results. Results: {result}"
+        return f"Tool {name} returned {result}"
+
+    def stats(self):
+        return dict(self.metrics)
+
+    async def run(self, tool_calls):
+        """Run tool calls concurrently and return one tool message per call, in call order."""
+        results = await asyncio.gather(*(self._call(tool_call) for tool_call in tool_calls))
+        return [{'role': 'tool', 'content': content} for content in results]
+
+
+class SearchClient:
+    """Internet search through one shared backend, with results cached per normalized query.
+
+    `backend` is any object with an async `atext(query, max_results=...)` method;
+    by default a DuckDuckGo AsyncDDGS instance is created on first use. Identical
+    searches already in flight share one request.
+    """
+
+    def __init__(self, backend=None, max_results=3, ttl=600, cache_size=256):
+        self._backend = backend
+        self.max_results = max_results
+        self.cache = TTLCache(max_size=cache_size, ttl=ttl)
+        self._in_flight = {}
+        self.requests = 0
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = AsyncDDGS()
+        return self._backend
+
+    async def text(self, query):
+        key = normalize_text(query)
+        results = self.cache.get(key)
+        if results is not None:
+            return results
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(self._search(query, key))
+        # Shielded so a caller timing out doesn't cancel the search for everyone else
+        return await asyncio.shield(task)
+
+    async def _search(self, query, key):
+        self.requests += 1
+        try:
+            results = await self.backend.atext(query, max_results=self.max_results)
+            self.cache.put(key, results)
+            return results
+        finally:
+            self._in_flight.pop(key, None)
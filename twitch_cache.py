@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import time
+
+
+def batches(items, size=100):
+    """Split a list into lists of at most `size` items, the most Twitch's API accepts per request."""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+class TwitchCache:
+    """Twitch user ids and stream status, kept between reconnects and restarts so Helix is only asked about what isn't known.
+
+    User ids are reused for `user_ttl` seconds and stream status (live, category, title)
+    for `stream_ttl`. EventSub events update the status as it changes (see update_stream);
+    once a streamer's events are being received (see watch), a status updated since then
+    stays valid however old it is, so rejoining chat costs no requests at all.
+
+    Entries are timestamped with wall clock time and, given a `path`, loaded from it at
+    startup and saved to it by a background thread `save_delay` seconds after they change,
+    together with any other changes by then; close() saves what is left. If the API can't
+    be reached, expired entries are used rather than nothing.
+    """
+
+    USER_TTL = 7 * 24 * 3600  # Seconds a user id is reused; ids never change, but logins can be renamed
+    STREAM_TTL = 300  # Seconds a stream status is reused without EventSub keeping it up to date
+    SAVE_DELAY = 2.0  # Seconds a change waits to be saved, so a burst of events is written once
+
+    def __init__(self, api=None, path=None, user_ttl=USER_TTL, stream_ttl=STREAM_TTL, save_delay=SAVE_DELAY):
+        self.api = api  # twitchAPI's Twitch client, set once authenticated
+        self.path = path
+        self.user_ttl = user_ttl
+        self.stream_ttl = stream_ttl
+        self.save_delay = save_delay
+        self._save_handle = None
+        self._save_task = None
+        self._lock = None
+        self._users = {}  # Lower-case login -> {'id', 'name', 'updated'}
+        self._streams = {}  # Lower-case login -> {'live', 'category', 'title', 'updated'}
+        self._watched = {}  # Lower-case login -> time its EventSub subscriptions were made
+        self.metrics = {'hits': 0, 'misses': 0, 'api_requests': 0, 'api_errors': 0, 'events': 0, 'saves': 0}
+        if path:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._users = data.get('users', {})
+            self._streams = data.get('streams', {})
+            print(f"Loaded {len(self._users)} Twitch users and {len(self._streams)} streams from {self.path}")
+        except (OSError, ValueError) as e:
+            print(f"Error loading Twitch cache {self.path}: {e}")
+
+    def save_later(self):
+        """Save the cache in a background thread after `save_delay` seconds, or now outside the event loop."""
+        if not self.path or self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._encode())
+            return
+        self._save_handle = loop.call_later(self.save_delay, self._start_save)
+
+    def _start_save(self):
+        self._save_task = asyncio.get_running_loop().create_task(self.save())
+
+    async def save(self):
+        """Write the cache in a background thread."""
+        self._save_handle = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await asyncio.to_thread(self._write, self._encode())
+
+    def close(self):
+        """Synchronously write any changes still waiting to be saved. Safe to call outside the event loop."""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+            self._write(self._encode())
+
+    def _encode(self):
+        return json.dumps({'users': self._users, 'streams': self._streams}, ensure_ascii=False)
+
+    def _write(self, text):
+        """Write the cache to a temporary file that atomically replaces the old one."""
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, self.path)
+            self.metrics['saves'] += 1
+        except OSError as e:
+            print(f"Error saving Twitch cache {self.path}: {e}")
+
+    def _fresh(self, login, entry, ttl):
+        if entry is None or entry.get('live', False) is None:  # Only partly known from events
+            return False
+        watched = self._watched.get(login)
+        if watched is not None and entry['updated'] >= watched:
+            return True
+        return time.time() - entry['updated'] < ttl
+
+    def _missing(self, logins, entries, ttl):
+        missing = [login for login in logins if not self._fresh(login, entries.get(login), ttl)]
+        self.metrics['hits'] += len(logins) - len(missing)
+        self.metrics['misses'] += len(missing)
+        return missing
+
+    async def user_ids(self, logins):
+        """Twitch user ids by lower-case login, asking the API only about logins not cached. Unknown logins are left out."""
+        logins = [login.lower() for login in logins]
+        missing = self._missing(logins, self._users, self.user_ttl)
+        if missing:
+            try:
+                now = time.time()
+                for batch in batches(missing):
+                    self.metrics['api_requests'] += 1
+                    async for user in self.api.get_users(logins=batch):
+                        self._users[user.login.lower()] = {'id': user.id, 'name': user.display_name, 'updated': now}
+            except Exception as e:
+                self.metrics['api_errors'] += 1
+                print(f"Could not look up Twitch users: {e}")
+            self.save_later()
+        return {login: self._users[login]['id'] for login in logins if login in self._users}
+
+    async def stream_info(self, logins):
+        """Stream status by lower-case login, asking the API only about streams not cached.
+
+        Each status is a dict with `live`, `category` and `title`. Logins with no status
+        at all (the API failed and nothing was cached) are left out."""
+        logins = [login.lower() for login in logins]
+        missing = self._missing(logins, self._streams, self.stream_ttl)
+        if missing:
+            try:
+                live = {}
+                for batch in batches(missing):
+                    self.metrics['api_requests'] += 1
+                    async for stream in self.api.get_streams(user_login=batch, first=len(batch)):
+                        live[stream.user_login.lower()] = stream
+                # Only live streams are returned; the rest are offline, keeping their last category and title
+                for login in missing:
+                    stream = live.get(login)
+                    if stream:
+                        self._update(login, live=True, category=stream.game_name, title=stream.title)
+                    else:
+                        self._update(login, live=False)
+            except Exception as e:
+                self.metrics['api_errors'] += 1
+                print(f"Could not fetch stream status from Twitch: {e}")
+            self.save_later()
+        return {login: self.stream(login) for login in logins if login in self._streams}
+
+    def stream(self, login):
+        """The cached status of a stream, however old, or None."""
+        entry = self._streams.get(login.lower())
+        return dict(entry) if entry else None
+
+    def _update(self, login, **fields):
+        entry = self._streams.setdefault(login.lower(), {'live': None, 'category': None, 'title': None})
+        entry.update(fields)
+        entry['updated'] = time.time()
+
+    def update_stream(self, login, **fields):
+        """Record what an EventSub event says about a stream (`live`, `category` and/or `title`)."""
+        self.metrics['events'] += 1
+        self._update(login, **fields)
+        self.save_later()
+
+    def watch(self, login):
+        """Note that EventSub events for this streamer are now being received, keeping its status current."""
+        self._watched[login.lower()] = time.time()
+
+    def stats(self):
+        return {**self.metrics, 'users': len(self._users), 'streams': len(self._streams), 'watched': len(self._watched)}
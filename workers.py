@@ -0,0 +1,275 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+
+from metrics import NULL_TRACE, Trace
+
+# Longest line either side may send: a request carries the whole prompt
+MESSAGE_LIMIT = 16 * 2 ** 20
+
+
+class WorkerError(Exception):
+    """No worker process could answer a request."""
+
+
+def _encode(message):
+    return (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class _Connection:
+    __slots__ = ('pid', 'reader', 'writer', 'pending', 'completed')
+
+    def __init__(self, pid, reader, writer):
+        self.pid = pid
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}  # Request id -> future of the response
+        self.completed = 0
+
+
+class WorkerPool:
+    """Worker processes that generate and check replies for the front process, over a Unix socket.
+
+    The front process keeps the Twitch connections, the queue and every channel's
+    history. For each question it sends a worker the messages to answer; the
+    worker runs the model, any tools and the message check, and sends back the
+    reply and the tool results, which only the front process adds to the history.
+
+    `command` starts one worker, with `--worker-socket PATH` appended (see
+    serve). Each request goes to the worker with the fewest in flight, and is
+    retried once on another if its worker dies; dead workers are started again.
+    """
+
+    RESTART_DELAY = 1.0  # Seconds before a worker that exited is started again
+
+    def __init__(self, command, processes, timeout=120):
+        self.command = list(command)
+        self.processes = processes
+        self.timeout = timeout
+
+        self._directory = None
+        self.path = None
+        self._server = None
+        self._procs = {}  # Pid -> asyncio.subprocess.Process
+        self._watchers = set()
+        self._connections = []
+        self._connected = None
+        self._next_id = 0
+        self._stopping = False
+
+        self.metrics = {'requests': 0, 'completed': 0, 'failed': 0, 'retried': 0, 'restarts': 0}
+
+    async def start(self, timeout=30):
+        """Start the workers and wait (up to `timeout` seconds) for them to connect."""
+        self._stopping = False
+        self._directory = tempfile.mkdtemp(prefix='twitch-llm-')
+        self.path = os.path.join(self._directory, 'workers.sock')
+        self._connected = asyncio.Event()
+        self._server = await asyncio.start_unix_server(self._on_connect, path=self.path, limit=MESSAGE_LIMIT)
+        for _ in range(self.processes):
+            await self._spawn()
+        try:
+            await asyncio.wait_for(self._all_connected(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Only {len(self._connections)} of {self.processes} worker processes started")
+        else:
+            print(f"Started {self.processes} worker processes")
+
+    async def _all_connected(self):
+        while len(self._connections) < self.processes:
+            self._connected.clear()
+            await self._connected.wait()
+
+    async def _spawn(self):
+        proc = await asyncio.create_subprocess_exec(*self.command, '--worker-socket', self.path)
+        self._procs[proc.pid] = proc
+        watcher = asyncio.create_task(self._watch(proc))
+        self._watchers.add(watcher)
+        watcher.add_done_callback(self._watchers.discard)
+
+    async def _watch(self, proc):
+        code = await proc.wait()
+        self._procs.pop(proc.pid, None)
+        if self._stopping:
+            return
+        print(f"Worker process {proc.pid} exited with status {code}, starting another")
+        self.metrics['restarts'] += 1
+        await asyncio.sleep(self.RESTART_DELAY)
+        if not self._stopping:
+            await self._spawn()
+
+    async def _on_connect(self, reader, writer):
+        try:
+            hello = json.loads(await reader.readline())
+        except ValueError:
+            writer.close()
+            return
+        connection = _Connection(hello['pid'], reader, writer)
+        self._connections.append(connection)
+        self._connected.set()
+        try:
+            while line := await reader.readline():
+                response = json.loads(line)
+                future = connection.pending.pop(response['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (ConnectionError, ValueError) as e:
+            print(f"Lost worker process {connection.pid}: {e}")
+        finally:
+            self._connections.remove(connection)
+            for future in connection.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"worker process {connection.pid} went away"))
+            connection.pending.clear()
+            writer.close()
+
+    async def _request(self, connection, request, timeout):
+        self._next_id += 1
+        request['id'] = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        connection.pending[request['id']] = future
+        try:
+            connection.writer.write(_encode(request))
+            await connection.writer.drain()
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        finally:
+            connection.pending.pop(request['id'], None)
+
+    async def generate_reply(self, messages, trace=NULL_TRACE, timeout=None):
+        """A worker's checked reply to `messages`, as (text, tool messages); see Bot._generate_reply.
+
+        The worker's stage timings and token counts are added to `trace`. Raises
+        WorkerError if no worker is running, the request failed twice or no reply came
+        within `timeout` seconds (by default the pool's), retries included."""
+        self.metrics['requests'] += 1
+        deadline = time.monotonic() + (self.timeout if timeout is None else min(timeout, self.timeout))
+        tried = set()
+        for _ in range(2):
+            candidates = [connection for connection in self._connections if connection.pid not in tried]
+            if not candidates:
+                break
+            connection = min(candidates, key=lambda connection: len(connection.pending))
+            tried.add(connection.pid)
+            try:
+                response = await self._request(connection, {'messages': messages}, deadline - time.monotonic())
+            except ConnectionError:
+                self.metrics['retried'] += 1
+                continue
+            except asyncio.TimeoutError:
+                break
+            if 'error' in response:
+                break
+            connection.completed += 1
+            self.metrics['completed'] += 1
+            for stage, seconds in response['stages'].items():
+                trace.add(stage, seconds)
+            trace.count(**response['counts'])
+            return response['text'], response['tool_messages']
+        self.metrics['failed'] += 1
+        raise WorkerError(f"no reply from {len(tried)} worker process(es)" if tried else "no worker process is running")
+
+    async def stop(self, timeout=5):
+        """Close the connections, which makes the workers exit, stopping any that don't."""
+        self._stopping = True
+        for watcher in list(self._watchers):
+            watcher.cancel()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for connection in list(self._connections):
+            connection.writer.close()
+        for proc in list(self._procs.values()):
+            try:
+                await asyncio.wait_for(proc.wait(), timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        self._procs.clear()
+        if self._directory:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def stats(self):
+        return {**self.metrics, 'processes': len(self._connections),
+                'in_flight': sum(len(connection.pending) for connection in self._connections)}
+
+
+async def serve(generate, path):
+    """Run in a worker process: answer requests from the WorkerPool listening at `path` until it closes.
+
+    `generate(messages, trace)` returns the reply and tool messages (see Bot._generate_reply).
+    Requests are answered concurrently, as they come."""
+    reader, writer = await asyncio.open_unix_connection(path, limit=MESSAGE_LIMIT)
+    writer.write(_encode({'pid': os.getpid()}))
+    tasks = set()
+
+    async def answer(request):
+        trace = Trace()
+        try:
+            text, tool_messages = await generate(request['messages'], trace)
+            response = {'id': request['id'], 'text': text, 'tool_messages': tool_messages, 'stages': trace.stages,
+                        'counts': {name: value for name, value in trace.fields.items()
+                                   if isinstance(value, (int, float))}}
+        except Exception as e:
+            print(f"Error answering a request from the front process: {e}")
+            response = {'id': request['id'], 'error': str(e)}
+        writer.write(_encode(response))
+        await writer.drain()
+
+    try:
+        while line := await reader.readline():
+            task = asyncio.create_task(answer(json.loads(line)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        writer.close()
+
+
+class ReplyOrder:
+    """Lets each channel's replies be sent in the order their questions were taken from the queue.
+
+    Take a turn when starting on a question, wait for it before sending the reply,
+    and release it once done (also when failing), letting the next reply go."""
+
+    def __init__(self):
+        self._lines = {}  # Channel -> deque of asyncio.Event, one per question still being answered, in order
+        self.metrics = {'waited': 0, 'wait_seconds': 0.0, 'skipped': 0}
+
+    def take(self, channel):
+        line = self._lines.setdefault(channel, deque())
+        turn = asyncio.Event()
+        if not line:
+            turn.set()
+        line.append(turn)
+        return turn
+
+    async def wait(self, turn, timeout):
+        """Wait until every earlier reply in the channel is done, or `timeout` seconds, whichever is sooner."""
+        if turn.is_set():
+            return
+        start = time.monotonic()
+        self.metrics['waited'] += 1
+        try:
+            await asyncio.wait_for(turn.wait(), max(0.0, timeout))
+        except asyncio.TimeoutError:
+            self.metrics['skipped'] += 1  # Sent out of order rather than not at all
+        self.metrics['wait_seconds'] += time.monotonic() - start
+
+    def release(self, channel, turn):
+        line = self._lines[channel]
+        first = line[0] is turn
+        line.remove(turn)
+        if not line:
+            del self._lines[channel]
+        elif first:
+            line[0].set()
+
+    def stats(self):
+        return {**self.metrics, 'waiting': sum(len(line) - 1 for line in self._lines.values())}